@@ -0,0 +1,235 @@
+"""An in-process index of hostnames for answering regular expression searches.
+
+Scanning every hostname attribute in clusto for each get_hosts_by_regex call
+gets slower as the fleet grows.  Instead, HostnameIndex keeps every hostname in
+memory along with two indexes:
+
+* a sorted list of lowercased hostnames, for regexes anchored with a literal
+  prefix (e.g. ^sim12)
+* a trigram index, for regexes that contain literal text anywhere (e.g.
+  agni\.lindenlab)
+
+Literal text that every match must contain is pulled out of the regex with
+sre_parse.  Only hostnames that contain all of it are checked against the full
+regular expression.  Regexes without any usable literal text fall back to
+checking every hostname, which is still much cheaper than going to the
+database.
+
+The index is rebuilt when clusto's version number changes (see
+jinx_api.api.versioning), and at most JINX_HOSTNAME_INDEX_MAX_AGE seconds after
+it was built.
+"""
+
+import array
+import bisect
+import re
+import sre_constants
+import sre_parse
+import threading
+import time
+import clusto
+from django.conf import settings
+from jinx_api.api.versioning import get_clusto_version
+
+# The smallest string that sorts after every string starting with a given
+# prefix is prefix + _MAX_CHAR.
+_MAX_CHAR = u'\U0010ffff'
+
+def _literal_char(code):
+    if code < 128:
+        return chr(code)
+    else:
+        return unichr(code)
+
+def _collect_literals(subpattern, literals):
+    """Add each run of literal text in a parsed regex to literals.
+
+    Only text that any match must contain is collected: the contents of
+    branches, character classes, and optional repeats are skipped.
+    """
+
+    run = []
+
+    for op, av in subpattern:
+        if op == sre_constants.LITERAL:
+            run.append(_literal_char(av))
+            continue
+
+        if run:
+            literals.append(''.join(run))
+            run = []
+
+        if op == sre_constants.SUBPATTERN:
+            _collect_literals(av[-1], literals)
+        elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT):
+            min_repeat, max_repeat, repeated = av
+
+            if min_repeat > 0:
+                _collect_literals(repeated, literals)
+
+    if run:
+        literals.append(''.join(run))
+
+def extract_literals(regex, flags=0):
+    """Find the literal text that every match of a regular expression contains.
+
+    Returns a tuple of (prefix, literals).  prefix is the literal text that
+    a match must start the string with, or None if the regex isn't anchored
+    that way.  literals is a list of literal strings each match must contain
+    somewhere.  Everything is lowercased, because the index is
+    case-insensitive.
+    """
+
+    parsed = sre_parse.parse(regex, flags)
+    items = list(parsed)
+
+    prefix = None
+
+    if items and items[0][0] == sre_constants.AT:
+        anchor = items[0][1]
+
+        # With re.M, ^ can match after any newline, not just at the start.
+        if anchor == sre_constants.AT_BEGINNING_STRING or \
+            (anchor == sre_constants.AT_BEGINNING and not flags & re.M):
+            prefix_chars = []
+
+            for op, av in items[1:]:
+                if op != sre_constants.LITERAL:
+                    break
+                prefix_chars.append(_literal_char(av))
+
+            if prefix_chars:
+                prefix = ''.join(prefix_chars).lower()
+
+    literals = []
+    _collect_literals(items, literals)
+
+    return prefix, [literal.lower() for literal in literals]
+
+def _trigrams(text):
+    return set(text[i:i + 3] for i in xrange(len(text) - 2))
+
+
+class HostnameIndex(object):
+    """A searchable in-memory copy of every hostname in clusto."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._built_at = None
+
+        # A tuple of (hostnames, lowered, trigrams):
+        #
+        # hostnames -- all hostnames, sorted case-insensitively, with duplicates
+        # lowered -- the lowercased version of each entry in hostnames
+        # trigrams -- maps each trigram to an array of positions in hostnames
+        #
+        # It's replaced as a whole when the index is rebuilt, so a search that
+        # is already running keeps a consistent view.
+        self._snapshot = ([], [], {})
+
+    def invalidate(self):
+        """Force the index to be rebuilt the next time it's used."""
+
+        self._lock.acquire()
+        try:
+            self._version = None
+        finally:
+            self._lock.release()
+
+    def refresh(self):
+        """Rebuild the index if clusto has changed since it was built."""
+
+        version = get_clusto_version()
+        max_age = getattr(settings, 'JINX_HOSTNAME_INDEX_MAX_AGE', None)
+
+        self._lock.acquire()
+        try:
+            if version == self._version and \
+                (max_age is None or time.time() - self._built_at < max_age):
+                return
+
+            # I could start off with clusto.get_entities(attrs={'subkey': 'hostname'}),
+            # but that would be slow because it would load every single host's full
+            # attribute list.  Using do_attr_query only fetches the hostname
+            # attributes.
+
+            hostname_attrs = clusto.drivers.Driver.do_attr_query(subkey='hostname')
+
+            hostnames = [attr.value for attr in hostname_attrs if attr.value is not None]
+            hostnames.sort(key=lambda hostname: hostname.lower())
+
+            lowered = [hostname.lower() for hostname in hostnames]
+            trigrams = {}
+
+            for position, hostname in enumerate(lowered):
+                for trigram in _trigrams(hostname):
+                    if trigram not in trigrams:
+                        trigrams[trigram] = array.array('l')
+                    trigrams[trigram].append(position)
+
+            self._snapshot = (hostnames, lowered, trigrams)
+            self._version = version
+            self._built_at = time.time()
+        finally:
+            self._lock.release()
+
+    def _candidates(self, lowered, trigram_index, prefix, literals):
+        """Return the positions of the hostnames that could match.
+
+        Returns None if every hostname is a candidate.
+        """
+
+        candidates = None
+
+        if prefix is not None:
+            start = bisect.bisect_left(lowered, prefix)
+            end = bisect.bisect_left(lowered, prefix + _MAX_CHAR)
+
+            candidates = set(xrange(start, end))
+
+        trigrams = set()
+
+        for literal in literals:
+            trigrams.update(_trigrams(literal))
+
+        # Intersect the smallest lists first, so the candidate set shrinks fast.
+        for postings in sorted((trigram_index.get(trigram, ()) for trigram in trigrams), key=len):
+            if candidates is None:
+                candidates = set(postings)
+            else:
+                candidates.intersection_update(postings)
+
+            if not candidates:
+                break
+
+        return candidates
+
+    def search(self, host_re):
+        """Return an iterator over the hostnames that host_re.search() matches.
+
+        The index is brought up to date right away, but matching happens as
+        the iterator is consumed.
+
+        Arguments:
+            host_re -- A compiled regular expression.
+        """
+
+        self.refresh()
+
+        hostnames, lowered, trigram_index = self._snapshot
+
+        try:
+            prefix, literals = extract_literals(host_re.pattern, host_re.flags)
+        except (sre_constants.error, OverflowError, RuntimeError):
+            prefix, literals = None, []
+
+        candidates = self._candidates(lowered, trigram_index, prefix, literals)
+
+        if candidates is None:
+            return (hostname for hostname in hostnames if host_re.search(hostname))
+        else:
+            return (hostnames[position] for position in sorted(candidates)
+                    if host_re.search(hostnames[position]))
+
+hostname_index = HostnameIndex()
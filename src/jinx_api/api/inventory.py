@@ -0,0 +1,550 @@
+"""Set-based loading of clusto data for calls that cover many hosts at once.
+
+Going through clusto's drivers costs several queries per host: every
+attribute lookup, port lookup and parents() call is its own SELECT.  That's
+fine for one host but takes minutes for a whole rack.  An InventorySnapshot
+loads the entities, attributes and containment links for a set of hosts in a
+handful of queries (one per level of the containment tree, plus a few more),
+and then answers questions about them from memory.
+
+The snapshot only reads the attribute table directly, so it has to know how
+attributes are laid out:
+
+    hostname        subkey 'hostname'
+    serial number   subkey 'serial_number'
+    MAC address     port key for 'nic-eth', subkey 'mac', number = port number
+    power port      port key for 'pwr-nema-5', subkey 'connection' (the PDU)
+                    and 'otherportnum' (the PDU's port), number = port number
+    containment     key '_contains' on the parent, relating to the child;
+                    racks keep the rack unit in number
+    host state      containment in a HostState entity named after the state
+
+Port keys come from the driver's _port_key(), the same as clusto's PortMixin
+uses to store them.
+"""
+
+import re
+import clusto
+import llclusto
+from clusto.drivers.base import Driver
+from clusto.schema import Attribute, Entity, and_, func
+from sqlalchemy.orm import aliased
+
+# Databases limit how many values an IN clause may have (sqlite's default is
+# 999), so larger sets are queried in chunks of this size.
+IN_CHUNK_SIZE = 500
+
+MAC_RE = re.compile(r'[0-9a-f]{2}:[0-9a-f]{2}:[0-9a-f]{2}:[0-9a-f]{2}:[0-9a-f]{2}:[0-9a-f]{2}', re.I)
+
+
+def _query_in(query, column, values):
+    """Run query once per chunk of values, filtered on column IN (chunk)."""
+
+    values = list(values)
+    results = []
+
+    for start in xrange(0, len(values), IN_CHUNK_SIZE):
+        results.extend(query.filter(column.in_(values[start:start + IN_CHUNK_SIZE])).all())
+
+    return results
+
+
+def _driver_names(driver_class):
+    """Return the names of driver_class and all of its subclasses, as stored in Entity.driver."""
+
+    return [driver_name for driver_name, entity_driver_class in clusto.DRIVERLIST.iteritems()
+            if issubclass(entity_driver_class, driver_class)]
+
+
+def hostnames_in(entity_id, after=None, limit=None):
+    """Return a query for the hostnames of the things an entity (like a HostState) contains.
+
+    The containment links are joined straight to the hostname attributes, so
+    no entities or drivers are loaded.  Hostnames come out sorted, as
+    1-tuples.
+
+    Arguments:
+        entity_id -- The ID of the containing entity.
+        after -- optional; only return hostnames sorting after this one.
+        limit -- optional; return at most this many hostnames.
+    """
+
+    contains = aliased(Attribute)
+    hostname = aliased(Attribute)
+
+    # Attribute.query() leaves out deleted attributes; the same conditions
+    # have to be applied to both aliases by hand.
+    current = Attribute._version_args.im_func
+
+    query = clusto.SESSION.query(hostname.string_value).filter(
+        and_(contains.entity_id == entity_id,
+             contains.key == u'_contains',
+             hostname.entity_id == contains.relation_id,
+             hostname.subkey == u'hostname',
+             *(current(contains) + current(hostname))))
+
+    return _sorted_page(query, hostname.string_value, after, limit)
+
+def hostnames_of(driver_class, after=None, limit=None):
+    """Return a query for the hostnames of all entities whose driver is driver_class or a subclass of it.
+
+    Hostnames of "missing" are left out.  Hostnames come out sorted, as
+    1-tuples; after and limit work as they do for hostnames_in().
+    """
+
+    query = clusto.SESSION.query(Attribute.string_value).filter(
+        and_(Attribute.subkey == u'hostname',
+             func.lower(Attribute.string_value) != u'missing',
+             Attribute.entity_id == Entity.entity_id,
+             Entity.driver.in_(_driver_names(driver_class)),
+             *(Attribute._version_args() + Entity._version_args())))
+
+    return _sorted_page(query, Attribute.string_value, after, limit)
+
+def _sorted_page(query, column, after, limit):
+    if after is not None:
+        query = query.filter(column > after)
+
+    query = query.order_by(column)
+
+    if limit is not None:
+        query = query.limit(limit)
+
+    return query
+
+
+class InventorySnapshot(object):
+    """An in-memory copy of the clusto data about a set of hosts.
+
+    Create one, add hosts to it with find_hosts() or find_hosts_in(), then
+    call load() once before reading their remote hands information.  Rack
+    contents are loaded separately, with load_contents().
+    """
+
+    def __init__(self):
+        self.host_ids = []
+
+        self._entities = {}      # entity_id -> Entity
+        self._attrs = {}         # entity_id -> [Attribute, ...]
+        self._parent_links = {}  # entity_id -> [(parent entity_id, number), ...]
+
+    def find_hosts(self, hostnames_or_macs):
+        """Add hosts to the snapshot by hostname or MAC address.
+
+        Returns a dict mapping each of hostnames_or_macs to the list of entity
+        IDs it matched.  Like get_host_remote_hands_info, anything that looks
+        like a MAC address is tried as one first, then as a hostname.
+        """
+
+        matches = dict((name, []) for name in hostnames_or_macs)
+
+        macs = [name for name in matches if MAC_RE.match(name)]
+
+        if macs:
+            query = Attribute.query().filter(Attribute.subkey == u'mac')
+
+            for attr in _query_in(query, Attribute.string_value, macs):
+                if attr.string_value in matches:
+                    matches[attr.string_value].append(attr.entity_id)
+
+        hostnames = [name for name in matches if not matches[name]]
+
+        if hostnames:
+            query = Attribute.query().filter(Attribute.subkey == u'hostname')
+
+            for attr in _query_in(query, Attribute.string_value, hostnames):
+                if attr.string_value in matches:
+                    matches[attr.string_value].append(attr.entity_id)
+
+        for entity_ids in matches.itervalues():
+            self._add_hosts(entity_ids)
+
+        return matches
+
+    def find_racks(self, names):
+        """Look up racks by name, all at once.
+
+        Returns a dict mapping each of names that's the name of a rack to the
+        rack's entity ID.
+        """
+
+        query = Entity.query().filter(Entity.driver.in_(_driver_names(clusto.drivers.BasicRack)))
+        rack_ids = {}
+
+        for entity in _query_in(query, Entity.name, set(unicode(name) for name in names)):
+            self._entities[entity.entity_id] = entity
+            rack_ids[entity.name] = entity.entity_id
+
+        # With a case-insensitive collation (MySQL's default), the database
+        # can match a name given in another case.
+        lowered = dict((name.lower(), rack_id) for name, rack_id in rack_ids.iteritems())
+        found = {}
+
+        for name in names:
+            rack_id = rack_ids.get(name, lowered.get(name.lower()))
+
+            if rack_id is not None:
+                found[name] = rack_id
+
+        return found
+
+    def find_hosts_in(self, entity_id):
+        """Add everything with a hostname inside an entity (like a rack) to the snapshot.
+
+        Returns the entity IDs of the hosts found.
+        """
+
+        contents = set()
+        level = set([entity_id])
+
+        while level:
+            query = Attribute.query().filter(Attribute.key == u'_contains')
+            children = set(attr.relation_id for attr in _query_in(query, Attribute.entity_id, level))
+
+            # Guard against containment loops.
+            level = children - contents
+            contents.update(level)
+
+        query = Attribute.query().filter(Attribute.subkey == u'hostname')
+        host_ids = sorted(set(attr.entity_id for attr in _query_in(query, Attribute.entity_id, contents)))
+
+        self._add_hosts(host_ids)
+
+        return host_ids
+
+    def _add_hosts(self, entity_ids):
+        for entity_id in entity_ids:
+            if entity_id not in self.host_ids:
+                self.host_ids.append(entity_id)
+
+    def load(self):
+        """Load everything needed to describe the hosts found so far."""
+
+        self._load_ancestors(self.host_ids)
+
+        # Servers in a chassis get their power through the chassis, so the
+        # chassis' attributes are needed too.
+        wanted = set(self.host_ids)
+        wanted.update(filter(None, [self.get_chassis(host_id) for host_id in self.host_ids]))
+        self._load_attrs(wanted)
+
+        pdu_ids = set()
+
+        for entity_id in wanted:
+            power_key = self._port_key(entity_id, 'pwr-nema-5')
+
+            if power_key is None:
+                continue
+
+            for attr in self._attrs.get(entity_id, ()):
+                if attr.key == power_key and attr.subkey == u'connection' and attr.relation_id is not None:
+                    pdu_ids.add(attr.relation_id)
+
+        self._load_entities(pdu_ids)
+
+        # Only the PDUs' hostnames are needed, not all their attributes.
+        query = Attribute.query().filter(Attribute.subkey == u'hostname')
+
+        for pdu_id in pdu_ids:
+            self._attrs.setdefault(pdu_id, [])
+
+        for attr in _query_in(query, Attribute.entity_id, pdu_ids - wanted):
+            self._attrs[attr.entity_id].append(attr)
+
+    def load_contents(self, entity_ids):
+        """Load the devices in each of entity_ids (usually racks) and their hostnames and serial numbers.
+
+        Devices in a chassis are listed instead of the chassis, like
+        get_rack_contents does.  Takes the same few queries for any number
+        of racks.
+
+        Returns a dict mapping each of entity_ids to a list of device IDs.
+        """
+
+        children = self._load_children(entity_ids)
+        self._load_entities(set(sum(children.values(), [])))
+
+        chassis_ids = [child_id for child_id in set(sum(children.values(), []))
+                       if self.is_instance(child_id, llclusto.drivers.Class7Chassis)]
+        chassis_contents = self._load_children(chassis_ids)
+        self._load_entities(set(sum(chassis_contents.values(), [])))
+
+        contents = {}
+
+        for entity_id in entity_ids:
+            contents[entity_id] = []
+
+            for child_id in children[entity_id]:
+                if child_id in chassis_contents:
+                    contents[entity_id].extend(chassis_contents[child_id])
+                else:
+                    contents[entity_id].append(child_id)
+
+        self._load_attrs(set(sum(contents.values(), [])), subkeys=(u'hostname', u'serial_number'))
+
+        return contents
+
+    def load_states(self, entity_ids):
+        """Load the host states of entity_ids, in a single query.
+
+        Returns a dict mapping each of entity_ids to the name of its state,
+        or to None if it has none.
+        """
+
+        # Join each containment link to the state entity holding it, to get
+        # just the state names rather than whole entities.
+        query = clusto.SESSION.query(Attribute.relation_id, Entity.name).filter(
+            and_(Attribute.key == u'_contains',
+                 Attribute.entity_id == Entity.entity_id,
+                 Entity.driver.in_(_driver_names(llclusto.drivers.HostState)),
+                 *(Attribute._version_args() + Entity._version_args())))
+
+        states = dict((entity_id, None) for entity_id in entity_ids)
+
+        for entity_id, state in _query_in(query, Attribute.relation_id, entity_ids):
+            states[entity_id] = state
+
+        return states
+
+    def load_hostnames(self, entity_ids, clusto_types=None):
+        """Load the hostnames of entity_ids, optionally only those of some clusto types.
+
+        Returns a dict mapping entity IDs to hostnames, leaving out entities
+        without one (or of other types).
+        """
+
+        self._load_entities(entity_ids)
+
+        if clusto_types is not None:
+            entity_ids = [entity_id for entity_id in entity_ids if self._entities[entity_id].type in clusto_types]
+
+        self._load_attrs(entity_ids, subkeys=(u'hostname',))
+
+        hostnames = {}
+
+        for entity_id in entity_ids:
+            hostname = self.get_attr(entity_id, u'hostname')
+
+            if hostname is not None:
+                hostnames[entity_id] = hostname
+
+        return hostnames
+
+    def get_driver(self, entity_id):
+        """Return a clusto driver for an entity, for making changes to it."""
+
+        self._load_entities([entity_id])
+
+        return Driver(self._entities[entity_id])
+
+    def _load_children(self, entity_ids):
+        children = dict((entity_id, set()) for entity_id in entity_ids)
+        query = Attribute.query().filter(Attribute.key == u'_contains')
+
+        for attr in _query_in(query, Attribute.entity_id, children):
+            children[attr.entity_id].add(attr.relation_id)
+
+        # A device taking up several rack units has one link per unit.
+        return dict((entity_id, sorted(child_ids)) for entity_id, child_ids in children.iteritems())
+
+    def _load_ancestors(self, entity_ids):
+        seen = set(entity_ids)
+        level = set(entity_ids)
+
+        while level:
+            query = Attribute.query().filter(Attribute.key == u'_contains')
+            parents = set()
+
+            for attr in _query_in(query, Attribute.relation_id, level):
+                self._parent_links.setdefault(attr.relation_id, []).append((attr.entity_id, attr.number))
+                parents.add(attr.entity_id)
+
+            level = parents - seen
+            seen.update(level)
+
+        self._load_entities(seen)
+
+    def _load_entities(self, entity_ids):
+        missing = [entity_id for entity_id in entity_ids if entity_id not in self._entities]
+
+        for entity in _query_in(Entity.query(), Entity.entity_id, missing):
+            self._entities[entity.entity_id] = entity
+
+    def _load_attrs(self, entity_ids, subkeys=None):
+        # When subkeys is given, only those attributes are loaded, and the
+        # entities' other attributes will look like they don't exist.
+        missing = [entity_id for entity_id in entity_ids if entity_id not in self._attrs]
+
+        for entity_id in missing:
+            self._attrs[entity_id] = []
+
+        query = Attribute.query()
+
+        if subkeys is not None:
+            query = query.filter(Attribute.subkey.in_(list(subkeys)))
+
+        for attr in _query_in(query, Attribute.entity_id, missing):
+            self._attrs[attr.entity_id].append(attr)
+
+    def _driver_class(self, entity_id):
+        entity = self._entities.get(entity_id)
+
+        if entity is None:
+            return None
+
+        return clusto.DRIVERLIST.get(entity.driver)
+
+    def is_instance(self, entity_id, driver_class):
+        """Return whether an entity's driver is driver_class or a subclass of it."""
+
+        entity_driver_class = self._driver_class(entity_id)
+
+        return entity_driver_class is not None and issubclass(entity_driver_class, driver_class)
+
+    def _numports(self, entity_id, porttype):
+        portmeta = getattr(self._driver_class(entity_id), '_portmeta', {})
+
+        if porttype not in portmeta:
+            return None
+
+        return portmeta[porttype]['numports']
+
+    def _port_key(self, entity_id, porttype):
+        """Return the attribute key an entity's driver stores a port type's attributes under, or None if it has no ports."""
+
+        entity_driver_class = self._driver_class(entity_id)
+
+        if entity_driver_class is None or not hasattr(entity_driver_class, '_port_key'):
+            return None
+
+        # _port_key() doesn't look at the driver instance, and there's no
+        # making one here without going back to the database for it.
+        return unicode(entity_driver_class._port_key.im_func(None, porttype))
+
+    def get_attr(self, entity_id, subkey, key=None, number=None):
+        """Return the value of an entity's attribute, or None if it doesn't have it.
+
+        Relations are returned as the related entity's ID.
+        """
+
+        for attr in self._attrs.get(entity_id, ()):
+            if attr.subkey == subkey and (key is None or attr.key == key) and attr.number == number:
+                if attr.relation_id is not None:
+                    return attr.relation_id
+
+                return attr.value
+
+        return None
+
+    def get_chassis(self, entity_id):
+        """Return the ID of the chassis an entity is in, or None."""
+
+        for parent_id, number in self._parent_links.get(entity_id, ()):
+            if self.is_instance(parent_id, llclusto.drivers.LindenServerChassis):
+                return parent_id
+
+        return None
+
+    def get_rack_and_u(self, entity_id):
+        """Return (rack entity ID, sorted list of rack units) for an entity, or None."""
+
+        for parent_id, number in self._parent_links.get(entity_id, ()):
+            if self._entities[parent_id].type == 'rack':
+                positions = sorted(number for link_parent_id, number in self._parent_links[entity_id]
+                                   if link_parent_id == parent_id)
+                return parent_id, positions
+
+        return None
+
+    def get_datacenter(self, entity_id):
+        """Return the ID of the nearest datacenter containing an entity, or None."""
+
+        seen = set()
+        level = [entity_id]
+
+        while level:
+            next_level = []
+
+            for child_id in level:
+                for parent_id, number in self._parent_links.get(child_id, ()):
+                    if self._entities[parent_id].type == 'datacenter':
+                        return parent_id
+
+                    if parent_id not in seen:
+                        seen.add(parent_id)
+                        next_level.append(parent_id)
+
+            level = next_level
+
+        return None
+
+    def get_device_info(self, entity_id):
+        """Return the same dict as get_rack_contents does for a device."""
+
+        device_info = {'hostname': self.get_attr(entity_id, u'hostname'),
+                       'serial_number': self.get_attr(entity_id, u'serial_number')}
+
+        if self.is_instance(entity_id, llclusto.drivers.LindenServer):
+            device_info['type'] = 'server'
+        elif self.is_instance(entity_id, llclusto.drivers.LindenPDU):
+            device_info['type'] = 'pdu'
+        elif self.is_instance(entity_id, llclusto.drivers.LindenSwitch):
+            device_info['type'] = 'switch'
+
+        return device_info
+
+    def get_remote_hands_info(self, entity_id):
+        """Return the same dict as the get_host_remote_hands_info API call."""
+
+        info = {}
+
+        info['hostname'] = self.get_attr(entity_id, u'hostname')
+
+        info['macs'] = []
+
+        for port_num in xrange(1, (self._numports(entity_id, 'nic-eth') or 0) + 1):
+            info['macs'].append(self.get_attr(entity_id, u'mac', self._port_key(entity_id, 'nic-eth'), port_num))
+
+        # If the host doesn't have power connections, maybe it's a class 7 in a chassis.
+        power_source = entity_id
+
+        if self._numports(entity_id, 'pwr-nema-5') is None:
+            power_source = self.get_chassis(entity_id)
+
+        info['pdu_connections'] = []
+
+        power_key = self._port_key(power_source, 'pwr-nema-5')
+
+        for port_num in xrange(1, (self._numports(power_source, 'pwr-nema-5') or 0) + 1):
+            pdu_id = self.get_attr(power_source, u'connection', power_key, port_num)
+
+            if pdu_id is not None:
+                info['pdu_connections'].append({'pdu': self.get_attr(pdu_id, u'hostname'),
+                                                'port': self.get_attr(power_source, u'otherportnum', power_key, port_num)})
+
+        info['serial_number'] = self.get_attr(entity_id, u'serial_number')
+
+        datacenter_id = self.get_datacenter(entity_id)
+
+        if datacenter_id is not None:
+            info['colo'] = self._entities[datacenter_id].name.upper()
+        else:
+            info['colo'] = None
+
+        location = self.get_rack_and_u(entity_id)
+
+        # Try the chassis instead
+        if location is None:
+            chassis_id = self.get_chassis(entity_id)
+
+            if chassis_id is not None:
+                location = self.get_rack_and_u(chassis_id)
+
+        if location is not None:
+            info['rack'] = self._entities[location[0]].name
+            info['positions'] = location[1]
+        else:
+            info['rack'] = None
+            info['positions'] = None
+
+        return info
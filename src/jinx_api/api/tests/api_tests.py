@@ -1,8 +1,32 @@
 from django.test import TestCase
+from django.conf import settings
 from django.http import HttpResponseNotFound, HttpResponseServerError
 from django.conf.urls.defaults import patterns, include
+from django.core.urlresolvers import Resolver404, get_resolver
+from django.core.exceptions import ImproperlyConfigured
+from django.core.handlers.wsgi import WSGIHandler
+from api.tests.base import JinxTestCase
+from jinx_api import authorization
+from jinx_api import changes as change_log
+from jinx_api.dispatch import CallDispatcher
+from jinx_api.fixtures import Fixture
+from llclusto.drivers import Class5Server, HostState, ServerClass
+from jinx_api import metrics
+from jinx_api import serialization
+from jinx_api import mpack
+from jinx_api import warmup
+from jinx_api import pagination
+from jinx_api.middleware import QueryBudgetExceeded
+from jinx_api.registry import paginated, query_budget
+from jinx_api.workers import WorkerPool
+import logging
+import os
 import simplejson
+import tempfile
+import threading
+import time
 import views
+import zlib
 
 # First, define a urlconf and some views that will be used to test only the
 # API middleware, not the real Jinx API call functions.
@@ -10,11 +34,23 @@ import views
 urlpatterns = patterns('api.tests.api_tests',
     (r'test_view_normal', 'test_view_normal'),
     (r'test_view_exception', 'test_view_exception'),
+    (r'test_view_type_error', 'test_view_type_error'),
     (r'test_view_not_found', 'test_view_not_found_response'),
     (r'test_view_echo', 'test_view_echo'),
     (r'test_view_reverse_three_arguments', 'test_view_reverse_three_arguments'),
     (r'test_view_one_default_argument', 'test_view_one_default_argument'),
     (r'test_doc', 'test_doc'),
+    (r'test_view_generator', 'test_view_generator'),
+    (r'test_view_generator_exception', 'test_view_generator_exception'),
+    (r'test_view_cached_counter', 'test_view_cached_counter'),
+    (r'test_view_reset_counter', 'test_view_reset_counter'),
+    (r'test_view_paginated', 'test_view_paginated'),
+    (r'test_view_streamed_queries', 'test_view_streamed_queries'),
+    (r'test_view_queries', 'test_view_queries'),
+)
+
+urlpatterns += patterns('',
+    (r'^metrics$', 'api.views.meta.metrics'),
 )
 
 
@@ -29,6 +65,11 @@ def test_view_exception(request):
     # Raises AttributeError
     None.foo
 
+def test_view_type_error(request, arg):
+    """Raise a TypeError from inside the view, to mimic a view with a bug."""
+    
+    return arg + 1
+    
 def test_view_not_found_response(request):
     """Return a 404 response to mimic requesting data that doesn't exist from an API call."""
     
@@ -49,6 +90,58 @@ def test_view_one_default_argument(request, arg="default"):
     
     return arg
     
+def test_view_generator(request, count):
+    """Return a generator to exercise streaming of list-like responses."""
+    
+    return ("item%d" % i for i in xrange(count))
+    
+def test_view_generator_exception(request):
+    """Return a generator that fails as soon as it's consumed."""
+    
+    return (None.foo for i in xrange(1))
+    
+_counter = [0]
+
+def test_view_cached_counter(request, *args):
+    """Return a number that goes up each time the view is actually called, to test result caching."""
+    
+    _counter[0] += 1
+    return _counter[0]
+    
+def test_view_reset_counter(request):
+    """Reset the counter, to test invalidation of cached results."""
+    
+    _counter[0] = 0
+    
+@paginated((int, long))
+def test_view_paginated(request, count):
+    """Return a list of count items, leaving pagination to the middleware."""
+    
+    return ["item%03d" % i for i in xrange(count)]
+    
+def _run_queries(count):
+    # Count statements the way the instrumented engine does, without needing
+    # a database.
+    for i in xrange(count):
+        metrics._record_query(0.0, "SELECT name FROM entities WHERE entity_id = ?")
+    
+@query_budget(3)
+def test_view_queries(request, count):
+    """Run count SQL statements, against a budget of 3."""
+    
+    _run_queries(count)
+    return count
+    
+@query_budget(3)
+def test_view_streamed_queries(request, count):
+    """Return a generator that runs count SQL statements as it's consumed."""
+    
+    def results():
+        _run_queries(count)
+        yield count
+    
+    return results()
+    
 def test_doc(request, arg1, arg2=3):
     """Test fetching of documentation strings.
     
@@ -60,6 +153,21 @@ def test_doc(request, arg1, arg2=3):
     pass
     
 
+class UnavailableCodec(serialization.JSONCodec):
+    """A codec whose library is never installed, to test falling back."""
+    
+    def __init__(self):
+        raise serialization.CodecUnavailable("not installed")
+
+class SlowCodec(serialization.StdlibJSONCodec):
+    """A codec that's installed but has no speedups, to test preferring ones that do."""
+    
+    name = 'slow'
+    
+    def __init__(self):
+        super(SlowCodec, self).__init__()
+        self.accelerated = False
+
 # Django's default 404 and 500 handlers want templates, 404.html and 500.html.
 # I define new handlers here that don't care about templates.
     
@@ -138,6 +246,16 @@ class JinxAPITests(TestCase):
         response = self._post_json('/test_view_exception', [])
         self._assert_call_status_code(response, 500, 'Should get HTTP 500 when view throws an unhandled exception')
     
+    def test_call_type_error(self):
+        response = self._post_json('/test_view_type_error', ["not a number"])
+        self._assert_call_status_code(response, 500,
+            'Should get HTTP 500 when a view raises TypeError, even though TypeError is also raised for bad arguments')
+        
+        response = self._post_json('/test_view_type_error', [])
+        self._assert_call_status_code(response, 400,
+            'Should get HTTP 400 when a view is called with the wrong number of arguments')
+        self.assertEqual(response.content, "test_view_type_error() takes exactly 1 argument (0 given)")
+    
     def test_call_404(self):
         response = self._post_json('/test_view_not_found_response', [])
         self._assert_call_status_code(response, 404, 
@@ -186,6 +304,50 @@ class JinxAPITests(TestCase):
         self._assert_call_status_code(response, 400, 
             '/test_view_one_default_argument with 2 arguments should result in HTTP 400.')
     
+    def test_streaming(self):
+        response = self._post_json('/test_view_generator', [0])
+        self._assert_api_status_code(response, 200, '/test_view_generator should return HTTP 200.')
+        self.assertEqual(response['Content-Type'], "application/json")
+        self.assertEqual(simplejson.loads(response.content), [])
+        
+        response = self._post_json('/test_view_generator', [2500])
+        self._assert_api_status_code(response, 200, '/test_view_generator should return HTTP 200.')
+        self.assertEqual(simplejson.loads(response.content), ["item%d" % i for i in xrange(2500)],
+            "A generator returned by a view should be sent as a JSON array")
+        
+        response = self._post_json('/test_view_generator_exception', [])
+        self._assert_call_status_code(response, 500,
+            'Should get HTTP 500 when a generator returned by a view fails right away')
+    
+    def test_pagination(self):
+        response = self._post_json("/test_view_paginated", [5])
+        self._assert_api_status_code(response, 200, "Unpaginated calls should work as usual")
+        self.assertEqual(len(simplejson.loads(response.content)), 5)
+        
+        items = []
+        cursor = ""
+        
+        for page in xrange(3):
+            response = self._post_json("/test_view_paginated?page_size=2&cursor=%s" % cursor, [5])
+            self._assert_api_status_code(response, 200, "Page %d should be returned" % page)
+            data = simplejson.loads(response.content)
+            items.extend(data['results'])
+            cursor = data['next_cursor']
+        
+        self.assertEqual(cursor, None, "The third page should be the last")
+        self.assertEqual(items, ["item%03d" % i for i in xrange(5)])
+        
+        self._assert_api_status_code(self._post_json("/test_view_paginated?page_size=0", [5]), 400,
+            "page_size must be positive")
+        self._assert_api_status_code(self._post_json("/test_view_paginated?page_size=2&cursor=garbage", [5]), 400,
+            "Invalid cursors should be rejected")
+        self._assert_api_status_code(self._post_json("/test_view_paginated?cursor=%s" % pagination.encode_cursor("test_view_echo", 2), [5]), 400,
+            "Cursors from other calls should be rejected")
+        self._assert_api_status_code(self._post_json("/test_view_paginated?cursor=%s" % pagination.encode_cursor("test_view_paginated", {"a": 1}), [5]), 400,
+            "Cursors holding the wrong type of position should be rejected")
+        self._assert_api_status_code(self._post_json("/test_view_normal?page_size=2", []), 400,
+            "Calls that aren't paginated should reject page_size")
+    
     def test_doc(self):
         expected_documentation = \
 """test_doc(arg1, arg2=3):
@@ -207,3 +369,635 @@ Note: This documentation string is used as part of the test.
         
 
     
+
+
+class JinxResultCacheTests(TestCase):
+    """Test caching of API call results."""
+    
+    urls = 'api.tests'
+    
+    def setUp(self):
+        self._result_cache_setting = getattr(settings, 'JINX_RESULT_CACHE', None)
+        settings.JINX_RESULT_CACHE = {
+            'CALLS': {'test_view_cached_counter': {'ttl': 60, 'max_entries': 2}},
+            'INVALIDATES': {'test_view_reset_counter': ('test_view_cached_counter',)},
+        }
+        
+        self.client.post('/test_view_reset_counter', simplejson.dumps([]), "application/json")
+    
+    def tearDown(self):
+        settings.JINX_RESULT_CACHE = self._result_cache_setting
+    
+    def _call_counter(self, *args):
+        response = self.client.post('/test_view_cached_counter', simplejson.dumps(list(args)), "application/json")
+        self.assertEqual(response.status_code, 200)
+        
+        return simplejson.loads(response.content)
+    
+    def test_cached_result(self):
+        self.assertEqual(self._call_counter("a"), 1)
+        self.assertEqual(self._call_counter("a"), 1, "Second call with the same arguments should be cached")
+        self.assertEqual(self._call_counter("b"), 2, "Calls with different arguments should be cached separately")
+        self.assertEqual(self._call_counter("b"), 2)
+        self.assertEqual(self._call_counter("a"), 1)
+    
+    def test_max_entries(self):
+        self.assertEqual(self._call_counter("a"), 1)
+        self.assertEqual(self._call_counter("b"), 2)
+        self.assertEqual(self._call_counter("a"), 1)
+        
+        # "b" is now the least recently used, so it gets thrown out:
+        self.assertEqual(self._call_counter("c"), 3)
+        self.assertEqual(self._call_counter("a"), 1)
+        self.assertEqual(self._call_counter("b"), 4)
+    
+    def test_invalidation(self):
+        self.assertEqual(self._call_counter("a"), 1)
+        
+        response = self.client.post('/test_view_reset_counter', simplejson.dumps([]), "application/json")
+        self.assertEqual(response.status_code, 200)
+        
+        self.assertEqual(self._call_counter("a"), 1, "Resetting the counter should have invalidated the cached result")
+        self.assertEqual(self._call_counter("b"), 2)
+
+
+class JinxInstrumentationTests(TestCase):
+    """Test the metrics and profiling middleware."""
+    
+    urls = 'api.tests'
+    
+    def setUp(self):
+        self._allow_profiling_setting = getattr(settings, 'JINX_ALLOW_PROFILING', False)
+        metrics.registry.clear()
+    
+    def tearDown(self):
+        settings.JINX_ALLOW_PROFILING = self._allow_profiling_setting
+    
+    def _post_json(self, path, data):
+        return self.client.post(path, simplejson.dumps(data), "application/json")
+    
+    def test_metrics(self):
+        self._post_json('/test_view_normal', [])
+        self._post_json('/test_view_normal', [])
+        self._post_json('/test_view_not_found', [])
+        
+        self.assertEqual(metrics.registry.get('jinx_requests_total', (('call', 'test_view_normal'), ('status', 200))), 2)
+        self.assertEqual(metrics.registry.get('jinx_requests_total', (('call', 'test_view_not_found_response'), ('status', 404))), 1)
+        
+        count, total_size = metrics.registry.get('jinx_response_size_bytes', (('call', 'test_view_normal'),))
+        self.assertEqual(count, 2)
+        self.assertEqual(total_size, 2 * len(simplejson.dumps("Hello, world!")))
+        
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        self.assertTrue('# TYPE jinx_request_duration_seconds histogram' in response.content)
+        self.assertTrue('jinx_requests_total{call="test_view_normal",status="200"} 2\n' in response.content)
+        self.assertTrue('jinx_request_duration_seconds_count{call="test_view_normal"} 2\n' in response.content)
+        self.assertTrue('jinx_request_duration_seconds_bucket{call="test_view_normal",le="+Inf"} 2\n' in response.content)
+    
+    def test_streamed_response_size(self):
+        response = self._post_json('/test_view_generator', [2500])
+        content = response.content
+        
+        count, total_size = metrics.registry.get('jinx_response_size_bytes', (('call', 'test_view_generator'),))
+        self.assertEqual(count, 1)
+        self.assertEqual(total_size, len(content))
+    
+    def test_profile(self):
+        settings.JINX_ALLOW_PROFILING = False
+        
+        response = self._post_json('/test_view_normal?profile', [])
+        self.assertEqual(simplejson.loads(response.content), "Hello, world!",
+            "?profile should be ignored unless JINX_ALLOW_PROFILING is set")
+        
+        settings.JINX_ALLOW_PROFILING = True
+        
+        response = self._post_json('/test_view_normal?profile', [])
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        self.assertTrue(response.content.startswith("Response status: 200"))
+        self.assertTrue("function calls" in response.content)
+        self.assertTrue("test_view_normal" in response.content)
+        
+        response = self._post_json('/test_view_normal?profile=time', [])
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue("Ordered by: internal time" in response.content)
+        
+        response = self._post_json('/test_view_normal?profile=bogus', [])
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue("Ordered by: cumulative time" in response.content,
+            "an unknown sort key should fall back to cumulative time")
+
+
+class JinxSerializationTests(TestCase):
+    """Test the choice of codec and content negotiation."""
+    
+    urls = 'api.tests'
+    
+    def setUp(self):
+        self._codecs_setting = getattr(settings, 'JINX_JSON_CODECS', serialization.DEFAULT_CODECS)
+        self._msgpack_codecs_setting = getattr(settings, 'JINX_MSGPACK_CODECS', serialization.DEFAULT_MSGPACK_CODECS)
+    
+    def tearDown(self):
+        settings.JINX_JSON_CODECS = self._codecs_setting
+        settings.JINX_MSGPACK_CODECS = self._msgpack_codecs_setting
+    
+    def test_codecs(self):
+        for name in sorted(serialization.CODECS):
+            try:
+                codec = serialization.load_codec(name)
+            except serialization.CodecUnavailable:
+                continue
+            
+            data = {'hostnames': ["sim1.agni.lindenlab.com", u"caf\xe9"], 'positions': [1, 2], 'rack': None}
+            self.assertEqual(codec.loads(codec.dumps(data)), data, "%s should round-trip data" % name)
+            self.assertRaises(serialization.DecodeError, codec.loads, "This is not valid JSON data.")
+            self.assertRaises(TypeError, codec.dumps, object())
+    
+    def test_choose_codec(self):
+        self.assertEqual(serialization.choose_codec(['api.tests.api_tests.UnavailableCodec', 'json']).name, 'json')
+        self.assertEqual(serialization.choose_codec(['api.tests.api_tests.SlowCodec']).name, 'slow')
+        
+        if serialization.load_codec('json').accelerated:
+            self.assertEqual(serialization.choose_codec(['api.tests.api_tests.SlowCodec', 'json']).name, 'json',
+                "A codec with speedups should be preferred")
+        
+        self.assertRaises(ImproperlyConfigured, serialization.choose_codec, ['api.tests.api_tests.UnavailableCodec'])
+        self.assertRaises(ImproperlyConfigured, serialization.choose_codec, ['no.such.Codec'])
+    
+    def test_configured_codec(self):
+        settings.JINX_JSON_CODECS = ('api.tests.api_tests.SlowCodec',)
+        self.assertEqual(serialization.get_codec().name, 'slow')
+        
+        response = self.client.post('/test_view_reverse_three_arguments', simplejson.dumps([1, 2, "3"]), "application/json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(simplejson.loads(response.content), ["3", 2, 1])
+        
+        response = self.client.post('/test_view_normal', "This is not valid JSON data.", "application/json")
+        self.assertEqual(response.status_code, 415)
+    
+    def test_msgpack(self):
+        settings.JINX_MSGPACK_CODECS = ('mpack',)
+        
+        response = self.client.post('/test_view_reverse_three_arguments', mpack.packb([1, 2, "3"]), "application/x-msgpack")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], "application/json",
+            "Responses should be JSON unless the client asks for MessagePack")
+        self.assertEqual(simplejson.loads(response.content), ["3", 2, 1])
+        
+        response = self.client.post('/test_view_reverse_three_arguments', simplejson.dumps([1, 2, "3"]), "application/json",
+                                    HTTP_ACCEPT="application/x-msgpack, application/json;q=0.5")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], "application/x-msgpack")
+        self.assertEqual(mpack.unpackb(response.content), ["3", 2, 1])
+        
+        response = self.client.post('/test_view_generator', mpack.packb([3]), "application/x-msgpack",
+                                    HTTP_ACCEPT="application/x-msgpack")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(mpack.unpackb(response.content), ["item0", "item1", "item2"],
+            "A generator returned by a view should be sent as a MessagePack array")
+        
+        response = self.client.post('/test_view_normal', simplejson.dumps([]), "application/json",
+                                    HTTP_ACCEPT="application/x-msgpack;q=0.5, application/json")
+        self.assertEqual(response['Content-Type'], "application/json")
+        
+        response = self.client.post('/test_view_normal', "\xc1", "application/x-msgpack")
+        self.assertEqual(response.status_code, 415)
+    
+    def test_negotiate_codec(self):
+        self.assertEqual(serialization.negotiate_codec(None).media_type, "application/json")
+        self.assertEqual(serialization.negotiate_codec("*/*").media_type, "application/json")
+        self.assertEqual(serialization.negotiate_codec("text/html").media_type, "application/json")
+        self.assertEqual(serialization.negotiate_codec("application/msgpack").media_type, "application/x-msgpack")
+        self.assertEqual(serialization.negotiate_codec("application/x-msgpack, application/json").media_type, "application/json",
+            "JSON should win ties")
+        self.assertEqual(serialization.negotiate_codec("application/x-msgpack;q=0").media_type, "application/json")
+
+
+class JinxCompressionTests(TestCase):
+    """Test compression of responses."""
+    
+    urls = 'api.tests'
+    
+    def setUp(self):
+        self._min_size_setting = getattr(settings, 'JINX_COMPRESSION_MIN_SIZE', 1024)
+        settings.JINX_COMPRESSION_MIN_SIZE = 1024
+    
+    def tearDown(self):
+        settings.JINX_COMPRESSION_MIN_SIZE = self._min_size_setting
+    
+    def _post_json(self, path, data, **extra):
+        return self.client.post(path, simplejson.dumps(data), "application/json", **extra)
+    
+    def test_gzip(self):
+        response = self._post_json('/test_view_echo', range(1000), HTTP_ACCEPT_ENCODING="gzip, deflate")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Encoding'], "gzip")
+        self.assertTrue('Accept-Encoding' in response['Vary'])
+        self.assertEqual(simplejson.loads(zlib.decompress(response.content, 16 + zlib.MAX_WBITS)), range(1000))
+    
+    def test_deflate(self):
+        response = self._post_json('/test_view_echo', range(1000), HTTP_ACCEPT_ENCODING="gzip;q=0.5, deflate")
+        self.assertEqual(response['Content-Encoding'], "deflate")
+        self.assertEqual(simplejson.loads(zlib.decompress(response.content)), range(1000))
+    
+    def test_not_accepted(self):
+        response = self._post_json('/test_view_echo', range(1000))
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(simplejson.loads(response.content), range(1000))
+        
+        response = self._post_json('/test_view_echo', range(1000), HTTP_ACCEPT_ENCODING="identity, gzip;q=0")
+        self.assertFalse(response.has_header('Content-Encoding'))
+    
+    def test_min_size(self):
+        response = self._post_json('/test_view_normal', [], HTTP_ACCEPT_ENCODING="gzip")
+        self.assertFalse(response.has_header('Content-Encoding'), "Small responses shouldn't be compressed")
+        self.assertEqual(simplejson.loads(response.content), "Hello, world!")
+        
+        response = self._post_json('/test_view_generator', [3], HTTP_ACCEPT_ENCODING="gzip")
+        self.assertFalse(response.has_header('Content-Encoding'), "Small streamed responses shouldn't be compressed")
+        self.assertEqual(simplejson.loads(response.content), ["item0", "item1", "item2"])
+    
+    def test_streaming(self):
+        response = self._post_json('/test_view_generator', [2500], HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Encoding'], "gzip")
+        self.assertEqual(simplejson.loads(zlib.decompress(response.content, 16 + zlib.MAX_WBITS)),
+                         ["item%d" % i for i in xrange(2500)])
+
+
+class JinxAuthorizationTests(TestCase):
+    """Test authorization of API calls by directory group."""
+    
+    urls = 'api.tests'
+    
+    def setUp(self):
+        self._authorization_setting = getattr(settings, 'JINX_AUTHORIZATION', None)
+        settings.JINX_AUTHORIZATION = {
+            'BACKEND': 'jinx_api.authorization.MemoryDirectory',
+            'OPTIONS': {'groups': {'alice': ['jinx-users', 'jinx-admins'],
+                                   'bob': ['jinx-users'],
+                                   'carol': ['accounting']}},
+            'RULES': {'*': ['jinx-users'],
+                      'test_view_reset_counter': ['jinx-admins']},
+            'TTL': 300,
+            'STALE_TTL': 600,
+        }
+    
+    def tearDown(self):
+        settings.JINX_AUTHORIZATION = self._authorization_setting
+    
+    def _post_as(self, user, path):
+        extra = {}
+        
+        if user is not None:
+            extra['REMOTE_USER'] = user
+        
+        return self.client.post(path, simplejson.dumps([]), "application/json", **extra)
+    
+    def test_allowed(self):
+        response = self._post_as("bob@LINDENLAB.COM", '/test_view_normal')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(simplejson.loads(response.content), "Hello, world!")
+        
+        response = self._post_as("alice", '/test_view_reset_counter')
+        self.assertEqual(response.status_code, 200)
+    
+    def test_denied(self):
+        self.assertEqual(self._post_as("carol", '/test_view_normal').status_code, 403)
+        self.assertEqual(self._post_as("bob", '/test_view_reset_counter').status_code, 403)
+        self.assertEqual(self._post_as("nobody", '/test_view_normal').status_code, 403)
+        self.assertEqual(self._post_as(None, '/test_view_normal').status_code, 403,
+                         "Requests without an authenticated user should be denied")
+    
+    def test_raw_views_skipped(self):
+        self.assertEqual(self._post_as(None, '/metrics').status_code, 200)
+    
+    def test_cached_decisions(self):
+        directory = authorization.get_authorizer().directory
+        
+        for path in ('/test_view_normal', '/test_view_normal', '/test_view_reset_counter', '/test_view_echo'):
+            self._post_as("bob", path)
+        
+        self.assertEqual(directory.lookups, 1, "All of a user's groups should be fetched with one lookup")
+        
+        directory.groups['bob'] = []
+        self.assertEqual(self._post_as("bob", '/test_view_normal').status_code, 200,
+                         "A fresh cached decision should be used")
+    
+    def test_stale_decisions(self):
+        settings.JINX_AUTHORIZATION = dict(settings.JINX_AUTHORIZATION, TTL=0)
+        authorizer = authorization.get_authorizer()
+        
+        self.assertTrue(authorizer.is_allowed("bob", "test_view_normal"))
+        
+        authorizer.directory.groups['bob'] = []
+        self.assertTrue(authorizer.is_allowed("bob", "test_view_normal"),
+                        "A stale decision should be used while it's looked up again")
+        
+        # Wait for the background refresh.
+        for i in xrange(100):
+            if authorizer.directory.lookups >= 2 and not authorizer._refreshing:
+                break
+            
+            time.sleep(0.01)
+        
+        self.assertFalse(authorizer.is_allowed("bob", "test_view_normal"))
+    
+    def test_slow_directory(self):
+        settings.JINX_AUTHORIZATION = dict(settings.JINX_AUTHORIZATION, LOOKUP_TIMEOUT=0.05)
+        authorization.get_authorizer().directory.delay = 0.5
+        
+        self.assertEqual(self._post_as("bob", '/test_view_normal').status_code, 503)
+
+
+class JinxChangeLogTests(TestCase):
+    """Test the change log backends."""
+    
+    def _check_log(self, log):
+        self.assertEqual(log.get_since(0, 10), ([], 1, 0))
+        
+        log.append([{'time': time.time(), 'state': "up"}, {'time': time.time(), 'state': "down"}])
+        log.append([{'time': time.time(), 'state': "maint"}])
+        
+        changes, first_seq, last_seq = log.get_since(1, 10)
+        self.assertEqual([(change['seq'], change['state']) for change in changes], [(2, "down"), (3, "maint")])
+        self.assertEqual((first_seq, last_seq), (1, 3))
+        
+        changes, first_seq, last_seq = log.get_since(0, 1)
+        self.assertEqual([change['seq'] for change in changes], [1])
+        
+        # Only max_changes (3) are kept.
+        log.append([{'time': time.time(), 'state': "gone"}])
+        changes, first_seq, last_seq = log.get_since(0, 10)
+        self.assertEqual([change['seq'] for change in changes], [2, 3, 4])
+        self.assertEqual((first_seq, last_seq), (2, 4))
+        
+        # Changes expire after retention seconds.
+        time.sleep(0.3)
+        log.append([{'time': time.time(), 'state': "new"}])
+        changes, first_seq, last_seq = log.get_since(0, 10)
+        self.assertEqual([change['seq'] for change in changes], [5])
+        self.assertEqual((first_seq, last_seq), (5, 5))
+    
+    def test_memory_change_log(self):
+        self._check_log(change_log.MemoryChangeLog(max_changes=3, retention=0.2))
+    
+    def test_sqlite_change_log(self):
+        handle, path = tempfile.mkstemp()
+        os.close(handle)
+        
+        try:
+            self._check_log(change_log.SqliteChangeLog(path, max_changes=3, retention=0.2))
+        finally:
+            os.remove(path)
+
+
+class JinxWorkerPoolTests(TestCase):
+    """Test giving up on tasks that are stuck in a WorkerPool."""
+    
+    def test_abandon(self):
+        pool = WorkerPool(1, name='jinx-test', max_abandoned=1)
+        release = threading.Event()
+        
+        hung = pool.submit(release.wait)
+        queued = pool.submit(lambda: "queued")
+        
+        self.assertFalse(queued.wait(0.2))
+        self.assertTrue(pool.abandon(queued), "A task that hasn't started should be cancelled")
+        self.assertTrue(queued.cancelled)
+        
+        self.assertFalse(pool.abandon(hung), "A running task can't be cancelled")
+        self.assertFalse(hung.cancelled)
+        
+        # The hung task's thread has been replaced, so new tasks still run.
+        task = pool.submit(lambda: "replaced")
+        self.assertTrue(task.wait(2))
+        self.assertEqual(task.result, "replaced")
+        
+        # Only max_abandoned threads are replaced.
+        second_hung = pool.submit(release.wait)
+        time.sleep(0.1)
+        self.assertFalse(pool.abandon(second_hung))
+        self.assertFalse(pool.submit(lambda: None).wait(0.2))
+        
+        release.set()
+        self.assertTrue(hung.wait(2))
+        self.assertTrue(second_hung.wait(2))
+        self.assertEqual(queued.result, None, "A cancelled task should never run")
+
+
+class JinxDispatchTests(TestCase):
+    """Test routing API calls by exact name and version."""
+    
+    def setUp(self):
+        calls = patterns('api.tests.api_tests',
+            (r'test_view_normal', 'test_view_normal'),
+            (r'test_view_echo', 'test_view_echo'),
+        )
+        version_calls = {
+            '1.0': patterns('api.tests.api_tests', (r'test_view_normal', 'test_view_one_default_argument')),
+        }
+        self.dispatcher = CallDispatcher(r'^[0-9.-]+/', calls, version_calls)
+    
+    def test_exact_names(self):
+        view, args, kwargs = self.dispatcher.resolve('2.0/test_view_normal')
+        self.assertEqual((view, args, kwargs), (test_view_normal, (), {}))
+        self.assertEqual(self.dispatcher.resolve('2.0/test_view_echo')[0], test_view_echo)
+        
+        for path in ['2.0/test_view', '2.0/test_view_normal_x', '2.0/xtest_view_normal', '2.0/', 'test_view_normal']:
+            self.assertRaises(Resolver404, self.dispatcher.resolve, path)
+    
+    def test_version_calls(self):
+        self.assertEqual(self.dispatcher.resolve('1.0/test_view_normal')[0], test_view_one_default_argument)
+        self.assertEqual(self.dispatcher.resolve('1.0/test_view_echo')[0], test_view_echo,
+            "Calls without an override should fall back on the usual view")
+        self.assertEqual(self.dispatcher.resolve('2.1/test_view_normal')[0], test_view_normal)
+    
+    def test_api_calls(self):
+        # Calls whose names contain other calls' names reach their own views.
+        resolver = get_resolver(None)
+        
+        for call_name in ['get_host_state', 'get_hosts_state', 'get_host_state_changes', 'set_host_state',
+                          'power_cycle', 'power_cycle_hosts', 'power_cycle_async', 'get_rack_contents']:
+            self.assertEqual(resolver.resolve('/jinx/2.0/%s' % call_name)[0].__name__, call_name)
+        
+        self.assertRaises(Resolver404, resolver.resolve, '/jinx/2.0/get_host_state_and_more')
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+    
+    def emit(self, record):
+        self.records.append(record)
+
+class JinxQueryBudgetTests(TestCase):
+    """Test enforcement of query budgets and detection of repeated statements."""
+    
+    urls = 'api.tests'
+    
+    def setUp(self):
+        self._query_budget_setting = getattr(settings, 'JINX_QUERY_BUDGET', None)
+        settings.JINX_QUERY_BUDGET = {'ACTION': 'raise', 'REPEAT_THRESHOLD': 5, 'BUDGETS': {}}
+        
+        self.log = ListHandler()
+        logging.getLogger('jinx_api.queries').addHandler(self.log)
+    
+    def tearDown(self):
+        settings.JINX_QUERY_BUDGET = self._query_budget_setting
+        logging.getLogger('jinx_api.queries').removeHandler(self.log)
+    
+    def _post_json(self, path, data):
+        return self.client.post(path, simplejson.dumps(data), "application/json")
+    
+    def test_within_budget(self):
+        response = self._post_json('/test_view_queries', [3])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.log.records, [])
+    
+    def test_over_budget(self):
+        self.assertRaises(QueryBudgetExceeded, self._post_json, '/test_view_queries', [4])
+        
+        settings.JINX_QUERY_BUDGET['ACTION'] = 'warn'
+        response = self._post_json('/test_view_queries', [4])
+        self.assertEqual(response.status_code, 200, "Going over budget in production should only log")
+        self.assertEqual(len(self.log.records), 1)
+        self.assertTrue("budget is 3" in self.log.records[0].getMessage())
+    
+    def test_configured_budget(self):
+        settings.JINX_QUERY_BUDGET['BUDGETS'] = {'test_view_queries': 4}
+        self.assertEqual(self._post_json('/test_view_queries', [4]).status_code, 200)
+    
+    def test_streamed_response(self):
+        response = self._post_json('/test_view_streamed_queries', [3])
+        self.assertEqual(simplejson.loads(response.content), [3])
+        
+        # The budget is checked once the response has been generated.
+        self.assertRaises(QueryBudgetExceeded, lambda: self._post_json('/test_view_streamed_queries', [4]).content)
+    
+    def test_repeated_statements(self):
+        settings.JINX_QUERY_BUDGET['BUDGETS'] = {'test_view_queries': 100}
+        
+        response = self._post_json('/test_view_queries', [10])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self.log.records), 1)
+        self.assertTrue("10 times" in self.log.records[0].getMessage())
+    
+    def test_statement_shape(self):
+        self.assertEqual(metrics.statement_shape("SELECT *\n  FROM attributes WHERE entity_id IN (?, ?, ?)"),
+                         metrics.statement_shape("SELECT * FROM attributes WHERE entity_id IN (?)"))
+        self.assertNotEqual(metrics.statement_shape("SELECT * FROM attributes WHERE entity_id = ?"),
+                            metrics.statement_shape("SELECT * FROM entities WHERE entity_id = ?"))
+    
+    def test_disabled(self):
+        settings.JINX_QUERY_BUDGET = None
+        self.assertEqual(self._post_json('/test_view_queries', [10]).status_code, 200)
+        self.assertEqual(self.log.records, [])
+
+
+def build_state_fixture():
+    ServerClass("Class 5")
+    HostState("up")
+    HostState("down")
+    
+    for i in xrange(50):
+        Class5Server("host%02d.lindenlab.com" % i).state = "up"
+    
+    return ["host%02d.lindenlab.com" % i for i in xrange(50)]
+
+class JinxFixtureTests(JinxTestCase):
+    api_call_path = "/jinx/2.0/get_hosts_in_state"
+    fixture = Fixture(build_state_fixture)
+    
+    def data(self):
+        HostState("maintenance")
+    
+    def _check_restored(self):
+        response = self.do_api_call("up")
+        self.assert_response_code(response, 200, response.data)
+        self.assertEqual(response.data, self.fixture.data)
+        
+        response = self.do_api_call("maintenance")
+        self.assert_response_code(response, 200, "data() should add to the fixture")
+        self.assertEqual(response.data, [])
+    
+    def test_changes_are_discarded(self):
+        self._check_restored()
+        
+        self.api_call_path = "/jinx/2.0/set_hosts_state"
+        response = self.do_api_call(self.fixture.data[:10], "down")
+        self.assert_response_code(response, 200, response.data)
+    
+    def test_changes_are_discarded_again(self):
+        # Whichever test runs second sees the fixture as it was built.
+        self.test_changes_are_discarded()
+    
+    def test_reused_image(self):
+        # Only one database can be connected at a time.
+        self.fixture.release()
+        
+        path = os.path.join(tempfile.mkdtemp(), "fixture.sqlite")
+        built = []
+        
+        def build():
+            built.append(True)
+            return build_state_fixture()
+        
+        try:
+            for i in xrange(2):
+                fixture = Fixture(build, path)
+                fixture.restore()
+                fixture.release()
+                self.assertEqual(fixture.data, self.fixture.data)
+            
+            self.assertEqual(len(built), 1, "A kept image should be reused")
+        finally:
+            os.remove(path)
+            os.remove(path + ".pickle")
+            os.rmdir(os.path.dirname(path))
+            
+            # Reconnect, for tearDown.
+            self.fixture.restore()
+
+
+class JinxWarmupTests(JinxTestCase):
+    """Test getting a new server process ready before its first request."""
+    
+    def data(self):
+        HostState("up")
+    
+    def setUp(self):
+        super(JinxWarmupTests, self).setUp()
+        self._warmup_setting = getattr(settings, 'JINX_WARMUP', None)
+    
+    def tearDown(self):
+        settings.JINX_WARMUP = self._warmup_setting
+        super(JinxWarmupTests, self).tearDown()
+    
+    def test_warm_up(self):
+        settings.JINX_WARMUP = {'HOSTNAME_INDEX': True, 'CALLS': [('list_host_states', [])]}
+        application = WSGIHandler()
+        
+        self.assertEqual(warmup.warm_up(application), [])
+        self.assertTrue(application._request_middleware is not None, "The middleware should be loaded")
+        self.assertTrue(warmup.make_call(application, 'list_host_states', []).startswith('200'))
+    
+    def test_failed_call(self):
+        settings.JINX_WARMUP = {'HOSTNAME_INDEX': False, 'CALLS': [('list_host_states', ["unexpected"])]}
+        problems = warmup.warm_up(WSGIHandler())
+        
+        self.assertEqual(len(problems), 1, problems)
+        self.assertTrue(problems[0].startswith("list_host_states returned 400"), problems)
+    
+    def test_resolve_calls(self):
+        self.assertEqual(warmup.resolve_calls(), [], "Every call's URL should reach a view")
+    
+    def test_disabled(self):
+        settings.JINX_WARMUP = None
+        application = WSGIHandler()
+        
+        self.assertEqual(warmup.warm_up(application), [])
+        self.assertTrue(application._request_middleware is None)
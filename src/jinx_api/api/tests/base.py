@@ -1,8 +1,10 @@
 from django.test import TestCase
+from django.conf import settings
 import ConfigParser
 import clusto
 import llclusto
 import simplejson
+from jinx_api import metrics
 
 
 
@@ -16,7 +18,33 @@ class JinxTestCase(TestCase):
     
     api_call_path = None
     
+    # Subclasses can set this to a jinx_api.fixtures.Fixture to start each
+    # test with a copy of a prebuilt database instead of an empty one; data()
+    # is still called afterwards, to add to it.
+    
+    fixture = None
+    
     def setUp(self):
+        # Tests change clusto directly between API calls, which the result
+        # cache can't know about, so turn it off.  Tests of the cache itself
+        # can turn it back on.
+        self._result_cache_setting = getattr(settings, 'JINX_RESULT_CACHE', None)
+        settings.JINX_RESULT_CACHE = None
+        
+        # Likewise, tests run without an authenticated user.  Tests of
+        # authorization turn it on with a MemoryDirectory.
+        self._authorization_setting = getattr(settings, 'JINX_AUTHORIZATION', None)
+        settings.JINX_AUTHORIZATION = None
+        
+        # Calls that go over their query budget fail the test.
+        self._query_budget_setting = getattr(settings, 'JINX_QUERY_BUDGET', None)
+        settings.JINX_QUERY_BUDGET = dict(self._query_budget_setting or {}, ACTION='raise')
+        
+        if self.fixture is not None:
+            self.fixture.restore()
+            self.data()
+            return
+        
         # Mostly cribbed from clusto's test framework
         
         conf = ConfigParser.ConfigParser()
@@ -30,9 +58,17 @@ class JinxTestCase(TestCase):
         self.data()
         
     def tearDown(self):
+        settings.JINX_RESULT_CACHE = self._result_cache_setting
+        settings.JINX_AUTHORIZATION = self._authorization_setting
+        settings.JINX_QUERY_BUDGET = self._query_budget_setting
+        
         if clusto.SESSION.is_active:
             raise Exception("SESSION IS STILL ACTIVE in %s" % str(self.__class__))
         
+        if self.fixture is not None:
+            self.fixture.release()
+            return
+        
         clusto.clear()
         clusto.disconnect()
         clusto.METADATA.drop_all(clusto.SESSION.bind)
@@ -63,3 +99,21 @@ class JinxTestCase(TestCase):
     
     def assert_response_code(self, response, code, description=None):
         self.assertEqual(response.status_code, code, description)
+        
+    def assert_max_queries(self, max_queries, *args):
+        """Performs the API call, failing if it runs more than max_queries SQL statements.
+        
+        Use this with enough data in clusto that a call querying once per
+        host would show up.  Returns the response, like do_api_call().
+        """
+        
+        labels = (('call', self.api_call_path.rsplit('/', 1)[-1]),)
+        queries_before = metrics.registry.get('jinx_sql_queries_total', labels)
+        
+        response = self.do_api_call(*args)
+        queries = metrics.registry.get('jinx_sql_queries_total', labels) - queries_before
+        
+        self.assertTrue(queries <= max_queries, 
+            "API call %s(%s) ran %d SQL statements; expected at most %d" % (self.api_call_path, str(args), queries, max_queries))
+        
+        return response
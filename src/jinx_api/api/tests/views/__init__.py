@@ -1,3 +1,5 @@
 from host import *
 from rack import *
 from pdu import *
+from meta import *
+from job import *
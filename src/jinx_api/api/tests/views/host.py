@@ -1,8 +1,14 @@
+from django.conf import settings
 from api.tests.base import JinxTestCase
+from jinx_api import changes
+from jinx_api import pagination
 import clusto
 import llclusto
 from llclusto.drivers import Class5Server, ServerClass, LindenDatacenter, LindenRack, Class7Server, Class7Chassis, HostState, LindenPDU
+import simplejson
 import sys
+import threading
+import time
 
 class TestGetHostsByRegex(JinxTestCase):
     api_call_path = "/jinx/2.0/get_hosts_by_regex"
@@ -25,7 +31,39 @@ class TestGetHostsByRegex(JinxTestCase):
         response = self.do_api_call(r'nothername.*')
         self.assert_response_code(response, 200)
         self.assertEqual(sorted(response.data), ["anothername1"])
-        
+
+    def test_indexed_patterns(self):
+        response = self.do_api_call(r'^HOSTNAME')
+        self.assert_response_code(response, 200)
+        self.assertEqual(sorted(response.data), ["hostname1", "hostname2", "hostname3", "hostname4", "hostname5"])
+
+        response = self.do_api_call(r'^HOSTNAME', 0)
+        self.assert_response_code(response, 200)
+        self.assertEqual(response.data, [])
+
+        response = self.do_api_call(r'(another|host)name1$')
+        self.assert_response_code(response, 200)
+        self.assertEqual(sorted(response.data), ["anothername1", "hostname1"])
+
+        response = self.do_api_call(r'x?name[15]')
+        self.assert_response_code(response, 200)
+        self.assertEqual(sorted(response.data), ["anothername1", "hostname1", "hostname5"])
+
+        response = self.do_api_call(r'.')
+        self.assert_response_code(response, 200)
+        self.assertEqual(len(response.data), 6)
+
+    def test_new_host(self):
+        response = self.do_api_call(r'^hostname6')
+        self.assert_response_code(response, 200)
+        self.assertEqual(response.data, [])
+
+        Class5Server("hostname6")
+
+        response = self.do_api_call(r'^hostname6')
+        self.assert_response_code(response, 200)
+        self.assertEqual(response.data, ["hostname6"])
+
     def test_bad_regex(self):
         response = self.do_api_call(r'^(badregex')
         self.assert_response_code(response, 400)
@@ -112,6 +150,69 @@ class TestGetRemoteHandsInfo(JinxTestCase):
         response = self.do_api_call("huh?", 2)
         self.assert_response_code(response, 400)
         
+class TestGetHostsRemoteHandsInfo(TestGetRemoteHandsInfo):
+    api_call_path = "/jinx/2.0/get_hosts_remote_hands_info"
+
+    def test_normal_call(self):
+        response = self.do_api_call(["hostname1.lindenlab.com", "aa:bb:cc:11:22:96", "huh?"])
+        self.assert_response_code(response, 200)
+        self.assertEqual(response.data, {'hostname1.lindenlab.com': {'status': 200,
+                                                                     'result': {'macs': ['aa:bb:cc:11:22:33', 'aa:bb:cc:11:22:34'],
+                                                                                'positions': [1],
+                                                                                'hostname': 'hostname1.lindenlab.com',
+                                                                                'pdu_connections': [],
+                                                                                'serial_number': 'SM55880',
+                                                                                'colo': 'PHX',
+                                                                                'rack': "c3.03.2000"}},
+                                         'aa:bb:cc:11:22:96': {'status': 200,
+                                                               'result': {'macs': ['aa:bb:cc:11:22:96', 'aa:bb:cc:11:22:97'],
+                                                                          'positions': [1, 2],
+                                                                          'hostname': 'hostname2.lindenlab.com',
+                                                                          'pdu_connections': [],
+                                                                          'serial_number': 'SM55880',
+                                                                          'colo': 'DFW',
+                                                                          'rack': "c1.01.1000"}},
+                                         'huh?': {'status': 404,
+                                                  'result': 'No host was found with hostname or MAC address "huh?".'}})
+
+    def test_matches_single_host_call(self):
+        hosts_or_macs = ["hostname1.lindenlab.com", "aa:bb:cc:11:22:34", "hostname2.lindenlab.com"]
+        bulk = self.do_api_call(hosts_or_macs)
+
+        self.api_call_path = TestGetRemoteHandsInfo.api_call_path
+
+        for host_or_mac in hosts_or_macs:
+            single = self.do_api_call(host_or_mac)
+            self.assertEqual(bulk.data[host_or_mac]['result'], single.data)
+
+    def test_pdu_connections(self):
+        pdu = LindenPDU()
+        pdu.hostname = "pdu1-c1-01-20.dca.lindenlab.com"
+
+        # The class 5 is powered directly and the class 7 through its chassis.
+        clusto.get_by_name("hostname1.lindenlab.com").connect_ports("pwr-nema-5", 1, pdu, 3)
+        class7 = clusto.get_by_name("hostname2.lindenlab.com")
+        llclusto.drivers.LindenServerChassis.get_chassis(class7).connect_ports("pwr-nema-5", 1, pdu, 4)
+
+        hostnames = ["hostname1.lindenlab.com", "hostname2.lindenlab.com"]
+        bulk = self.do_api_call(hostnames)
+        self.assert_response_code(bulk, 200)
+
+        self.assertEqual(bulk.data["hostname1.lindenlab.com"]['result']['pdu_connections'],
+                         [{'pdu': "pdu1-c1-01-20.dca.lindenlab.com", 'port': 3}])
+        self.assertEqual(bulk.data["hostname2.lindenlab.com"]['result']['pdu_connections'],
+                         [{'pdu': "pdu1-c1-01-20.dca.lindenlab.com", 'port': 4}])
+
+        self.api_call_path = TestGetRemoteHandsInfo.api_call_path
+
+        for hostname in hostnames:
+            single = self.do_api_call(hostname)
+            self.assertEqual(bulk.data[hostname]['result'], single.data)
+
+    def test_bad_call(self):
+        response = self.do_api_call("hostname1.lindenlab.com")
+        self.assert_response_code(response, 400)
+
 class TestGetHostState(JinxTestCase):
     api_call_path = "/jinx/2.0/get_host_state"
     
@@ -136,6 +237,43 @@ class TestGetHostState(JinxTestCase):
         response = self.do_api_call("test3.lindenlab.com")
         self.assert_response_code(response, 404)
         
+class TestGetHostsState(JinxTestCase):
+    api_call_path = "/jinx/2.0/get_hosts_state"
+    
+    def data(self):
+        ServerClass("Class 5")
+        server1 = Class5Server("test1.lindenlab.com")
+        Class5Server("test2.lindenlab.com")
+        server3 = Class5Server("other3.lindenlab.com")
+        HostState("up")
+        HostState("down")
+        server1.state = "up"
+        server3.state = "down"
+    
+    def test_normal_call(self):
+        response = self.do_api_call(["test1.lindenlab.com", "test2.lindenlab.com", "other3.lindenlab.com", "test4.lindenlab.com"])
+        self.assert_response_code(response, 200, response.data)
+        self.assertEqual(response.data, {"test1.lindenlab.com": "up",
+                                         "test2.lindenlab.com": None,
+                                         "other3.lindenlab.com": "down"})
+    
+    def test_regex(self):
+        response = self.do_api_call(r"^test\d")
+        self.assert_response_code(response, 200, response.data)
+        self.assertEqual(response.data, {"test1.lindenlab.com": "up",
+                                         "test2.lindenlab.com": None})
+    
+    def test_matches_single_host_call(self):
+        for hostname in ("test1.lindenlab.com", "test2.lindenlab.com", "other3.lindenlab.com"):
+            response = self.client.post("/jinx/2.0/get_host_state", simplejson.dumps([hostname]), "application/json")
+            self.assertEqual(self.do_api_call([hostname]).data[hostname], simplejson.loads(response.content))
+    
+    def test_bad_call(self):
+        self.assert_response_code(self.do_api_call("test("), 400)
+        self.assert_response_code(self.do_api_call(1), 400)
+        self.assert_response_code(self.do_api_call(["test1.lindenlab.com", 1]), 400)
+        self.assert_response_code(self.do_api_call([["test1.lindenlab.com"]]), 400)
+
 class TestSetHostState(JinxTestCase):
     api_call_path = "/jinx/2.0/set_host_state"
     
@@ -181,6 +319,60 @@ class TestSetHostState(JinxTestCase):
         self.assertEqual(response.data, None)
         self.assertEqual(self.server1.state, None)
 
+class TestSetHostsState(JinxTestCase):
+    api_call_path = "/jinx/2.0/set_hosts_state"
+    
+    def data(self):
+        ServerClass("Class 5")
+        self.server1 = Class5Server("test1.lindenlab.com")
+        self.server2 = Class5Server("test2.lindenlab.com")
+        self.server3 = Class5Server("other3.lindenlab.com")
+        HostState("up")
+        HostState("down")
+        self.server1.state = "down"
+    
+    def test_set_hosts_state(self):
+        start = changes.get_changes(None)['last_seq']
+        
+        response = self.do_api_call(["test1.lindenlab.com", "test2.lindenlab.com", "test4.lindenlab.com"], "up")
+        self.assert_response_code(response, 200, response.data)
+        self.assertEqual(response.data, {"test1.lindenlab.com": {'status': 200, 'result': None},
+                                         "test2.lindenlab.com": {'status': 200, 'result': None},
+                                         "test4.lindenlab.com": {'status': 404, 'result': "Host test4.lindenlab.com not found."}})
+        self.assertEqual(self.server1.state, "up")
+        self.assertEqual(self.server2.state, "up")
+        self.assertEqual(self.server3.state, None)
+        
+        logged = changes.get_changes(start)['changes']
+        self.assertEqual(sorted((change['hostname'], change['old_state'], change['state']) for change in logged),
+                         [("test1.lindenlab.com", "down", "up"), ("test2.lindenlab.com", None, "up")])
+    
+    def test_regex(self):
+        response = self.do_api_call(r"^test\d", "down")
+        self.assert_response_code(response, 200, response.data)
+        self.assertEqual(sorted(response.data), ["test1.lindenlab.com", "test2.lindenlab.com"])
+        self.assertEqual(self.server2.state, "down")
+        self.assertEqual(self.server3.state, None)
+    
+    def test_delete_state(self):
+        response = self.do_api_call(["test1.lindenlab.com"], None)
+        self.assert_response_code(response, 200, response.data)
+        self.assertEqual(response.data["test1.lindenlab.com"]['status'], 200)
+        self.assertEqual(self.server1.state, None)
+    
+    def test_nonexistent_state(self):
+        response = self.do_api_call(["test1.lindenlab.com", "test2.lindenlab.com"], "sideways")
+        self.assert_response_code(response, 200, response.data)
+        self.assertEqual([result['status'] for result in response.data.values()], [409, 409])
+        self.assertEqual(self.server1.state, "down")
+    
+    def test_bad_call(self):
+        self.assert_response_code(self.do_api_call("test(", "up"), 400)
+        self.assert_response_code(self.do_api_call(1, "up"), 400)
+        self.assert_response_code(self.do_api_call(["test1.lindenlab.com", 1], "up"), 400)
+        self.assert_response_code(self.do_api_call([{"hostname": "test1.lindenlab.com"}], "up"), 400)
+        self.assertEqual(self.server1.state, "down")
+
 class TestGetHostsInState(JinxTestCase):
     api_call_path = "/jinx/2.0/get_hosts_in_state"
     
@@ -218,6 +410,31 @@ class TestGetHostsInState(JinxTestCase):
         self.assert_response_code(response, 200, response.data)
         self.assertEqual(response.data, [self.server2.hostname])
         
+    def test_cursor_pagination(self):
+        Class5Server("test3.lindenlab.com").state = "up"
+        self.server1.state = "up"
+        self.server2.state = "up"
+        
+        response = self.client.post(self.api_call_path + "?page_size=2", '["up"]', "application/json")
+        self.assert_response_code(response, 200, response.content)
+        data = simplejson.loads(response.content)
+        self.assertEqual(data['results'], ["test1.lindenlab.com", "test2.lindenlab.com"])
+        
+        response = self.client.post(self.api_call_path + "?page_size=2&cursor=%s" % data['next_cursor'], '["up"]', "application/json")
+        self.assert_response_code(response, 200, response.content)
+        self.assertEqual(simplejson.loads(response.content), {'results': ["test3.lindenlab.com"], 'next_cursor': None})
+        
+        cursor = pagination.encode_cursor("get_hosts_in_state", {"hostname": "test1"})
+        response = self.client.post(self.api_call_path + "?page_size=2&cursor=%s" % cursor, '["up"]', "application/json")
+        self.assert_response_code(response, 400, "A cursor position that isn't a hostname should be rejected")
+    
+    def test_query_count(self):
+        for i in xrange(20):
+            Class5Server("bulk%02d.lindenlab.com" % i).state = "up"
+        
+        response = self.assert_max_queries(10, "up")
+        self.assertEqual(len(response.data), 20)
+    
     def test_nonexistent_state(self):
         response = self.do_api_call("sideways")
         self.assert_response_code(response, 409, response.data)
@@ -241,6 +458,124 @@ class TestListHostStates(JinxTestCase):
         response = self.do_api_call()
         self.assert_response_code(response, 200, response.data)
         self.assertEqual(sorted(response.data), ["down", "up"])
+    
+    def test_conditional_call(self):
+        HostState("up")
+        
+        response = self.do_api_call()
+        self.assert_response_code(response, 200, response.data)
+        etag = response['ETag']
+        
+        response = self.client.post(self.api_call_path, "[]", "application/json", HTTP_IF_NONE_MATCH=etag)
+        self.assert_response_code(response, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(response.content, "")
+        
+        response = self.client.post(self.api_call_path, "[]", "application/json", HTTP_IF_NONE_MATCH='W/"other", %s' % etag)
+        self.assert_response_code(response, 304, "Any of the listed tags should match")
+        
+        HostState("down")
+        
+        response = self.client.post(self.api_call_path, "[]", "application/json", HTTP_IF_NONE_MATCH=etag)
+        self.assert_response_code(response, 200, "Changing clusto should change the ETag")
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(sorted(simplejson.loads(response.content)), ["down", "up"])
+    
+    def test_conditional_call_cached(self):
+        settings.JINX_RESULT_CACHE = {'CALLS': {'list_host_states': {'ttl': 60, 'max_entries': 1}}}
+        HostState("up")
+    
+        response = self.do_api_call()
+        etag = response['ETag']
+    
+        # Changed behind the result cache's back, as another process would.
+        HostState("down")
+    
+        response = self.client.post(self.api_call_path, "[]", "application/json", HTTP_IF_NONE_MATCH=etag)
+        self.assert_response_code(response, 200, response.content)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(sorted(simplejson.loads(response.content)), ["down", "up"],
+                         "A result cached before the change shouldn't be sent with the new ETag")
+    
+class TestGetHostStateChanges(JinxTestCase):
+    api_call_path = "/jinx/2.0/get_host_state_changes"
+    
+    def data(self):
+        ServerClass("Class 5")
+        Class5Server("test1.lindenlab.com")
+        HostState("up")
+    
+    def _call(self, path, *args):
+        response = self.client.post(path, simplejson.dumps(list(args)), "application/json")
+        self.assert_response_code(response, 200, response.content)
+        
+        return simplejson.loads(response.content)
+    
+    def test_changes(self):
+        response = self.do_api_call()
+        self.assert_response_code(response, 200, response.data)
+        self.assertEqual(response.data['changes'], [])
+        start = response.data['last_seq']
+        
+        self._call("/jinx/2.0/set_host_state", "test1.lindenlab.com", "up")
+        self._call("/jinx/2.0/add_host_state", "down")
+        self._call("/jinx/2.0/set_host_state", "test1.lindenlab.com", "down")
+        
+        response = self.do_api_call(start)
+        self.assert_response_code(response, 200, response.data)
+        self.assertFalse(response.data['truncated'])
+        self.assertEqual([change['seq'] for change in response.data['changes']], [start + 1, start + 2, start + 3])
+        self.assertEqual(response.data['last_seq'], start + 3)
+        self.assertEqual([(change['call'], change['hostname'], change['old_state'], change['state'])
+                          for change in response.data['changes']],
+                         [("set_host_state", "test1.lindenlab.com", None, "up"),
+                          ("add_host_state", None, None, "down"),
+                          ("set_host_state", "test1.lindenlab.com", "up", "down")])
+        
+        response = self.do_api_call(start + 2)
+        self.assertEqual([change['seq'] for change in response.data['changes']], [start + 3])
+        
+        response = self.do_api_call(start + 3)
+        self.assertEqual(response.data, {'changes': [], 'last_seq': start + 3, 'truncated': False})
+    
+    def test_failed_calls_not_recorded(self):
+        start = self.do_api_call().data['last_seq']
+        
+        self.client.post("/jinx/2.0/set_host_state", simplejson.dumps(["test1.lindenlab.com", "sideways"]), "application/json")
+        self.client.post("/jinx/2.0/add_host_state", simplejson.dumps(["up"]), "application/json")
+        
+        self.assertEqual(self.do_api_call(start).data['changes'], [])
+    
+    def test_long_poll(self):
+        start = self.do_api_call().data['last_seq']
+        
+        started_at = time.time()
+        response = self.do_api_call(start, 0.2)
+        self.assert_response_code(response, 200, response.data)
+        self.assertEqual(response.data['changes'], [])
+        self.assertTrue(time.time() - started_at >= 0.2, "The call should have waited for a change")
+        
+        # A change made while waiting ends the wait.
+        timer = threading.Timer(0.1, changes.record_changes, ('set_host_state', [{'hostname': "test1.lindenlab.com",
+                                                                                  'state': "up"}]))
+        timer.start()
+        response = self.do_api_call(start, 10)
+        timer.join()
+        self.assertEqual([change['seq'] for change in response.data['changes']], [start + 1])
+    
+    def test_truncated(self):
+        start = self.do_api_call().data['last_seq']
+        
+        response = self.do_api_call(start + 100)
+        self.assertTrue(response.data['truncated'], "A sequence number from the future means the log was reset")
+        self.assertEqual(response.data['last_seq'], start)
+    
+    def test_bad_call(self):
+        self.assert_response_code(self.do_api_call("1"), 400)
+        self.assert_response_code(self.do_api_call(-1), 400)
+        self.assert_response_code(self.do_api_call(0, "forever"), 400)
+        self.assert_response_code(self.do_api_call(0, float('nan')), 400)
+        self.assert_response_code(self.do_api_call(0, float('inf')), 400)
 
 class TestAddHostState(JinxTestCase):
     api_call_path = "/jinx/2.0/add_host_state"
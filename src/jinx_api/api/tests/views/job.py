@@ -0,0 +1,98 @@
+from api.tests.base import JinxTestCase
+from jinx_api import jobs
+from django.conf import settings
+from django.http import HttpResponseNotFound
+import threading
+
+class TestGetJobStatus(JinxTestCase):
+    api_call_path = "/jinx/2.0/get_job_status"
+
+    def test_finished_job(self):
+        job_id = jobs.submit_job('test_job', [1, 2], lambda: 1 + 2)
+        jobs.wait_for_jobs([job_id], 5)
+
+        response = self.do_api_call(job_id)
+        self.assert_response_code(response, 200)
+        self.assertEqual(response.data['id'], job_id)
+        self.assertEqual(response.data['call'], 'test_job')
+        self.assertEqual(response.data['args'], [1, 2])
+        self.assertEqual(response.data['state'], 'finished')
+        self.assertEqual(response.data['status'], 200)
+        self.assertEqual(response.data['result'], 3)
+
+    def test_failed_job(self):
+        job_id = jobs.submit_job('test_job', [], lambda: HttpResponseNotFound("Not found."))
+        jobs.wait_for_jobs([job_id], 5)
+
+        response = self.do_api_call(job_id)
+        self.assert_response_code(response, 200)
+        self.assertEqual(response.data['status'], 404)
+        self.assertEqual(response.data['result'], "Not found.")
+
+    def test_timed_out_job(self):
+        release = threading.Event()
+
+        try:
+            job_id = jobs.submit_job('test_job', [], release.wait, 0.2)
+            jobs.wait_for_jobs([job_id], 5)
+
+            response = self.do_api_call(job_id)
+            self.assert_response_code(response, 200)
+            self.assertEqual(response.data['state'], 'finished')
+            self.assertEqual(response.data['status'], 504)
+        finally:
+            release.set()
+
+    def test_nonexistent_job(self):
+        response = self.do_api_call("nosuchjob")
+        self.assert_response_code(response, 404)
+
+class TestWaitForJobs(JinxTestCase):
+    api_call_path = "/jinx/2.0/wait_for_jobs"
+
+    def test_wait_for_jobs(self):
+        job_ids = [jobs.submit_job('test_job', [i], lambda i=i: i * 2) for i in range(3)]
+
+        response = self.do_api_call(job_ids + ["nosuchjob"], 5)
+        self.assert_response_code(response, 200)
+        self.assertEqual(response.data["nosuchjob"], None)
+
+        for i, job_id in enumerate(job_ids):
+            self.assertEqual(response.data[job_id]['state'], 'finished')
+            self.assertEqual(response.data[job_id]['result'], i * 2)
+
+    def test_hung_jobs(self):
+        release = threading.Event()
+
+        try:
+            # Hang every worker thread.
+            hung_ids = [jobs.submit_job('test_job', [i], release.wait, 0.2)
+                        for i in range(getattr(settings, 'JINX_JOB_WORKERS', 8))]
+
+            response = self.do_api_call(hung_ids, 5)
+            self.assert_response_code(response, 200)
+
+            for job_id in hung_ids:
+                self.assertEqual(response.data[job_id]['state'], 'finished')
+                self.assertEqual(response.data[job_id]['status'], 504)
+
+            # The hung jobs were abandoned, so new ones still run.
+            job_id = jobs.submit_job('test_job', [], lambda: 42)
+            response = self.do_api_call([job_id], 5)
+            self.assertEqual(response.data[job_id]['status'], 200)
+            self.assertEqual(response.data[job_id]['result'], 42)
+        finally:
+            release.set()
+
+    def test_bad_call(self):
+        response = self.do_api_call("nosuchjob")
+        self.assert_response_code(response, 400)
+
+        response = self.do_api_call([], "forever")
+        self.assert_response_code(response, 400)
+
+        response = self.do_api_call([], float('nan'))
+        self.assert_response_code(response, 400)
+
+        response = self.do_api_call([], float('-inf'))
+        self.assert_response_code(response, 400)
@@ -0,0 +1,84 @@
+from api.tests.base import JinxTestCase
+from django.conf import settings
+from django.conf.urls.defaults import patterns
+from jinx_api.api.urls import call_dispatcher
+from llclusto.drivers import Class5Server, ServerClass, HostState
+import simplejson
+
+class TestMulticall(JinxTestCase):
+    api_call_path = "/jinx/2.0/multicall"
+
+    def data(self):
+        ServerClass("Class 5")
+        server1 = Class5Server("test1.lindenlab.com")
+        Class5Server("test2.lindenlab.com")
+        HostState("up")
+        server1.state = "up"
+
+    def test_normal_call(self):
+        response = self.do_api_call(["get_host_state", ["test1.lindenlab.com"]],
+                                    ["get_host_state", ["test2.lindenlab.com"]],
+                                    ["list_host_states", []])
+        self.assert_response_code(response, 200)
+        self.assertEqual(response.data, [{'status': 200, 'result': "up"},
+                                         {'status': 200, 'result': None},
+                                         {'status': 200, 'result': ["up"]}])
+
+    def test_empty_call(self):
+        response = self.do_api_call()
+        self.assert_response_code(response, 200)
+        self.assertEqual(response.data, [])
+
+    def test_mutating_call(self):
+        response = self.do_api_call(["set_host_state", ["test2.lindenlab.com", "up"]],
+                                    ["get_hosts_in_state", ["up"]])
+        self.assert_response_code(response, 200)
+        self.assertEqual(response.data[0], {'status': 200, 'result': None})
+        self.assertEqual(response.data[1]['status'], 200)
+        self.assertEqual(sorted(response.data[1]['result']), ["test1.lindenlab.com", "test2.lindenlab.com"])
+
+    def test_failed_calls(self):
+        response = self.do_api_call(["get_host_state", ["test3.lindenlab.com"]],
+                                    ["get_host_state", ["test1.lindenlab.com", 2]],
+                                    ["no_such_call", []],
+                                    "get_host_state",
+                                    ["get_host_state", ["test1.lindenlab.com"]])
+        self.assert_response_code(response, 200)
+        self.assertEqual([result['status'] for result in response.data], [404, 400, 404, 400, 200])
+        self.assertEqual(response.data[4]['result'], "up")
+
+    def test_version_calls(self):
+        # Calls overridden for a version of the protocol are overridden in
+        # that version's multicall too.
+        call_dispatcher._version_calls[('1.0', 'get_host_state')] = \
+            patterns('api.views', (r'get_host_state', 'host.list_host_states'))[0]
+
+        try:
+            calls = simplejson.dumps([["get_host_state", []]])
+            response = self.client.post("/jinx/1.0/multicall", calls, "application/json")
+            self.assert_response_code(response, 200)
+            self.assertEqual(simplejson.loads(response.content), [{'status': 200, 'result': ["up"]}])
+
+            response = self.client.post("/jinx/2.0/multicall", calls, "application/json")
+            self.assert_response_code(response, 200)
+            self.assertEqual(simplejson.loads(response.content)[0]['status'], 400)
+        finally:
+            del call_dispatcher._version_calls[('1.0', 'get_host_state')]
+
+    def test_authorization(self):
+        settings.JINX_AUTHORIZATION = {
+            'BACKEND': 'jinx_api.authorization.MemoryDirectory',
+            'OPTIONS': {'groups': {'bob': ['jinx-users']}},
+            'RULES': {'*': ['jinx-users'],
+                      'set_host_state': ['jinx-admins']},
+        }
+
+        calls = [["set_host_state", ["test2.lindenlab.com", "up"]],
+                 ["get_host_state", ["test2.lindenlab.com"]]]
+        response = self.client.post(self.api_call_path, simplejson.dumps(calls), "application/json",
+                                    REMOTE_USER="bob@LINDENLAB.COM")
+        self.assert_response_code(response, 200)
+
+        data = simplejson.loads(response.content)
+        self.assertEqual([result['status'] for result in data], [403, 200])
+        self.assertEqual(data[1]['result'], None, "The denied call shouldn't have been made")
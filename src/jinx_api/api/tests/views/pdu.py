@@ -18,3 +18,21 @@ class TestGetPduHostnames(JinxTestCase):
         self.assert_response_code(response, 200)
         self.assertEqual(sorted(response.data), ["pdu1.lindenlab.com", "pdu2.lindenlab.com"])
         
+
+class TestPowerCycleHosts(JinxTestCase):
+    api_call_path = "/jinx/2.0/power_cycle_hosts"
+
+    def test_empty_list(self):
+        response = self.do_api_call([])
+        self.assert_response_code(response, 200)
+        self.assertEqual(response.data, {})
+
+    def test_bad_call(self):
+        response = self.do_api_call("pdu1.lindenlab.com")
+        self.assert_response_code(response, 400)
+
+        response = self.do_api_call(["pdu1.lindenlab.com", 1])
+        self.assert_response_code(response, 400)
+
+        response = self.do_api_call([["pdu1.lindenlab.com"]])
+        self.assert_response_code(response, 400)
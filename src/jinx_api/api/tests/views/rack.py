@@ -1,6 +1,7 @@
 from api.tests.base import JinxTestCase
 import clusto
-from llclusto.drivers import Class5Server, Class7Server, Class7Chassis, ServerClass, LindenRack
+import llclusto
+from llclusto.drivers import Class5Server, Class7Server, Class7Chassis, ServerClass, LindenRack, LindenDatacenter, LindenPDU
 import sys
 
 class TestGetRackContents(JinxTestCase):
@@ -32,6 +33,90 @@ class TestGetRackContents(JinxTestCase):
         response = self.do_api_call("huh?", 2)
         self.assert_response_code(response, 400)
 
+    def test_query_count(self):
+        rack = clusto.get_by_name("c2-02-00")
+        
+        for i in xrange(3, 30):
+            rack.insert(Class5Server("hostname%d.lindenlab.com" % i), i)
+        
+        response = self.assert_max_queries(15, "c2-02-00")
+        self.assertEqual(len(response.data), 29)
+
+
+class TestGetRacksContents(JinxTestCase):
+    api_call_path = "/jinx/2.0/get_racks_contents"
+
+    def data(self):
+        # Populate Clusto
+        rack1 = LindenRack("c2-02-00")
+        rack2 = LindenRack("c2-02-01")
+        ServerClass("Class 5")
+        h1 = Class5Server("hostname1.lindenlab.com")
+        h1.serial_number = "SM55880"
+        h2 = Class5Server("hostname2.lindenlab.com")
+        rack1.insert(h1, 1)
+        rack1.insert(h2, 2)
+
+        ServerClass("Class 7")
+        chassis = Class7Chassis()
+        rack2.insert(chassis, [1, 2])
+        chassis.insert(Class7Server("hostname3.lindenlab.com"))
+        chassis.insert(Class7Server("hostname4.lindenlab.com"))
+
+    def test_normal_call(self):
+        response = self.do_api_call(["c2-02-00", "c2-02-01", "huh?"])
+        self.assert_response_code(response, 200)
+        self.assertEqual(response.data['c2-02-00'], {'status': 200,
+                                                     'result': [{'serial_number': 'SM55880',
+                                                                 'hostname': 'hostname1.lindenlab.com',
+                                                                 'type': 'server'},
+                                                                {'serial_number': None,
+                                                                 'hostname': 'hostname2.lindenlab.com',
+                                                                 'type': 'server'}]})
+        self.assertEqual(response.data['c2-02-01'], {'status': 200,
+                                                     'result': [{'serial_number': None,
+                                                                 'hostname': 'hostname3.lindenlab.com',
+                                                                 'type': 'server'},
+                                                                {'serial_number': None,
+                                                                 'hostname': 'hostname4.lindenlab.com',
+                                                                 'type': 'server'}]})
+        self.assertEqual(response.data['huh?']['status'], 404)
+
+    def test_matches_single_rack_call(self):
+        bulk = self.do_api_call(["c2-02-00", "c2-02-01"])
+
+        self.api_call_path = TestGetRackContents.api_call_path
+
+        for rack_name in ["c2-02-00", "c2-02-01"]:
+            self.assertEqual(bulk.data[rack_name]['result'], self.do_api_call(rack_name).data)
+
+    def test_bad_call(self):
+        response = self.do_api_call("c2-02-00")
+        self.assert_response_code(response, 400)
+
+        response = self.do_api_call(["c2-02-00", ["c2-02-01"]])
+        self.assert_response_code(response, 400)
+
+        response = self.do_api_call([{"rack": "c2-02-00"}])
+        self.assert_response_code(response, 400)
+
+    def test_query_count(self):
+        rack_names = ["c2-02-00", "c2-02-01"]
+
+        for rack_num in xrange(2, 8):
+            rack = LindenRack("c2-02-%02d" % rack_num)
+            rack_names.append(rack.name)
+
+            for position in xrange(1, 6):
+                rack.insert(Class5Server("hostname%d-%d.lindenlab.com" % (rack_num, position)), position)
+
+        response = self.assert_max_queries(15, rack_names)
+        self.assertEqual(sorted(response.data), sorted(rack_names))
+
+        for rack_name in rack_names[2:]:
+            self.assertEqual(response.data[rack_name]['status'], 200)
+            self.assertEqual(len(response.data[rack_name]['result']), 5)
+
 
 class TestGetServerHostnamesInRack(JinxTestCase):
     api_call_path = "/jinx/2.0/get_server_hostnames_in_rack"
@@ -71,3 +156,67 @@ class TestGetServerHostnamesInRack(JinxTestCase):
         self.assert_response_code(response, 200)
         self.assertEqual(sorted(response.data), ['hostname1.lindenlab.com'])
 
+
+class TestGetRackRemoteHandsInfo(JinxTestCase):
+    api_call_path = "/jinx/2.0/get_rack_remote_hands_info"
+
+    def data(self):
+        # Populate Clusto
+        dfw = LindenDatacenter("DFW", "1234 Anywhere", "123 Anywhere street", "remotehands@remote.com")
+        rack = LindenRack("c1.01.1000")
+        dfw.insert(rack)
+
+        ServerClass("Class 5")
+        h1 = Class5Server("hostname1.lindenlab.com")
+        h1.serial_number = "SM55880"
+        h1.set_port_attr("nic-eth", 1, "mac", "aa:bb:cc:11:22:33")
+        h1.set_port_attr("nic-eth", 2, "mac", "aa:bb:cc:11:22:34")
+        rack.insert(h1, 3)
+
+        ServerClass("Class 7")
+        chassis = Class7Chassis()
+        rack.insert(chassis, [1, 2])
+        class7 = Class7Server("hostname2.lindenlab.com")
+        chassis.insert(class7)
+
+        Class5Server("hostname3.lindenlab.com")
+
+    def test_normal_call(self):
+        response = self.do_api_call("c1.01.1000")
+        self.assert_response_code(response, 200)
+        self.assertEqual([info['hostname'] for info in response.data],
+                         ['hostname2.lindenlab.com', 'hostname1.lindenlab.com'])
+        self.assertEqual(response.data[1], {'macs': ['aa:bb:cc:11:22:33', 'aa:bb:cc:11:22:34'],
+                                            'positions': [3],
+                                            'hostname': 'hostname1.lindenlab.com',
+                                            'pdu_connections': [],
+                                            'serial_number': 'SM55880',
+                                            'colo': 'DFW',
+                                            'rack': "c1.01.1000"})
+        self.assertEqual(response.data[0]['positions'], [1, 2])
+        self.assertEqual(response.data[0]['colo'], 'DFW')
+
+    def test_pdu_connections(self):
+        pdu = LindenPDU()
+        pdu.hostname = "pdu1-c1-01-1000.dfw.lindenlab.com"
+
+        # The class 5 is powered directly and the class 7 through its chassis.
+        clusto.get_by_name("hostname1.lindenlab.com").connect_ports("pwr-nema-5", 1, pdu, 3)
+        class7 = clusto.get_by_name("hostname2.lindenlab.com")
+        llclusto.drivers.LindenServerChassis.get_chassis(class7).connect_ports("pwr-nema-5", 1, pdu, 4)
+
+        response = self.do_api_call("c1.01.1000")
+        self.assert_response_code(response, 200)
+        self.assertEqual([info['pdu_connections'] for info in response.data],
+                         [[{'pdu': "pdu1-c1-01-1000.dfw.lindenlab.com", 'port': 4}],
+                          [{'pdu': "pdu1-c1-01-1000.dfw.lindenlab.com", 'port': 3}]])
+
+        self.api_call_path = "/jinx/2.0/get_host_remote_hands_info"
+
+        for info in response.data:
+            single = self.do_api_call(info['hostname'])
+            self.assertEqual(info, single.data)
+
+    def test_bad_call(self):
+        response = self.do_api_call("huh?")
+        self.assert_response_code(response, 404)
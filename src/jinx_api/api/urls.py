@@ -1,12 +1,20 @@
 from django.conf.urls.defaults import *
+from jinx_api.dispatch import CallDispatcher
 
+# Each pattern is the exact name of an API call; see CallDispatcher.
 api_calls = patterns('api.views',
+    (r'get_racks_contents', 'rack.get_racks_contents'),
     (r'get_rack_contents', 'rack.get_rack_contents'),
     (r'get_server_hostnames_in_rack', 'rack.get_server_hostnames_in_rack'),
+    (r'get_rack_remote_hands_info', 'rack.get_rack_remote_hands_info'),
     (r'get_hosts_by_regex', 'host.get_hosts_by_regex'),
     
+    (r'get_hosts_remote_hands_info', 'host.get_hosts_remote_hands_info'),
     (r'get_host_remote_hands_info', 'host.get_host_remote_hands_info'),
+    (r'get_hosts_state', 'host.get_hosts_state'),
+    (r'get_host_state_changes', 'host.get_host_state_changes'),
     (r'get_host_state', 'host.get_host_state'),
+    (r'set_hosts_state', 'host.set_hosts_state'),
     (r'set_host_state', 'host.set_host_state'),
     (r'get_hosts_in_state', 'host.get_hosts_in_state'),
     (r'list_host_states', 'host.list_host_states'),
@@ -14,22 +22,48 @@ api_calls = patterns('api.views',
     (r'get_server_class_info', 'host.get_server_class_info'),
 
     (r'get_pdu_hostnames', 'pdu.get_pdu_hostnames'),
+
+    (r'power_cycle_hosts', 'pdu.power_cycle_hosts'),
+    (r'power_on_hosts', 'pdu.power_on_hosts'),
+    (r'power_off_hosts', 'pdu.power_off_hosts'),
+    (r'power_status_hosts', 'pdu.power_status_hosts'),
+    (r'power_cycle_async', 'pdu.power_cycle_async'),
+    (r'power_on_async', 'pdu.power_on_async'),
+    (r'power_off_async', 'pdu.power_off_async'),
+    (r'power_status_async', 'pdu.power_status_async'),
     (r'power_cycle', 'pdu.power_cycle'),
     (r'power_on', 'pdu.power_on'),
     (r'power_off', 'pdu.power_off'),
     (r'power_status', 'pdu.power_status'),
+
+    (r'get_job_status', 'job.get_job_status'),
+    (r'wait_for_jobs', 'job.wait_for_jobs'),
 )
 
-urlpatterns = patterns('api.views',
-    # If we need to do anything specific in older versions of the protocol, add specific
-    # rules here, like this:
-    # (r'2\.0/get_rack_contents', 'rack.get_rack_contents_2_0')
+# If we need to do anything specific in older versions of the protocol, add
+# calls for them here, by version, like this:
+#
+#    '2.0': patterns('api.views',
+#        (r'get_rack_contents', 'rack.get_rack_contents_2_0'),
+#    ),
+version_calls = {
+}
+
+# Routes /jinx/<version>/<call>; multicall looks its calls up here too.
+call_dispatcher = CallDispatcher(r'^[0-9.-]+/', api_calls, version_calls)
 
+urlpatterns = patterns('api.views',
     # (r'(?P<call>[^/]+)/doc', 'meta.get_documentation')
     # (r'list_calls', 'meta.list_calls')
 
-    # otherwise, strip off the version and go to the list of API calls
-    (r'[0-9.-]+/', include(api_calls))
+    # Performance metrics, for Prometheus
+    (r'^metrics$', 'meta.metrics'),
+
+    # Make several API calls in one request
+    (r'^[0-9.-]+/multicall$', 'meta.multicall'),
+
+    # otherwise, strip off the version and look up the API call by name
+    call_dispatcher,
 )
 
 
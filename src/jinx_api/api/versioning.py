@@ -0,0 +1,30 @@
+"""Helpers for noticing when the data in clusto has changed."""
+
+import clusto
+import hashlib
+
+def get_clusto_version():
+    """Return a value that changes whenever clusto's data changes.
+
+    Clusto records a new version number in its versioning table for every
+    transaction that writes to the database, so the latest version number is a
+    cheap change counter: it's a single indexed query, no matter how big the
+    database is.  The number is paired with the engine clusto is bound to, so
+    that reconnecting to a different database (as the test suite does) never
+    looks like "nothing changed".  Only compare these values with ==; they
+    aren't meant to be serialized.
+    """
+
+    return (clusto.SESSION.bind, clusto.get_latest_version_number())
+
+def get_version_tag():
+    """Return a string that changes whenever clusto's data changes.
+
+    Unlike get_clusto_version(), this is the same in every server process
+    connected to the same database, so it can be handed to clients (e.g. in
+    an ETag).  The database URL is hashed, so as not to give away passwords.
+    """
+
+    database = hashlib.sha1(str(clusto.SESSION.bind.url)).hexdigest()[:12]
+
+    return '%s-%d' % (database, clusto.get_latest_version_number())
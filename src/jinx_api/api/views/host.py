@@ -1,8 +1,15 @@
 import clusto
 import llclusto
+import math
 import re
 from django.http import HttpResponseBadRequest, HttpResponseNotFound, HttpResponseBadRequest, HttpResponse
+from django.conf import settings
 from jinx_api.http import HttpResponseInvalidState
+from jinx_api import changes
+from jinx_api.api.hostindex import hostname_index
+from jinx_api.api.inventory import InventorySnapshot, hostnames_in
+from jinx_api.pagination import get_page_request, paginate
+from jinx_api.registry import paginated, query_budget
 import traceback
 
 def _get_host_instance(request, hostname_or_mac):
@@ -38,6 +45,7 @@ def _get_host_instance(request, hostname_or_mac):
     
     return host
 
+@paginated(basestring)
 def get_hosts_by_regex(request, regex, flags=re.I):
     """Return a list of hostnames of all hosts matching a given regular expression.  
     
@@ -61,20 +69,11 @@ def get_hosts_by_regex(request, regex, flags=re.I):
     except re.error, e:
         return HttpResponseBadRequest("regular expression syntax error: " + str(e))
     
-    # I could start off with clusto.get_entities(attrs={'subkey': 'hostname'}),
-    # but that would be slow because it would load every single host's full 
-    # attribute list.  Using do_attr_query only fetches the hostname
-    # attributes.
+    # Searching every hostname attribute in the database on each call gets
+    # slow with a large fleet, so use the in-process hostname index.  It only
+    # runs the regex against hostnames that contain the regex's literal text.
     
-    hostname_attrs = clusto.drivers.Driver.do_attr_query(subkey='hostname')
-    
-    matching_hostnames = []
-    
-    for attr in hostname_attrs:
-        if attr.value is not None and host_re.search(attr.value):
-                matching_hostnames.append(attr.value)
-    
-    return matching_hostnames
+    return paginate(request, hostname_index.search(host_re), key=lambda hostname: hostname)
     
 def get_host_remote_hands_info(request, hostname_or_mac):
     """Return information that will help remote hands identify a host.
@@ -172,6 +171,48 @@ def get_host_remote_hands_info(request, hostname_or_mac):
     
     return info
     
+def get_hosts_remote_hands_info(request, hosts_or_macs):
+    """Return remote hands information for many hosts at once.
+
+    This is much faster than calling get_host_remote_hands_info() once per
+    host: the data for all of the hosts is loaded in a few queries.
+
+    Returns a dict mapping each hostname or MAC address to a dict like this:
+
+    {"status": 200, "result": ...}
+
+    "status" is the HTTP status code that get_host_remote_hands_info would
+    have returned for that host.  "result" is what it would have returned, or
+    the error message.
+
+    Arguments:
+        hosts_or_macs -- A list of hostnames or MAC addresses.
+
+    Exceptions Raised:
+        JinxInvalidRequestError -- hosts_or_macs was not a list.
+    """
+
+    if not isinstance(hosts_or_macs, list):
+        return HttpResponseBadRequest("Expected a list of hostnames or MAC addresses; got %s" % str(type(hosts_or_macs)))
+
+    snapshot = InventorySnapshot()
+    matches = snapshot.find_hosts(hosts_or_macs)
+    snapshot.load()
+
+    results = {}
+
+    for host_or_mac, entity_ids in matches.iteritems():
+        if not entity_ids:
+            results[host_or_mac] = {'status': 404,
+                                    'result': 'No host was found with hostname or MAC address "%s".' % host_or_mac}
+        elif len(entity_ids) > 1:
+            results[host_or_mac] = {'status': 409,
+                                    'result': 'More than one host found with hostname or MAC address "%s".' % host_or_mac}
+        else:
+            results[host_or_mac] = {'status': 200, 'result': snapshot.get_remote_hands_info(entity_ids[0])}
+
+    return results
+
 def get_host_state(request, hostname):
     """Gets the state of a host.
     
@@ -191,6 +232,45 @@ def get_host_state(request, hostname):
     except IndexError:
         return HttpResponseNotFound("Host %s not found." % hostname)
     
+def get_hosts_state(request, hostnames):
+    """Gets the states of many hosts at once.
+    
+    The states are looked up for all of the hosts together, in a couple of
+    queries, so this is much faster than calling get_host_state() once per
+    host.
+    
+    Returns a dict mapping each hostname to its state, or to null if the host
+    has no state set.  Hostnames that don't match any host are left out.
+    
+    Arguments:
+        hostnames -- A list of hostnames, or a regular expression string to
+            get the state of every host whose hostname it matches (see
+            get_hosts_by_regex()).
+    
+    Exceptions Raised:
+        JinxInvalidRequestError -- hostnames was neither a list of strings nor
+            a string, or was an invalid regular expression.
+    """
+    
+    if isinstance(hostnames, basestring):
+        try:
+            hostnames = hostname_index.search(re.compile(hostnames, re.I))
+        except re.error, e:
+            return HttpResponseBadRequest("regular expression syntax error: " + str(e))
+    elif not isinstance(hostnames, list):
+        return HttpResponseBadRequest("Expected a list of hostnames or a regular expression; got %s" % str(type(hostnames)))
+    
+    for hostname in hostnames:
+        if not isinstance(hostname, basestring):
+            return HttpResponseBadRequest("Hostnames must be strings; got %s" % str(hostname))
+    
+    snapshot = InventorySnapshot()
+    matches = snapshot.find_hosts(hostnames)
+    states = snapshot.load_states([entity_id for entity_ids in matches.itervalues() for entity_id in entity_ids])
+    
+    # Like get_host_state, use the first host if several share a hostname.
+    return dict((hostname, states[min(entity_ids)]) for hostname, entity_ids in matches.iteritems() if entity_ids)
+    
 def set_host_state(request, hostname, state):
     """Sets the state of a host.  
     
@@ -208,6 +288,7 @@ def set_host_state(request, hostname, state):
     
     try:
         host = llclusto.get_by_hostname(hostname)[0]
+        old_state = host.state
         
         if state is None:
             del host.state
@@ -218,11 +299,103 @@ def set_host_state(request, hostname, state):
     except ValueError:
         return HttpResponseInvalidState("State %s does not exist." % state)
     
+    changes.record_changes('set_host_state', [{'hostname': hostname, 'old_state': old_state, 'state': state}])
+    
+def set_hosts_state(request, hostnames, state):
+    """Sets the state of many hosts at once.
+    
+    All of the hosts are looked up together, and all of the changes are made
+    in a single transaction, so this is much faster than calling
+    set_host_state() once per host.
+    
+    Returns a dict mapping each hostname to a dict like this:
+    
+    {"status": 200, "result": null}
+    
+    "status" is 200 if the host's state was set, 404 if the host was not
+    found, or 409 if the state does not exist or more than one host has the
+    hostname.  "result" is null, or the error message.
+    
+    Arguments:
+        hostnames -- A list of hostnames, or a regular expression string to
+            set the state of every host whose hostname it matches (see
+            get_hosts_by_regex()).
+        state -- The state to set the hosts to, as in set_host_state().  This
+            state must already exist (see list_states()).  If it's null, the
+            hosts' states are removed.
+    
+    Exceptions Raised:
+        JinxInvalidRequestError -- hostnames was neither a list of strings nor
+            a string, or was an invalid regular expression.
+    """
+    
+    if isinstance(hostnames, basestring):
+        try:
+            hostnames = hostname_index.search(re.compile(hostnames, re.I))
+        except re.error, e:
+            return HttpResponseBadRequest("regular expression syntax error: " + str(e))
+    elif not isinstance(hostnames, list):
+        return HttpResponseBadRequest("Expected a list of hostnames or a regular expression; got %s" % str(type(hostnames)))
+    
+    for hostname in hostnames:
+        if not isinstance(hostname, basestring):
+            return HttpResponseBadRequest("Hostnames must be strings; got %s" % str(hostname))
+    
+    if state is not None and not clusto.get_entities(names=[state], clusto_drivers=[llclusto.drivers.HostState]):
+        return dict((hostname, {'status': 409, 'result': "State %s does not exist." % state}) for hostname in hostnames)
+    
+    snapshot = InventorySnapshot()
+    matches = snapshot.find_hosts(hostnames)
+    old_states = snapshot.load_states([entity_id for entity_ids in matches.itervalues() for entity_id in entity_ids])
+    
+    results = {}
+    changed = []
+    
+    clusto.begin_transaction()
+    
+    try:
+        for hostname, entity_ids in matches.iteritems():
+            if not entity_ids:
+                results[hostname] = {'status': 404, 'result': "Host %s not found." % hostname}
+                continue
+            
+            if len(entity_ids) > 1:
+                results[hostname] = {'status': 409, 'result': "More than one host found with hostname %s." % hostname}
+                continue
+            
+            host = snapshot.get_driver(entity_ids[0])
+            
+            try:
+                if state is None:
+                    del host.state
+                else:
+                    host.state = state
+            except ValueError, e:
+                results[hostname] = {'status': 409, 'result': "Could not set the state of %s: %s" % (hostname, e)}
+                continue
+            
+            results[hostname] = {'status': 200, 'result': None}
+            changed.append({'hostname': hostname, 'old_state': old_states[entity_ids[0]], 'state': state})
+        
+        clusto.commit()
+    except:
+        clusto.rollback_transaction()
+        raise
+    
+    changes.record_changes('set_hosts_state', changed)
+    
+    return results
+    
+@paginated(basestring)
+@query_budget(10)
 def get_hosts_in_state(request, state):
     """Gets a list of all hosts in the specified state.
     
+    Large states can be read a page at a time, with the page_size and cursor
+    query parameters.
+    
     Returns:
-        A list of hostnames.
+        A list of hostnames, sorted.
         
     Arguments:
         state -- The name of the state.
@@ -230,12 +403,25 @@ def get_hosts_in_state(request, state):
     Exceptions Raised:
         JinxInvalidStateError -- The specified state does not exist.  Please see list_states() for a list of valid states.
     """
+    
     try:
-        state = clusto.get_entities(names=[state], clusto_drivers=[llclusto.drivers.HostState])[0]
-        return [host.hostname for host in state]
+        state_entity = clusto.get_entities(names=[state], clusto_drivers=[llclusto.drivers.HostState])[0]
     except IndexError:
         return HttpResponseInvalidState("State %s does not exist." % state)
     
+    page_request = get_page_request(request)
+    
+    # Iterating over the state would load every host's driver and then fetch
+    # its hostname separately; query the hostnames directly instead.
+    if page_request is None:
+        return (hostname for (hostname,) in hostnames_in(state_entity.entity.entity_id))
+    
+    hostnames = [hostname for (hostname,) in hostnames_in(state_entity.entity.entity_id, page_request.position,
+                                                          page_request.size + 1)]
+    
+    return page_request.page(hostnames, lambda hostname: hostname)
+    
+@query_budget(10)
 def list_host_states(request):
     """Gets a list of all defined host states.
     
@@ -266,9 +452,65 @@ def add_host_state(request, state):
     
     try:
         llclusto.drivers.HostState(state)
-        return None
     except clusto.exceptions.NameException:
         return HttpResponseInvalidState("A state named '%s' already exists." % state)
+    
+    changes.record_changes('add_host_state', [{'state': state}])
+    
+    return None
+
+def get_host_state_changes(request, since=None, timeout=0):
+    """Gets the host state changes made after the one numbered since.
+    
+    Every change made by set_host_state, set_hosts_state and add_host_state
+    is recorded in a log with an increasing sequence number.  Rather than
+    polling the state of every host, a client can call this without since to
+    get the latest sequence number, read the current states, and then keep
+    calling this with the last sequence number it has seen.  If there are no
+    newer changes, the call waits for one for up to timeout seconds.
+    
+    Returns a dict like this:
+    
+    {"changes": [{"seq":       1234,
+                  "time":      1308000000.0,
+                  "call":      "set_host_state",
+                  "hostname":  "sim1234.agni.lindenlab.com",
+                  "old_state": "up",
+                  "state":     "down"},
+                 ...],
+     "last_seq": 1234,
+     "truncated": false}
+    
+    Changes are listed oldest first, at most 1000 at a time.  Pass "last_seq"
+    as since in the next call.  add_host_state changes have a null hostname
+    and old_state.  If "truncated" is true, changes after since have been
+    forgotten, so the client should read the current states again.  Times
+    are in seconds since the epoch.
+    
+    Arguments:
+        since -- optional; the sequence number of the last change the client
+            has seen.  If it's null (the default), no changes are returned,
+            only the latest sequence number.
+        timeout -- optional; the maximum number of seconds to wait for a
+            change (defaults to 0, not to wait).  Capped at
+            JINX_CHANGES_MAX_WAIT seconds.
+    
+    Exceptions Raised:
+        JinxInvalidRequestError -- since was not an integer, or timeout was
+            not a finite number.
+    """
+    
+    if since is not None and (not isinstance(since, (int, long)) or isinstance(since, bool) or since < 0):
+        return HttpResponseBadRequest("since must be a change sequence number; got %s" % str(since))
+    
+    # JSON decoders accept NaN and Infinity, which would never time out.
+    if (not isinstance(timeout, (int, long, float)) or timeout < 0 or
+        math.isnan(timeout) or math.isinf(timeout)):
+        return HttpResponseBadRequest("timeout must be a number of seconds; got %s" % str(timeout))
+    
+    timeout = min(timeout, getattr(settings, 'JINX_CHANGES_MAX_WAIT', 60))
+    
+    return changes.get_changes(since, timeout)
 
 
 def get_server_class_info(request, hostname_or_mac):
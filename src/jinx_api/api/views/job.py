@@ -0,0 +1,70 @@
+import math
+from django.conf import settings
+from django.http import HttpResponseBadRequest, HttpResponseNotFound
+from jinx_api import jobs
+
+def get_job_status(request, job_id):
+    """Returns the status of a background job, such as one started by power_cycle_async().
+
+    Returns a dict like this:
+
+    {"id":           "8c4a1b0e2f6d4e1f9d0a7b3c5e2f1a09",
+     "call":         "power_cycle",
+     "args":         ["sim1234.agni.lindenlab.com"],
+     "state":        "finished",
+     "submitted_at": 1308000000.0,
+     "started_at":   1308000000.1,
+     "finished_at":  1308000004.2,
+     "deadline":     1308000300.0,
+     "status":       200,
+     "result":       ...}
+
+    "state" is "queued", "running" or "finished".  Once the job has finished,
+    "status" and "result" hold the HTTP status code and result the call would
+    have returned if it had been made directly.  A job still unfinished at
+    its deadline is finished with a status of 504.  Times are in seconds
+    since the epoch.
+
+    Arguments:
+        job_id -- The ID of the job.
+
+    Exceptions Raised:
+        JinxDataNotFoundError -- There is no job with that ID.  Jobs are
+            forgotten a while after they're submitted.
+    """
+
+    job = jobs.get_job(job_id)
+
+    if job is None:
+        return HttpResponseNotFound("Job %s not found." % job_id)
+
+    return job
+
+def wait_for_jobs(request, job_ids, timeout=10):
+    """Waits for background jobs to finish and returns their status.
+
+    Returns as soon as all of the jobs have finished, or after timeout seconds,
+    whichever comes first.  Returns a dict mapping each job ID to a dict like
+    the one get_job_status() returns, or to null if there is no such job.
+
+    Arguments:
+        job_ids -- A list of job IDs.
+        timeout -- optional; the maximum number of seconds to wait (defaults
+            to 10).  Capped at JINX_JOB_MAX_WAIT seconds.
+
+    Exceptions Raised:
+        JinxInvalidRequestError -- job_ids was not a list, or timeout was not
+            a finite number.
+    """
+
+    if not isinstance(job_ids, list):
+        return HttpResponseBadRequest("Expected a list of job IDs; got %s" % str(type(job_ids)))
+
+    # JSON decoders accept NaN and Infinity, which would never time out.
+    if (not isinstance(timeout, (int, long, float)) or timeout < 0 or
+        math.isnan(timeout) or math.isinf(timeout)):
+        return HttpResponseBadRequest("timeout must be a number of seconds; got %s" % str(timeout))
+
+    timeout = min(timeout, getattr(settings, 'JINX_JOB_MAX_WAIT', 60))
+
+    return jobs.wait_for_jobs(job_ids, timeout)
@@ -0,0 +1,87 @@
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseBadRequest
+from jinx_api.authorization import check_authorization
+from jinx_api.middleware import call_view
+from jinx_api.metrics import registry as metrics_registry
+from jinx_api.registry import raw_view
+
+def multicall(request, *calls):
+    """Perform several API calls in a single request.
+
+    Each argument describes one call as a list of the call name and a list of
+    arguments for it, like this:
+
+    [["get_host_state", ["sim1234.agni.lindenlab.com"]],
+     ["get_server_class_info", ["sim1234.agni.lindenlab.com"]],
+     ["list_host_states", []]]
+
+    The calls are made in order.  A failing call does not stop the calls after
+    it.  Returns a list with one dict per call, in the same order, like this:
+
+    [{"status": 200, "result": "up"},
+     {"status": 404, "result": "No host was found with hostname ..."},
+     {"status": 200, "result": ["up", "down"]}]
+
+    "status" is the HTTP status code the call would have returned on its own.
+    "result" is the data the call returned if it succeeded, or the body of the
+    error response otherwise.  Each call behaves as it does in the version of
+    the protocol in the multicall's URL.
+
+    Arguments:
+        calls -- Any number of [call_name, [arguments...]] lists.
+
+    Exceptions Raised:
+        JinxInvalidRequestError -- More calls were requested than the server
+            allows in a single multicall (JINX_MULTICALL_LIMIT).
+    """
+
+    limit = getattr(settings, 'JINX_MULTICALL_LIMIT', None)
+
+    if limit is not None and len(calls) > limit:
+        return HttpResponseBadRequest("A multicall may contain at most %d calls (got %d)." % (limit, len(calls)))
+
+    from jinx_api.api.urls import call_dispatcher
+
+    # The URL is /jinx/<version>/multicall.
+    version = request.path.rstrip('/').split('/')[-2]
+    results = []
+
+    for call in calls:
+        if (not isinstance(call, list) or len(call) != 2 or
+            not isinstance(call[0], basestring) or not isinstance(call[1], list)):
+            results.append({'status': 400,
+                            'result': 'Expected a [call_name, [arguments...]] list; got %s' % str(call)})
+            continue
+
+        call_name, args = call
+        pattern = call_dispatcher.get_pattern(version, call_name)
+
+        if pattern is None:
+            results.append({'status': 404, 'result': 'No such API call: %s' % call_name})
+            continue
+
+        denied = check_authorization(request, call_name)
+
+        if denied is not None:
+            results.append({'status': denied.status_code, 'result': denied.content})
+            continue
+
+        result = call_view(request, pattern.callback, args, {}, stream=False)
+
+        if isinstance(result, HttpResponse):
+            results.append({'status': result.status_code, 'result': result.content})
+        else:
+            results.append({'status': 200, 'result': result})
+
+    return results
+
+@raw_view
+def metrics(request):
+    """Return this server process's performance metrics, for Prometheus to scrape.
+
+    This is not a JSON API call: it's fetched with a plain GET of /jinx/metrics,
+    and returns text in the Prometheus exposition format.  See jinx_api.metrics
+    for what's recorded.
+    """
+
+    return HttpResponse(metrics_registry.render(), mimetype='text/plain; version=0.0.4')
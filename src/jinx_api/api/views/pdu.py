@@ -1,15 +1,34 @@
 import clusto
+import functools
 import llclusto
 import re
+import threading
+import time
+import traceback
+from django.conf import settings
 from django.http import HttpResponseBadRequest, HttpResponseNotFound, HttpResponse
+from jinx_api.api.inventory import hostnames_of
+from jinx_api.jobs import submit_job
+from jinx_api.pagination import get_page_request
+from jinx_api.registry import paginated, query_budget
+from jinx_api.workers import WorkerPool
 
+@paginated(basestring)
+@query_budget(5)
 def get_pdu_hostnames(request):
-    """Returns a list of hostnames for all hosts with a driver of LindenPDU.
+    """Returns a list of hostnames for all hosts with a driver of LindenPDU, sorted.
     """
 
-    pdus = clusto.get_entities(clusto_drivers=[llclusto.drivers.LindenPDU])
-    
-    return [pdu.hostname for pdu in pdus if pdu.hostname.lower() != 'missing']
+    # Query the hostnames directly rather than loading every PDU's driver.
+    page_request = get_page_request(request)
+
+    if page_request is None:
+        return (hostname for (hostname,) in hostnames_of(llclusto.drivers.LindenPDU))
+
+    hostnames = [hostname for (hostname,) in hostnames_of(llclusto.drivers.LindenPDU, page_request.position,
+                                                          page_request.size + 1)]
+
+    return page_request.page(hostnames, lambda hostname: hostname)
 
 def get_host_or_mac_object(request, hostname_or_mac):
     """ Returns an object for a hostname or a mac address...
@@ -33,6 +52,30 @@ def get_host_or_mac_object(request, hostname_or_mac):
     else:
         return hosts[0]
 
+def _power_cycle(host):
+    if host.has_ipmi():
+        return host.ipmi_power_cycle()
+    else:
+        return host.power_cycle()
+
+def _power_off(host):
+    if host.has_ipmi():
+        return host.ipmi_power_off()
+    else:
+        return host.power_off()
+
+def _power_on(host):
+    if host.has_ipmi():
+        return host.ipmi_power_on()
+    else:
+        return host.power_on()
+
+def _power_status(host):
+    if host.has_ipmi():
+        return host.ipmi_power_status()
+    else:
+        return HttpResponse('%s is not IPMI enabled. Power status is not available...' % host.hostname, status=409)
+
 def power_cycle(request, host_or_mac):
     """
     """
@@ -41,10 +84,7 @@ def power_cycle(request, host_or_mac):
     if isinstance(host, HttpResponse):
         return host
     
-    if host.has_ipmi():
-        return host.ipmi_power_cycle()
-    else:
-        return host.power_cycle()
+    return _power_cycle(host)
 
 def power_off(request, host_or_mac):
     """
@@ -54,10 +94,7 @@ def power_off(request, host_or_mac):
     if isinstance(host, HttpResponse):
         return host
     
-    if host.has_ipmi():
-        return host.ipmi_power_off()
-    else:
-        return host.power_off()
+    return _power_off(host)
 
 def power_on(request, host_or_mac):
     """ Powers on a host
@@ -67,10 +104,7 @@ def power_on(request, host_or_mac):
     if isinstance(host, HttpResponse):
         return host
     
-    if host.has_ipmi():
-        return host.ipmi_power_on()
-    else:
-        return host.power_on()
+    return _power_on(host)
 
 def power_status(request, host_or_mac):
     """
@@ -80,13 +114,278 @@ def power_status(request, host_or_mac):
     if isinstance(host, HttpResponse):
         return host
     
-    if host.has_ipmi():
-        return host.ipmi_power_status()
-    else:
-        return HttpResponse('%s is not IPMI enabled. Power status is not available...' % host.hostname, status=409)
+    return _power_status(host)
 
-    
+# Power operations on many hosts at once run on this pool of worker threads.
+# It's created the first time it's needed, sized by JINX_POWER_WORKERS.
+_power_pool = None
+_power_pool_lock = threading.Lock()
 
+# Maps PDU hostnames to semaphores limiting how many operations may use that
+# PDU at once (JINX_POWER_PER_PDU_LIMIT).
+_pdu_semaphores = {}
 
-    
-        
+def _get_power_pool():
+    global _power_pool
+
+    _power_pool_lock.acquire()
+    try:
+        if _power_pool is None:
+            _power_pool = WorkerPool(getattr(settings, 'JINX_POWER_WORKERS', 16), name='jinx-power')
+
+        return _power_pool
+    finally:
+        _power_pool_lock.release()
+
+def _get_pdu_semaphore(pdu_hostname):
+    _power_pool_lock.acquire()
+    try:
+        if pdu_hostname not in _pdu_semaphores:
+            _pdu_semaphores[pdu_hostname] = threading.Semaphore(getattr(settings, 'JINX_POWER_PER_PDU_LIMIT', 4))
+
+        return _pdu_semaphores[pdu_hostname]
+    finally:
+        _power_pool_lock.release()
+
+def _get_connected_pdu_hostnames(host):
+    """Return the sorted hostnames of the PDUs a host's power supplies are plugged into."""
+
+    try:
+        port_info = host.port_info
+
+        # If the host doesn't have power connections, maybe it's a class 7 in a chassis.  Try that.
+        if 'pwr-nema-5' not in port_info:
+            chassis = llclusto.drivers.LindenServerChassis.get_chassis(host)
+            port_info = chassis.port_info
+
+        return sorted(set(port['connection'].hostname for port in port_info['pwr-nema-5'].values()
+                          if port['connection']))
+    except (KeyError, AttributeError, IndexError):
+        return []
+
+def _acquire_before(semaphore, deadline):
+    """Acquire a semaphore, giving up at deadline (a time.time() value, or None to wait forever).
+
+    Returns True if the semaphore was acquired.
+    """
+
+    if deadline is None:
+        return semaphore.acquire()
+
+    while not semaphore.acquire(False):
+        if time.time() >= deadline:
+            return False
+
+        time.sleep(0.05)
+
+    return True
+
+def _run_power_operation(operation, host_or_mac, deadline=None):
+    """Perform a power operation on one host.  Runs on a worker thread.
+
+    Operations going through a PDU (rather than IPMI) hold that PDU's
+    semaphore, so that no PDU gets more than JINX_POWER_PER_PDU_LIMIT
+    requests at once.  If deadline is given, an operation still waiting for
+    a semaphore then gives up, rather than keep a worker thread waiting for
+    a PDU that's busy with hung requests.
+    """
+
+    try:
+        host = get_host_or_mac_object(None, host_or_mac)
+
+        if isinstance(host, HttpResponse):
+            return host
+
+        if host.has_ipmi():
+            return operation(host)
+
+        # Always acquire in sorted order, so two hosts sharing PDUs can't deadlock.
+        semaphores = [_get_pdu_semaphore(pdu) for pdu in _get_connected_pdu_hostnames(host)]
+
+        acquired = []
+
+        try:
+            for semaphore in semaphores:
+                if not _acquire_before(semaphore, deadline):
+                    return HttpResponse('Timed out waiting for a PDU that %s is plugged into.' % host_or_mac, status=504)
+
+                acquired.append(semaphore)
+
+            return operation(host)
+        finally:
+            for semaphore in acquired:
+                semaphore.release()
+    finally:
+        # Each worker thread has its own clusto session.  Don't let it hold on
+        # to objects (and a transaction) between tasks.
+        clusto.SESSION.remove()
+
+def _power_hosts(operation, hosts_or_macs):
+    """Perform a power operation on many hosts concurrently.
+
+    Returns a dict mapping each of hosts_or_macs to a dict with the keys
+    "status" and "result", as in multicall.
+    """
+
+    if not isinstance(hosts_or_macs, list):
+        return HttpResponseBadRequest("Expected a list of hostnames or MAC addresses; got %s" % str(type(hosts_or_macs)))
+
+    for host_or_mac in hosts_or_macs:
+        if not isinstance(host_or_mac, basestring):
+            return HttpResponseBadRequest("Hostnames and MAC addresses must be strings; got %s" % str(host_or_mac))
+
+    # One deadline covers the whole call, including time spent waiting for a
+    # free worker thread.
+    timeout = getattr(settings, 'JINX_POWER_TIMEOUT', 30)
+    deadline = time.time() + timeout
+    pool = _get_power_pool()
+
+    tasks = {}
+
+    for host_or_mac in set(hosts_or_macs):
+        tasks[host_or_mac] = pool.submit(_run_power_operation, operation, host_or_mac, deadline)
+
+    results = {}
+
+    for host_or_mac, task in tasks.iteritems():
+        if not task.wait(max(0, deadline - time.time())):
+            # Don't let a hung operation hold on to its worker thread, or a
+            # few hung BMCs would leave none for later calls.
+            if pool.abandon(task):
+                message = 'Power operation on %s did not start within %s seconds.' % (host_or_mac, timeout)
+            else:
+                message = 'Power operation on %s did not finish within %s seconds.' % (host_or_mac, timeout)
+
+            results[host_or_mac] = {'status': 504, 'result': message}
+        elif task.exc_info is not None:
+            results[host_or_mac] = {'status': 500,
+                                    'result': ''.join(traceback.format_exception(*task.exc_info))}
+        elif isinstance(task.result, HttpResponse):
+            results[host_or_mac] = {'status': task.result.status_code, 'result': task.result.content}
+        else:
+            results[host_or_mac] = {'status': 200, 'result': task.result}
+
+    return results
+
+def power_cycle_hosts(request, hosts_or_macs):
+    """Power cycles many hosts at once.
+
+    The hosts are power cycled concurrently, so this takes about as long as
+    the slowest host.  No PDU is asked to do more than a few operations at
+    the same time.
+
+    Returns a dict mapping each hostname or MAC address to a dict like this:
+
+    {"status": 200, "result": ...}
+
+    "status" is the HTTP status code that power_cycle would have returned for
+    that host, or 504 if the host didn't finish within JINX_POWER_TIMEOUT
+    seconds of the call starting.  "result" is what
+    power_cycle would have returned, or the error message.
+
+    Arguments:
+        hosts_or_macs -- A list of hostnames or MAC addresses.
+
+    Exceptions Raised:
+        JinxInvalidRequestError -- hosts_or_macs was not a list of strings.
+    """
+
+    return _power_hosts(_power_cycle, hosts_or_macs)
+
+def power_off_hosts(request, hosts_or_macs):
+    """Powers off many hosts at once.  See power_cycle_hosts() for details.
+
+    Arguments:
+        hosts_or_macs -- A list of hostnames or MAC addresses.
+
+    Exceptions Raised:
+        JinxInvalidRequestError -- hosts_or_macs was not a list of strings.
+    """
+
+    return _power_hosts(_power_off, hosts_or_macs)
+
+def power_on_hosts(request, hosts_or_macs):
+    """Powers on many hosts at once.  See power_cycle_hosts() for details.
+
+    Arguments:
+        hosts_or_macs -- A list of hostnames or MAC addresses.
+
+    Exceptions Raised:
+        JinxInvalidRequestError -- hosts_or_macs was not a list of strings.
+    """
+
+    return _power_hosts(_power_on, hosts_or_macs)
+
+def power_status_hosts(request, hosts_or_macs):
+    """Gets the power status of many hosts at once.  See power_cycle_hosts() for details.
+
+    Hosts that aren't IPMI enabled get a status of 409.
+
+    Arguments:
+        hosts_or_macs -- A list of hostnames or MAC addresses.
+
+    Exceptions Raised:
+        JinxInvalidRequestError -- hosts_or_macs was not a list of strings.
+    """
+
+    return _power_hosts(_power_status, hosts_or_macs)
+
+def _submit_power_job(call_name, operation, host_or_mac):
+    """Queue a power operation on one host as a background job and return the job's ID.
+
+    The job times out after JINX_POWER_TIMEOUT seconds, like one host's part
+    of power_cycle_hosts() does.
+    """
+
+    timeout = getattr(settings, 'JINX_POWER_TIMEOUT', 30)
+    deadline = time.time() + timeout
+
+    return submit_job(call_name, [host_or_mac], functools.partial(_run_power_operation, operation, host_or_mac, deadline),
+                      timeout)
+
+def power_cycle_async(request, host_or_mac):
+    """Starts power cycling a host in the background and returns a job ID right away.
+
+    Use get_job_status() or wait_for_jobs() to find out how it went.  The
+    finished job's status and result are the ones power_cycle would have
+    returned.  A job that hasn't finished after JINX_POWER_TIMEOUT seconds
+    gets a status of 504.
+
+    Arguments:
+        host_or_mac -- The hostname or MAC address of the host.
+    """
+
+    return _submit_power_job('power_cycle', _power_cycle, host_or_mac)
+
+def power_off_async(request, host_or_mac):
+    """Starts powering off a host in the background and returns a job ID right away.
+
+    See power_cycle_async() for details.
+
+    Arguments:
+        host_or_mac -- The hostname or MAC address of the host.
+    """
+
+    return _submit_power_job('power_off', _power_off, host_or_mac)
+
+def power_on_async(request, host_or_mac):
+    """Starts powering on a host in the background and returns a job ID right away.
+
+    See power_cycle_async() for details.
+
+    Arguments:
+        host_or_mac -- The hostname or MAC address of the host.
+    """
+
+    return _submit_power_job('power_on', _power_on, host_or_mac)
+
+def power_status_async(request, host_or_mac):
+    """Starts getting the power status of a host in the background and returns a job ID right away.
+
+    See power_cycle_async() for details.
+
+    Arguments:
+        host_or_mac -- The hostname or MAC address of the host.
+    """
+
+    return _submit_power_job('power_status', _power_status, host_or_mac)
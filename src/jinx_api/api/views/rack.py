@@ -1,7 +1,11 @@
 import clusto
-import llclusto
-from django.http import HttpResponseNotFound
+from django.http import HttpResponseNotFound, HttpResponseBadRequest
+from jinx_api.api.inventory import InventorySnapshot
+from jinx_api.pagination import paginate
+from jinx_api.registry import paginated, query_budget
 
+@paginated((int, long))
+@query_budget(15)
 def get_rack_contents(request, rack_name):
     """List all servers, PDUs, and switches in the given rack.  
     
@@ -34,33 +38,61 @@ def get_rack_contents(request, rack_name):
     except LookupError:
         return HttpResponseNotFound("Rack %s not found." % rack_name)
     
-    contents = []
-    
-    interesting_types = [llclusto.drivers.LindenServer, llclusto.drivers.LindenPDU, llclusto.drivers.LindenSwitch]
-    
-    for thing in rack:
-        if isinstance(thing, llclusto.drivers.Class7Chassis):
-            devices = thing.contents()
-        else:
-            devices = [thing]
-            
-        for device in devices:
-            device_info = {
-                           'hostname': device.hostname,
-                           'serial_number': device.serial_number
-                           }
-            
-            if isinstance(device, llclusto.drivers.LindenServer):
-                device_info['type'] = 'server'
-            elif isinstance(device, llclusto.drivers.LindenPDU):
-                device_info['type'] = 'pdu'
-            elif isinstance(device, llclusto.drivers.LindenSwitch):
-                device_info['type'] = 'switch'
-            
-            contents.append(device_info)
-    
-    return contents
+    # Reading each device's hostname and serial number through its driver
+    # costs a query apiece, so load the whole rack at once.
+    snapshot = InventorySnapshot()
+    contents = snapshot.load_contents([rack.entity.entity_id])
+
+    return paginate(request, [snapshot.get_device_info(device_id) for device_id in contents[rack.entity.entity_id]])
+
+def get_racks_contents(request, rack_names):
+    """List all servers, PDUs, and switches in each of several racks.
+
+    This loads all of the racks at once, so it's much faster than calling
+    get_rack_contents() once per rack.
+
+    Returns a dict mapping each rack name to a dict like this:
+
+    {"status": 200, "result": ...}
+
+    "status" is the HTTP status code that get_rack_contents would have
+    returned for that rack.  "result" is what it would have returned, or the
+    error message.
+
+    Arguments:
+        rack_names -- A list of rack names (case insensitive).
+
+    Exceptions Raised:
+        JinxInvalidRequestError -- rack_names was not a list of strings.
+    """
+
+    if not isinstance(rack_names, list):
+        return HttpResponseBadRequest("Expected a list of rack names; got %s" % str(type(rack_names)))
+
+    for rack_name in rack_names:
+        if not isinstance(rack_name, basestring):
+            return HttpResponseBadRequest("Rack names must be strings; got %s" % str(rack_name))
+
+    results = {}
+
+    # The racks are looked up together, so the number of queries doesn't
+    # grow with the number of racks.
+    snapshot = InventorySnapshot()
+    rack_ids = snapshot.find_racks(set(rack_names))
+
+    for rack_name in set(rack_names) - set(rack_ids):
+        results[rack_name] = {'status': 404, 'result': "Rack %s not found." % rack_name}
+
+    contents = snapshot.load_contents(set(rack_ids.values()))
+
+    for rack_name, rack_id in rack_ids.iteritems():
+        results[rack_name] = {'status': 200,
+                              'result': [snapshot.get_device_info(device_id) for device_id in contents[rack_id]]}
 
+    return results
+
+@paginated(basestring)
+@query_budget(15)
 def get_server_hostnames_in_rack(request, rack_name):
     """
     Returns a list of server hostnames in a rack with a clusto_type of server.
@@ -77,4 +109,39 @@ def get_server_hostnames_in_rack(request, rack_name):
     except LookupError:
         return HttpResponseNotFound("Rack %s not found." % rack_name)
 
-    return list(set([x.hostname for x in rack.contents(search_children=True, clusto_types=['server']) if x.hostname != None]))
+    # Going through each server's driver costs several queries apiece.
+    snapshot = InventorySnapshot()
+    hostnames = snapshot.load_hostnames(snapshot.find_hosts_in(rack.entity.entity_id), clusto_types=['server'])
+
+    return paginate(request, sorted(set(hostnames.values())), key=lambda hostname: hostname)
+
+def get_rack_remote_hands_info(request, rack_name):
+    """Return remote hands information for every host in a rack.
+
+    Hosts in a chassis in the rack are included.  The data for all of the
+    hosts is loaded in a few queries, so this is much faster than calling
+    get_host_remote_hands_info() once per host.
+
+    Returns a list of dicts like those returned by get_host_remote_hands_info,
+    ordered by position in the rack.
+
+    Arguments:
+        rack_name -- The name of the rack (case insensitive).
+
+    Exceptions Raised:
+        JinxDataNotFoundError -- The requested rack does not exist.
+    """
+
+    try:
+        rack = clusto.get_by_name(rack_name)
+    except LookupError:
+        return HttpResponseNotFound("Rack %s not found." % rack_name)
+
+    snapshot = InventorySnapshot()
+    host_ids = snapshot.find_hosts_in(rack.entity.entity_id)
+    snapshot.load()
+
+    infos = [snapshot.get_remote_hands_info(host_id) for host_id in host_ids]
+    infos.sort(key=lambda info: (info['positions'] or [], info['hostname']))
+
+    return infos
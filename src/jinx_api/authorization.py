@@ -0,0 +1,328 @@
+"""Authorization of API calls against directory (LDAP) group memberships.
+
+Each API call may be made by the members of a set of groups.  Looking the
+user's groups up in LDAP on every call would add a network round trip to all
+of them, so decisions are cached per (user, call), and group memberships per
+user.  All of a user's groups are fetched with one query, so the first call
+a user makes pays for the ones after it.
+
+Authorization is configured with the JINX_AUTHORIZATION setting.  Without
+it, every call is allowed.
+
+JINX_AUTHORIZATION = {
+    # Where group memberships come from.  MemoryDirectory takes them from
+    # its 'groups' option, a dict mapping users to lists of groups.
+    'BACKEND': 'jinx_api.authorization.LDAPDirectory',
+    'OPTIONS': {'uri': 'ldap://ldap.lindenlab.com',
+                'group_base_dn': 'ou=Groups,dc=lindenlab,dc=com'},
+
+    # Maps call names to the groups whose members may make them.  '*' is
+    # used for calls that aren't listed; calls matching neither are denied.
+    'RULES': {'*': ['jinx-users'],
+              'power_cycle': ['jinx-power']},
+
+    # Cached memberships and decisions are fresh for TTL seconds.  For
+    # STALE_TTL seconds after that, they're still used while they're looked
+    # up again in the background, so a slow or unreachable directory only
+    # holds up users it has never answered for.
+    'TTL': 300,
+    'STALE_TTL': 3600,
+    'MAX_ENTRIES': 10000,
+
+    # How long a request waits for the directory before giving up with a 503.
+    'LOOKUP_TIMEOUT': 2,
+
+    # Users whose groups are looked up as soon as the server starts.
+    'PREFETCH': [],
+}
+
+The user is the one the web server authenticated (REMOTE_USER), without its
+Kerberos realm.
+"""
+
+import threading
+import time
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.importlib import import_module
+from jinx_api.cache import LRUCache
+from jinx_api.workers import WorkerPool
+
+
+class DirectoryUnavailable(Exception):
+    """The directory couldn't be asked about a user's groups in time."""
+
+
+class MemoryDirectory(object):
+    """A directory kept in memory, for tests and small installations.
+
+    Options:
+        groups -- a dict mapping users to lists of group names
+        delay -- optional; seconds each lookup takes, to simulate a slow
+            directory
+    """
+
+    def __init__(self, groups=None, delay=0):
+        self.groups = dict(groups or {})
+        self.delay = delay
+        self.lookups = 0
+
+    def get_groups_for(self, users):
+        """Return a dict mapping each of users to a list of its groups."""
+
+        self.lookups += 1
+
+        if self.delay:
+            time.sleep(self.delay)
+
+        return dict((user, list(self.groups.get(user, ()))) for user in users)
+
+
+class LDAPDirectory(object):
+    """Look up group memberships in LDAP (posixGroup-style groups).
+
+    Requires the python-ldap module.
+
+    Options:
+        uri -- the LDAP server's URI, e.g. "ldap://ldap.lindenlab.com"
+        group_base_dn -- where to search for groups
+        member_attribute -- optional; the group attribute listing its
+            members' user names (default "memberUid")
+        name_attribute -- optional; the group attribute holding its name
+            (default "cn")
+        bind_dn, bind_password -- optional; credentials to bind with, if
+            anonymous searches aren't allowed
+        timeout -- optional; network timeout in seconds (default 2)
+    """
+
+    def __init__(self, uri, group_base_dn, member_attribute='memberUid', name_attribute='cn',
+                 bind_dn='', bind_password='', timeout=2):
+        import ldap
+
+        self._ldap = ldap
+        self.uri = uri
+        self.group_base_dn = group_base_dn
+        self.member_attribute = member_attribute
+        self.name_attribute = name_attribute
+        self.bind_dn = bind_dn
+        self.bind_password = bind_password
+        self.timeout = timeout
+
+    def get_groups_for(self, users):
+        """Return a dict mapping each of users to a list of its groups.
+
+        All of the users' groups are found with a single search.
+        """
+
+        from ldap.filter import escape_filter_chars
+
+        users = list(users)
+        groups = dict((user, []) for user in users)
+
+        if not users:
+            return groups
+
+        search_filter = '(|%s)' % ''.join('(%s=%s)' % (self.member_attribute, escape_filter_chars(user))
+                                          for user in users)
+
+        # python-ldap connections can't be shared between threads, and
+        # lookups are rare thanks to the cache, so use one per lookup.
+        connection = self._ldap.initialize(self.uri)
+        try:
+            connection.set_option(self._ldap.OPT_NETWORK_TIMEOUT, self.timeout)
+            connection.set_option(self._ldap.OPT_TIMEOUT, self.timeout)
+            connection.simple_bind_s(self.bind_dn, self.bind_password)
+
+            results = connection.search_s(self.group_base_dn, self._ldap.SCOPE_SUBTREE, search_filter,
+                                          [self.name_attribute, self.member_attribute])
+        finally:
+            connection.unbind_s()
+
+        for dn, attributes in results:
+            for name in attributes.get(self.name_attribute, [])[:1]:
+                for member in attributes.get(self.member_attribute, []):
+                    if member in groups:
+                        groups[member].append(name)
+
+        return groups
+
+
+class Authorizer(object):
+    """Decide whether users may make API calls, according to a JINX_AUTHORIZATION setting."""
+
+    def __init__(self, config):
+        self.config = config
+        self.rules = config.get('RULES', {})
+        self.ttl = config.get('TTL', 300)
+        self.stale_ttl = config.get('STALE_TTL', 3600)
+        self.lookup_timeout = config.get('LOOKUP_TIMEOUT', 2)
+
+        backend_path = config.get('BACKEND', 'jinx_api.authorization.LDAPDirectory')
+        module_name, class_name = backend_path.rsplit('.', 1)
+
+        try:
+            backend_class = getattr(import_module(module_name), class_name)
+        except (ImportError, AttributeError), e:
+            raise ImproperlyConfigured('Error loading directory backend %s: "%s"' % (backend_path, e))
+
+        self.directory = backend_class(**config.get('OPTIONS', {}))
+
+        max_entries = config.get('MAX_ENTRIES', 10000)
+
+        # Map user -> (frozenset of groups, time fetched), and
+        # (user, call name) -> (allowed, time the groups were fetched).
+        # Entries are kept through the stale window; freshness is checked
+        # against the time fetched.
+        self._groups = LRUCache(max_entries)
+        self._decisions = LRUCache(max_entries)
+
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._pool = WorkerPool(config.get('WORKERS', 2), name='jinx-authorization')
+
+        if config.get('PREFETCH'):
+            self._pool.submit(self._lookup, config['PREFETCH'])
+
+    def _lookup(self, users):
+        """Fetch users' groups from the directory and cache them."""
+
+        groups = self.directory.get_groups_for(users)
+        fetched_at = time.time()
+
+        for user in users:
+            self._groups.set(user, (frozenset(groups.get(user, ())), fetched_at), self.ttl + self.stale_ttl)
+
+    def _refresh(self, user):
+        try:
+            try:
+                self._lookup([user])
+            except Exception:
+                # Keep using what's cached until the stale window runs out.
+                pass
+        finally:
+            self._lock.acquire()
+            try:
+                self._refreshing.discard(user)
+            finally:
+                self._lock.release()
+
+    def _refresh_in_background(self, user):
+        self._lock.acquire()
+        try:
+            if user in self._refreshing:
+                return
+
+            self._refreshing.add(user)
+        finally:
+            self._lock.release()
+
+        self._pool.submit(self._refresh, user)
+
+    def _get_groups(self, user):
+        """Return (groups, time fetched) for a user, from the cache if possible."""
+
+        cached = self._groups.get(user)
+
+        if cached is not None:
+            if time.time() - cached[1] >= self.ttl:
+                self._refresh_in_background(user)
+
+            return cached
+
+        # Nothing usable is cached, so this request has to wait.  The lookup
+        # runs on a worker thread so that it can be given up on; if it
+        # finishes late, it still fills the cache for later requests.
+        task = self._pool.submit(self._lookup, [user])
+
+        if not task.wait(self.lookup_timeout):
+            raise DirectoryUnavailable("The directory didn't answer within %s seconds." % self.lookup_timeout)
+
+        if task.exc_info is not None:
+            raise DirectoryUnavailable("The directory lookup failed: %s" % task.exc_info[1])
+
+        return self._groups.get(user)
+
+    def is_allowed(self, user, call_name):
+        """Return whether user may make the call named call_name.
+
+        Raises DirectoryUnavailable if there's no cached answer and the
+        directory can't give one in time.
+        """
+
+        key = (user, call_name)
+        decision = self._decisions.get(key)
+        groups_entry = self._groups.get(user)
+
+        # A decision is good as long as the groups it was made from are the
+        # latest ones known.
+        if decision is not None and (groups_entry is None or groups_entry[1] <= decision[1]):
+            if time.time() - decision[1] >= self.ttl:
+                self._refresh_in_background(user)
+
+            return decision[0]
+
+        groups, fetched_at = self._get_groups(user)
+
+        required_groups = self.rules.get(call_name, self.rules.get('*'))
+        allowed = required_groups is not None and not groups.isdisjoint(required_groups)
+
+        remaining = self.ttl + self.stale_ttl - (time.time() - fetched_at)
+
+        if remaining > 0:
+            self._decisions.set(key, (allowed, fetched_at), remaining)
+
+        return allowed
+
+_authorizer = None
+
+def get_authorizer():
+    """Return the Authorizer for the current JINX_AUTHORIZATION setting, or None.
+
+    None means every call is allowed.
+    """
+
+    global _authorizer
+
+    config = getattr(settings, 'JINX_AUTHORIZATION', None)
+
+    if not config:
+        return None
+
+    if _authorizer is None or _authorizer.config is not config:
+        _authorizer = Authorizer(config)
+
+    return _authorizer
+
+def get_user(request):
+    """Return the name of the user the web server authenticated, without its Kerberos realm."""
+
+    user = request.META.get('REMOTE_USER')
+
+    if not user:
+        return None
+
+    return user.split('@', 1)[0]
+
+def check_authorization(request, call_name):
+    """Return None if the request's user may make an API call, or else an HttpResponse saying why not."""
+
+    authorizer = get_authorizer()
+
+    if authorizer is None:
+        return None
+
+    user = get_user(request)
+
+    if user is None:
+        return HttpResponseForbidden("The Jinx API requires an authenticated user.")
+
+    try:
+        allowed = authorizer.is_allowed(user, call_name)
+    except DirectoryUnavailable, e:
+        return HttpResponse("Could not check authorization for %s: %s" % (user, e), status=503)
+
+    if not allowed:
+        return HttpResponseForbidden("%s may not call %s." % (user, call_name))
+
+    return None
@@ -0,0 +1,7 @@
+"""Microbenchmarks for performance-sensitive parts of Jinx.
+
+Run them from the src directory, e.g.:
+
+    python -m jinx_api.benchmarks.serialization_bench
+    python -m jinx_api.benchmarks.api_bench --sizes 1000,10000 --output results.json
+"""
@@ -0,0 +1,303 @@
+"""Measure how the Jinx API calls scale with the size of the inventory.
+
+    python -m jinx_api.benchmarks.api_bench [options] [call ...]
+
+For each inventory size (1000, 10000 and 100000 hosts by default), this
+builds a synthetic inventory (see jinx_api.benchmarks.inventory) in a fresh
+clusto database, then sends every call in api.urls.api_calls (or
+just the calls named) through the full middleware stack with Django's test
+client.  For each call it records the throughput, the median and 99th
+percentile latency, and the number of SQL statements per request, prints
+them, and saves them all as JSON with --output.  Pass an earlier run's output
+with --compare to see what got slower.  Building the larger inventories
+takes a while; with --inventory-dir they're built once and reused.
+
+Calls that can't run against a synthetic inventory (those that talk to real
+PDUs or depend on submitted jobs) are listed as skipped.  The result cache is
+turned off unless --cache is given, so that every request does the real
+work.
+"""
+
+import os
+import sys
+
+# The API's urlconfs refer to modules relative to the jinx_api directory, the
+# way lldjango.wsgi sets things up.
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'settings')
+
+import math
+import optparse
+import random
+import simplejson
+import time
+from django.conf import settings
+from django.test.client import Client
+from jinx_api import metrics
+from jinx_api.benchmarks.inventory import build_inventory
+from jinx_api.fixtures import Fixture
+
+SIZES = [1000, 10000, 100000]
+
+# How long to spend on each call, at most, and how many requests to send.
+DURATION = 10.0
+REQUESTS = 200
+
+# Slowdowns smaller than this are reported by --compare as noise.
+TOLERANCE = 0.2
+
+_state_counter = [0]
+
+def _sample(population, count, rng):
+    return rng.sample(population, min(count, len(population)))
+
+def _new_state(inventory, rng):
+    _state_counter[0] += 1
+    return ["bench-%d" % _state_counter[0]]
+
+# Maps call names to functions returning arguments for one request.  Each
+# request gets different arguments, so that nothing is served from a cache
+# the real workload wouldn't hit.
+CALL_ARGUMENTS = {
+    'get_racks_contents': lambda inv, rng: [_sample(inv.rack_names, 10, rng)],
+    'get_rack_contents': lambda inv, rng: [rng.choice(inv.rack_names)],
+    'get_server_hostnames_in_rack': lambda inv, rng: [rng.choice(inv.rack_names)],
+    'get_rack_remote_hands_info': lambda inv, rng: [rng.choice(inv.rack_names)],
+    'get_hosts_by_regex': lambda inv, rng: [r"sim%d\d\d\." % rng.randint(100, 100 + max(0, len(inv.hostnames) // 100 - 1))],
+    'get_hosts_remote_hands_info': lambda inv, rng: [_sample(inv.hostnames, 100, rng)],
+    'get_host_remote_hands_info': lambda inv, rng: [rng.choice(inv.hostnames)],
+    'get_hosts_state': lambda inv, rng: [_sample(inv.hostnames, 1000, rng)],
+    'get_host_state_changes': lambda inv, rng: [0],
+    'get_host_state': lambda inv, rng: [rng.choice(inv.hostnames)],
+    'set_hosts_state': lambda inv, rng: [_sample(inv.hostnames, 100, rng), rng.choice(inv.states)],
+    'set_host_state': lambda inv, rng: [rng.choice(inv.hostnames), rng.choice(inv.states)],
+    'get_hosts_in_state': lambda inv, rng: [rng.choice(inv.states)],
+    'list_host_states': lambda inv, rng: [],
+    'add_host_state': _new_state,
+    'get_server_class_info': lambda inv, rng: [rng.choice(inv.hostnames)],
+    'get_pdu_hostnames': lambda inv, rng: [],
+}
+
+SKIPPED = {
+    'power_cycle_hosts': "needs real PDUs",
+    'power_on_hosts': "needs real PDUs",
+    'power_off_hosts': "needs real PDUs",
+    'power_status_hosts': "needs real PDUs",
+    'power_cycle_async': "needs real PDUs",
+    'power_on_async': "needs real PDUs",
+    'power_off_async': "needs real PDUs",
+    'power_status_async': "needs real PDUs",
+    'power_cycle': "needs real PDUs",
+    'power_on': "needs real PDUs",
+    'power_off': "needs real PDUs",
+    'power_status': "needs real PDUs",
+    'get_job_status': "needs submitted jobs",
+    'wait_for_jobs': "needs submitted jobs",
+}
+
+
+def api_call_names():
+    """Return the names of the calls in api.urls.api_calls, in order."""
+
+    from api.urls import api_calls
+
+    return [pattern.regex.pattern for pattern in api_calls]
+
+def percentile(sorted_values, fraction):
+    """Return the value below which fraction of sorted_values fall (nearest rank)."""
+
+    if not sorted_values:
+        return None
+
+    index = min(len(sorted_values) - 1, max(0, int(math.ceil(fraction * len(sorted_values))) - 1))
+
+    return sorted_values[index]
+
+def benchmark_call(client, call_name, inventory, rng, duration=DURATION, requests=REQUESTS):
+    """Send requests for one call until duration or requests runs out.
+
+    Returns a dict of results: requests, errors, requests_per_second,
+    p50_ms, p99_ms, max_ms and sql_queries (the mean per request).
+    """
+
+    path = "/jinx/2.0/%s" % call_name
+
+    def post():
+        response = client.post(path, simplejson.dumps(CALL_ARGUMENTS[call_name](inventory, rng)), "application/json")
+
+        # Streamed responses are only generated when read.
+        response.content
+
+        return response
+
+    # Warm up anything built on first use (e.g. the hostname index), so it
+    # isn't charged to the first request.
+    post()
+    metrics.registry.clear()
+
+    latencies = []
+    errors = 0
+    started_at = time.time()
+
+    while len(latencies) < requests and time.time() - started_at < duration:
+        request_started_at = time.time()
+        response = post()
+        latencies.append(time.time() - request_started_at)
+
+        if response.status_code != 200:
+            errors += 1
+
+    elapsed = time.time() - started_at
+    latencies.sort()
+    sql_queries = metrics.registry.get('jinx_sql_queries_total', (('call', call_name),))
+
+    return {'requests': len(latencies),
+            'errors': errors,
+            'requests_per_second': len(latencies) / elapsed,
+            'p50_ms': percentile(latencies, 0.5) * 1000,
+            'p99_ms': percentile(latencies, 0.99) * 1000,
+            'max_ms': latencies[-1] * 1000,
+            'sql_queries': float(sql_queries) / len(latencies)}
+
+def benchmark_size(hosts, call_names, seed=0, duration=DURATION, requests=REQUESTS, inventory_dir=None):
+    """Build an inventory of hosts servers and benchmark call_names against it.
+
+    If inventory_dir is given, the inventory is kept there and reused by
+    later runs with the same size and seed.  Yields (call name, results so
+    far) as each call is finished, then (None, results) with every call's
+    results.
+    """
+
+    path = None
+
+    if inventory_dir is not None:
+        path = os.path.join(inventory_dir, "inventory-%d-%d.sqlite" % (hosts, seed))
+
+    fixture = Fixture(lambda: build_inventory(hosts, seed), path)
+    build_started_at = time.time()
+    fixture.restore()
+
+    try:
+        inventory = fixture.data
+        results = {'hosts': len(inventory.hostnames),
+                   'racks': len(inventory.rack_names),
+                   'build_seconds': time.time() - build_started_at,
+                   'calls': {},
+                   'skipped': {}}
+
+        client = Client()
+        rng = random.Random(seed)
+
+        for call_name in call_names:
+            if call_name not in CALL_ARGUMENTS:
+                results['skipped'][call_name] = SKIPPED.get(call_name, "no arguments defined")
+                continue
+
+            results['calls'][call_name] = benchmark_call(client, call_name, inventory, rng, duration, requests)
+            yield call_name, results
+
+        yield None, results
+    finally:
+        fixture.release()
+
+def compare(old, new, tolerance=TOLERANCE):
+    """Yield (hosts, call, measure, old, new) for every measure that got worse.
+
+    Latencies count as worse when they grew by more than tolerance; SQL
+    query counts count when they grew at all.
+    """
+
+    for hosts, new_size in sorted(new['sizes'].items()):
+        old_size = old['sizes'].get(hosts)
+
+        if old_size is None:
+            continue
+
+        for call_name, new_call in sorted(new_size['calls'].items()):
+            old_call = old_size['calls'].get(call_name)
+
+            if old_call is None:
+                continue
+
+            for measure in ('p50_ms', 'p99_ms'):
+                if new_call[measure] > old_call[measure] * (1 + tolerance):
+                    yield hosts, call_name, measure, old_call[measure], new_call[measure]
+
+            if new_call['sql_queries'] > old_call['sql_queries']:
+                yield hosts, call_name, 'sql_queries', old_call['sql_queries'], new_call['sql_queries']
+
+def main(argv):
+    parser = optparse.OptionParser(usage="%prog [options] [call ...]")
+    parser.add_option('--sizes', default=','.join(str(size) for size in SIZES),
+                      help="comma-separated inventory sizes, in hosts [%default]")
+    parser.add_option('--duration', type='float', default=DURATION,
+                      help="the most seconds to spend on each call [%default]")
+    parser.add_option('--requests', type='int', default=REQUESTS,
+                      help="the most requests to send for each call [%default]")
+    parser.add_option('--seed', type='int', default=0)
+    parser.add_option('--cache', action='store_true', default=False,
+                      help="leave the result cache on")
+    parser.add_option('--inventory-dir', help="keep the inventories in this directory, to reuse in later runs")
+    parser.add_option('--output', help="save the results to this file, as JSON")
+    parser.add_option('--compare', help="report what got worse since the results in this file")
+    options, call_names = parser.parse_args(argv[1:])
+
+    known_calls = api_call_names()
+
+    for call_name in call_names:
+        if call_name not in known_calls:
+            parser.error("unknown call: %s" % call_name)
+
+    if not options.cache:
+        settings.JINX_RESULT_CACHE = None
+
+    run = {'started_at': time.time(),
+           'duration': options.duration,
+           'requests': options.requests,
+           'seed': options.seed,
+           'cache': options.cache,
+           'sizes': {}}
+
+    for hosts in [int(size) for size in options.sizes.split(',')]:
+        print "%d hosts" % hosts
+        print "%-32s %10s %10s %10s %10s %8s" % ("call", "req/s", "p50 (ms)", "p99 (ms)", "queries", "errors")
+
+        for call_name, results in benchmark_size(hosts, call_names or known_calls, options.seed,
+                                                 options.duration, options.requests, options.inventory_dir):
+            if call_name is None:
+                # JSON object keys are always strings.
+                run['sizes'][str(hosts)] = results
+                continue
+
+            call = results['calls'][call_name]
+            print "%-32s %10.1f %10.2f %10.2f %10.1f %8d" % (call_name, call['requests_per_second'], call['p50_ms'],
+                                                              call['p99_ms'], call['sql_queries'], call['errors'])
+
+        for call_name, reason in sorted(run['sizes'][str(hosts)]['skipped'].items()):
+            print "%-32s skipped: %s" % (call_name, reason)
+
+        print
+
+    if options.output:
+        output = open(options.output, 'w')
+        try:
+            simplejson.dump(run, output, indent=2, sort_keys=True)
+        finally:
+            output.close()
+
+    if options.compare:
+        baseline = simplejson.load(open(options.compare))
+        regressions = list(compare(baseline, run))
+
+        for hosts, call_name, measure, old_value, new_value in regressions:
+            print "%s hosts: %s %s went from %.2f to %.2f" % (hosts, call_name, measure, old_value, new_value)
+
+        if regressions:
+            return 1
+
+        print "No regressions since %s" % options.compare
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
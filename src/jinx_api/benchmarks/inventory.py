@@ -0,0 +1,147 @@
+"""Build a synthetic clusto inventory shaped like a real Linden datacenter.
+
+The inventory is built with the llclusto drivers, through clusto, so the API
+calls see exactly what they'd see in production: datacenters full of racks,
+each rack holding Class 5 servers, Class 7 chassis full of blades and a pair
+of PDUs powering all of them, with every host in one of a few HostStates.
+"""
+
+import random
+import clusto
+from llclusto.drivers import (Class5Server, Class7Chassis, Class7Server, HostState, LindenDatacenter, LindenPDU,
+                              LindenRack, ServerClass)
+
+DATACENTERS = ["DFW", "PHX", "SFO"]
+
+# HostStates, and the fraction of hosts in each.
+STATES = [("up", 0.85), ("down", 0.05), ("maintenance", 0.05), ("repair", 0.05)]
+
+# Per rack: Class 5 servers from the bottom up, then 2U Class 7 chassis, and
+# the two PDUs at the top.
+CLASS5_PER_RACK = 20
+CHASSIS_PER_RACK = 5
+BLADES_PER_CHASSIS = 4
+HOSTS_PER_RACK = CLASS5_PER_RACK + CHASSIS_PER_RACK * BLADES_PER_CHASSIS
+PDU_POSITIONS = [41, 42]
+PDU_PORTS = 24
+
+
+class Inventory(object):
+    """The names of what build_inventory() created, for choosing API call arguments.
+
+    Attributes:
+        hostnames -- Every server's hostname, in the order they were created.
+        rack_names -- Every rack's name.
+        pdu_hostnames -- Every PDU's hostname.
+        states -- The names of the HostStates.
+    """
+
+    def __init__(self):
+        self.hostnames = []
+        self.rack_names = []
+        self.pdu_hostnames = []
+        self.states = [name for name, fraction in STATES]
+
+def _mac(rng):
+    return ':'.join('%02x' % rng.randint(0, 255) for i in xrange(6))
+
+def _choose_state(rng):
+    value = rng.random()
+
+    for name, fraction in STATES:
+        if value < fraction:
+            return name
+
+        value -= fraction
+
+    return STATES[0][0]
+
+def build_inventory(hosts, seed=0):
+    """Fill the connected clusto database with an inventory of about hosts servers.
+
+    Racks are filled completely, so the number of servers is rounded up to a
+    whole number of racks.  The same seed always builds the same inventory.
+    Returns an Inventory.
+    """
+
+    rng = random.Random(seed)
+    inventory = Inventory()
+
+    clusto.begin_transaction()
+    try:
+        datacenters = [LindenDatacenter(name, "1 Datacenter Way", "1 Datacenter Way",
+                                        "remotehands@%s.example.com" % name.lower())
+                       for name in DATACENTERS]
+        states = dict((name, HostState(name)) for name in inventory.states)
+        ServerClass("Class 5", num_cpus=2, cores_per_cpu=4, ram_size=16, disk_size=500)
+        ServerClass("Class 7", num_cpus=2, cores_per_cpu=6, ram_size=24, disk_size=250)
+        clusto.commit()
+    except:
+        clusto.rollback_transaction()
+        raise
+
+    rack_count = (hosts + HOSTS_PER_RACK - 1) // HOSTS_PER_RACK
+
+    for rack_num in xrange(rack_count):
+        # One transaction per rack keeps clusto from committing every
+        # attribute separately, without holding the whole build in memory.
+        clusto.begin_transaction()
+        try:
+            _build_rack(rng, inventory, rack_num, datacenters[rack_num % len(datacenters)], states)
+            clusto.commit()
+        except:
+            clusto.rollback_transaction()
+            raise
+
+    return inventory
+
+def _build_rack(rng, inventory, rack_num, datacenter, states):
+    rack_name = "c%d.%02d.%d" % (rack_num % 9 + 1, rack_num // 9 % 40 + 1, 1000 + rack_num)
+    rack = LindenRack(rack_name)
+    datacenter.insert(rack)
+    inventory.rack_names.append(rack_name)
+
+    pdus = []
+
+    for pdu_num, position in enumerate(PDU_POSITIONS):
+        pdu = LindenPDU()
+        pdu.hostname = "pdu%d-%s.%s.lindenlab.com" % (pdu_num + 1, rack_name.replace('.', '-'),
+                                                      datacenter.name.lower())
+        rack.insert(pdu, position)
+        pdus.append(pdu)
+        inventory.pdu_hostnames.append(pdu.hostname)
+
+    # Power supplies are spread across the two PDUs.
+    powered = [0]
+
+    def connect_power(device):
+        pdu = pdus[powered[0] % len(pdus)]
+        device.connect_ports("pwr-nema-5", 1, pdu, powered[0] // len(pdus) % PDU_PORTS + 1)
+        powered[0] += 1
+
+    def add_server(server):
+        server.serial_number = "SM%06d" % rng.randint(0, 999999)
+        server.set_port_attr("nic-eth", 1, "mac", _mac(rng))
+        server.set_port_attr("nic-eth", 2, "mac", _mac(rng))
+        states[_choose_state(rng)].insert(server)
+        inventory.hostnames.append(server.hostname)
+
+    def next_hostname():
+        return "sim%d.agni.lindenlab.com" % (10000 + len(inventory.hostnames))
+
+    for position in xrange(1, CLASS5_PER_RACK + 1):
+        server = Class5Server(next_hostname())
+        rack.insert(server, position)
+        connect_power(server)
+        add_server(server)
+
+    for chassis_num in xrange(CHASSIS_PER_RACK):
+        position = CLASS5_PER_RACK + 1 + chassis_num * 2
+        chassis = Class7Chassis()
+        rack.insert(chassis, [position, position + 1])
+        connect_power(chassis)
+
+        for blade_num in xrange(BLADES_PER_CHASSIS):
+            server = Class7Server(next_hostname())
+            chassis.insert(server)
+            add_server(server)
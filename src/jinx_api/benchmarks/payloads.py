@@ -0,0 +1,63 @@
+"""Synthetic data shaped like the responses of real Jinx API calls."""
+
+import random
+
+
+def hostnames(count=20000):
+    """A get_hosts_by_regex / get_hosts_in_state response."""
+
+    return ["sim%d.agni.lindenlab.com" % (10000 + i) for i in xrange(count)]
+
+def _mac(rng):
+    return ':'.join('%02x' % rng.randint(0, 255) for i in xrange(6))
+
+def remote_hands_infos(count=2000, seed=0):
+    """A list of get_host_remote_hands_info responses."""
+
+    rng = random.Random(seed)
+    infos = []
+
+    for i in xrange(count):
+        rack = "c%d.%02d.%d" % (rng.randint(1, 9), rng.randint(1, 40), rng.randint(1000, 2000))
+        position = rng.randint(1, 42)
+
+        infos.append({'hostname': "sim%d.agni.lindenlab.com" % (10000 + i),
+                      'macs': [_mac(rng), _mac(rng)],
+                      'rack': rack,
+                      'positions': [position],
+                      'serial_number': "SM%06d" % rng.randint(0, 999999),
+                      'colo': rng.choice(["DFW", "PHX", "SFO"]),
+                      'pdu_connections': [{'pdu': "pdu%d-%s.dfw.lindenlab.com" % (n, rack.replace('.', '-')),
+                                           'port': rng.randint(1, 24)}
+                                          for n in (1, 2)]})
+
+    return infos
+
+def rack_contents(devices=42, seed=0):
+    """A get_rack_contents response for a full rack."""
+
+    rng = random.Random(seed)
+    contents = []
+
+    for i in xrange(devices):
+        device_type = rng.choice(['server'] * 8 + ['pdu', 'switch'])
+        contents.append({'hostname': "%s%d.dfw.lindenlab.com" % (device_type, 10000 + i),
+                         'type': device_type,
+                         'serial_number': "SM%06d" % rng.randint(0, 999999)})
+
+    return contents
+
+def racks_contents(racks=200, seed=0):
+    """A get_racks_contents response for a datacenter row or more."""
+
+    return dict(("c1.%02d.%d" % (i % 40, 1000 + i),
+                 {'status': 200, 'result': rack_contents(seed=seed + i)})
+                for i in xrange(racks))
+
+# Maps payload names to functions building them.
+PAYLOADS = {
+    'hostnames': hostnames,
+    'remote_hands_infos': remote_hands_infos,
+    'rack_contents': rack_contents,
+    'racks_contents': racks_contents,
+}
@@ -0,0 +1,75 @@
+"""Compare the JSON codecs in jinx_api.serialization on typical payloads.
+
+    python -m jinx_api.benchmarks.serialization_bench [codec ...]
+
+With no arguments, every codec that's installed is benchmarked.  For each
+payload and codec this prints the best time out of several runs to encode and
+decode it, and the size of the encoded data.
+"""
+
+import sys
+import timeit
+from jinx_api.benchmarks.payloads import PAYLOADS
+from jinx_api.serialization import CODECS, CodecUnavailable, load_codec
+
+REPEAT = 5
+
+
+def best_time(function, repeat=REPEAT):
+    """Return the fastest of several runs of function(), in seconds."""
+
+    timer = timeit.Timer(function)
+    number = 1
+
+    # Run often enough that each measurement takes a noticeable time.
+    while timer.timeit(number) < 0.2 and number < 10000:
+        number *= 10
+
+    return min(timer.repeat(repeat, number)) / number
+
+def benchmark(codecs, payloads):
+    """Yield (payload name, codec name, encode seconds, decode seconds, size) tuples."""
+
+    for payload_name in sorted(payloads):
+        data = payloads[payload_name]()
+
+        for codec in codecs:
+            encoded = codec.dumps(data)
+
+            # Every codec has to agree on what the data is.
+            assert codec.loads(encoded) == codecs[0].loads(codecs[0].dumps(data))
+
+            yield (payload_name, codec.name,
+                   best_time(lambda: codec.dumps(data)),
+                   best_time(lambda: codec.loads(encoded)),
+                   len(encoded))
+
+def main(argv):
+    codecs = []
+
+    for name in argv[1:] or sorted(CODECS):
+        try:
+            codecs.append(load_codec(name))
+        except CodecUnavailable, e:
+            print >> sys.stderr, "skipping %s: %s" % (name, e)
+
+    if not codecs:
+        print >> sys.stderr, "no codecs to benchmark"
+        return 1
+
+    print "%-20s %-24s %12s %12s %12s" % ("payload", "codec", "encode (ms)", "decode (ms)", "bytes")
+
+    for payload_name, codec_name, encode_time, decode_time, size in benchmark(codecs, PAYLOADS):
+        codec = [c for c in codecs if c.name == codec_name][0]
+
+        if codec.accelerated:
+            label = codec_name
+        else:
+            label = "%s (no speedups)" % codec_name
+
+        print "%-20s %-24s %12.3f %12.3f %12d" % (payload_name, label, encode_time * 1000, decode_time * 1000, size)
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
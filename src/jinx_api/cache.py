@@ -0,0 +1,324 @@
+"""Caching of API call results.
+
+Read-only API calls can have their results cached, keyed on the call name and
+its arguments.  Caching is configured with the JINX_RESULT_CACHE setting:
+
+JINX_RESULT_CACHE = {
+    # Where cached results are stored.  The default keeps them in the memory
+    # of each server process.
+    'BACKEND': 'jinx_api.cache.LocalMemoryBackend',
+    'OPTIONS': {},
+
+    # Only the calls listed here are cached.  ttl is in seconds; max_entries
+    # bounds how many different argument lists are kept for the call, least
+    # recently used first out.
+    'CALLS': {
+        'list_host_states': {'ttl': 60, 'max_entries': 1},
+        'get_rack_contents': {'ttl': 60, 'max_entries': 1000},
+    },
+
+    # Optional; replaces INVALIDATES below.
+    'INVALIDATES': {...},
+}
+
+When an API call that changes data is made, the cached results of the calls
+listed for it in INVALIDATES are thrown away.  Changes made to clusto by
+anything other than this server are only picked up when the TTL runs out.
+"""
+
+import hashlib
+import threading
+import time
+import simplejson
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.importlib import import_module
+
+# Maps each API call that changes data to the calls whose results it may change.
+INVALIDATES = {
+    'set_host_state': ('get_host_state', 'get_hosts_state', 'get_hosts_in_state'),
+    'set_hosts_state': ('get_host_state', 'get_hosts_state', 'get_hosts_in_state'),
+    'add_host_state': ('list_host_states',),
+    'power_cycle': ('power_status',),
+    'power_on': ('power_status',),
+    'power_off': ('power_status',),
+    'power_cycle_hosts': ('power_status',),
+    'power_on_hosts': ('power_status',),
+    'power_off_hosts': ('power_status',),
+}
+
+
+class LRUCache(object):
+    """A dict-like mapping with a maximum size and per-entry expiration times.
+
+    When the cache is full, adding an entry throws out the least recently used
+    one.  All methods are thread-safe.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+
+        # Maps key -> [key, value, expires, previous link, next link].  The
+        # links form a circular list through self._root, most recently used
+        # first.
+        self._links = {}
+        self._root = [None, None, None, None, None]
+        self._root[3] = self._root[4] = self._root
+
+    def __len__(self):
+        return len(self._links)
+
+    def _unlink(self, link):
+        link[3][4] = link[4]
+        link[4][3] = link[3]
+
+    def _link_first(self, link):
+        link[3] = self._root
+        link[4] = self._root[4]
+        self._root[4][3] = link
+        self._root[4] = link
+
+    def get(self, key, default=None):
+        """Return the value for key, or default if it's missing or expired."""
+
+        self._lock.acquire()
+        try:
+            link = self._links.get(key)
+
+            if link is None:
+                return default
+
+            if link[2] is not None and link[2] <= time.time():
+                self._unlink(link)
+                del self._links[key]
+                return default
+
+            self._unlink(link)
+            self._link_first(link)
+
+            return link[1]
+        finally:
+            self._lock.release()
+
+    def set(self, key, value, ttl=None):
+        """Store value for key, expiring after ttl seconds (or never, if None)."""
+
+        if ttl is None:
+            expires = None
+        else:
+            expires = time.time() + ttl
+
+        self._lock.acquire()
+        try:
+            link = self._links.get(key)
+
+            if link is not None:
+                self._unlink(link)
+                link[1] = value
+                link[2] = expires
+            else:
+                link = [key, value, expires, None, None]
+                self._links[key] = link
+
+            self._link_first(link)
+
+            while len(self._links) > self.max_entries:
+                oldest = self._root[3]
+                self._unlink(oldest)
+                del self._links[oldest[0]]
+        finally:
+            self._lock.release()
+
+    def delete(self, key):
+        self._lock.acquire()
+        try:
+            link = self._links.pop(key, None)
+
+            if link is not None:
+                self._unlink(link)
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._links.clear()
+            self._root[3] = self._root[4] = self._root
+        finally:
+            self._lock.release()
+
+
+class LocalMemoryBackend(object):
+    """Keep cached results in the memory of this process, one LRUCache per call.
+
+    Each server process has its own cache, so invalidation only reaches the
+    process that handled the call that changed data.  The others catch up when
+    their entries' TTL runs out.
+    """
+
+    def __init__(self):
+        self._caches = {}
+        self._lock = threading.Lock()
+
+    def _get_call_cache(self, call_name, max_entries):
+        self._lock.acquire()
+        try:
+            if call_name not in self._caches:
+                self._caches[call_name] = LRUCache(max_entries)
+
+            return self._caches[call_name]
+        finally:
+            self._lock.release()
+
+    def get(self, call_name, key):
+        cache = self._caches.get(call_name)
+
+        if cache is None:
+            return None
+
+        return cache.get(key)
+
+    def set(self, call_name, key, value, ttl, max_entries):
+        self._get_call_cache(call_name, max_entries).set(key, value, ttl)
+
+    def invalidate(self, call_name):
+        cache = self._caches.get(call_name)
+
+        if cache is not None:
+            cache.clear()
+
+
+class MemcachedBackend(object):
+    """Keep cached results in memcached (or anything that speaks its protocol).
+
+    This lets all server processes share one cache, so invalidation reaches
+    all of them.  memcached does its own LRU eviction, so max_entries is
+    ignored.  Invalidating a call bumps a generation number that's part of
+    every key for that call, which orphans the old entries.
+
+    Requires the python-memcache module.
+
+    Options:
+        servers -- a list of "host:port" strings
+        key_prefix -- optional; prepended to every key, so several Jinx
+            installations can share a memcached
+    """
+
+    def __init__(self, servers, key_prefix='jinx'):
+        import memcache
+
+        self._client = memcache.Client(servers)
+        self._key_prefix = key_prefix
+
+    def _generation_key(self, call_name):
+        return "%s:generation:%s" % (self._key_prefix, call_name)
+
+    def _key(self, call_name, key):
+        generation = self._client.get(self._generation_key(call_name))
+
+        if generation is None:
+            generation = 0
+            self._client.add(self._generation_key(call_name), generation)
+
+        # memcached keys can't contain spaces or control characters, and are
+        # limited to 250 characters, so use a digest of the arguments.
+        return "%s:%s:%s:%s" % (self._key_prefix, call_name, generation, _digest(key))
+
+    def get(self, call_name, key):
+        return self._client.get(self._key(call_name, key))
+
+    def set(self, call_name, key, value, ttl, max_entries):
+        self._client.set(self._key(call_name, key), value, time=ttl or 0)
+
+    def invalidate(self, call_name):
+        if self._client.incr(self._generation_key(call_name)) is None:
+            self._client.add(self._generation_key(call_name), 1)
+
+
+def _digest(key):
+    if isinstance(key, unicode):
+        key = key.encode('utf-8')
+
+    return hashlib.sha1(key).hexdigest()
+
+
+class ResultCache(object):
+    """Cache API call results according to a JINX_RESULT_CACHE setting."""
+
+    def __init__(self, config):
+        self.config = config
+        self.calls = config.get('CALLS', {})
+        self.invalidates = config.get('INVALIDATES', INVALIDATES)
+
+        backend_path = config.get('BACKEND', 'jinx_api.cache.LocalMemoryBackend')
+        module_name, class_name = backend_path.rsplit('.', 1)
+
+        try:
+            backend_class = getattr(import_module(module_name), class_name)
+        except (ImportError, AttributeError), e:
+            raise ImproperlyConfigured('Error loading result cache backend %s: "%s"' % (backend_path, e))
+
+        self.backend = backend_class(**config.get('OPTIONS', {}))
+
+    def is_cached(self, call_name):
+        return call_name in self.calls
+
+    def make_key(self, args, version_tag=None):
+        """Build a cache key from the arguments to a call.
+
+        If version_tag (see api.versioning.get_version_tag) is given, it's
+        part of the key, so the result is only used while clusto is unchanged.
+        """
+
+        if version_tag is None:
+            return simplejson.dumps(args, sort_keys=True)
+
+        return simplejson.dumps([version_tag, args], sort_keys=True)
+
+    def get(self, call_name, key):
+        """Look up the cached result of a call.
+
+        Returns a tuple of (hit, result).  hit is False if there was no cached
+        result, which can't be told apart from a cached None otherwise.
+        """
+
+        cached = self.backend.get(call_name, key)
+
+        if cached is None:
+            return False, None
+
+        return True, cached[0]
+
+    def set(self, call_name, key, result):
+        call_config = self.calls[call_name]
+
+        # Wrap the result, so that a cached None isn't mistaken for a miss.
+        self.backend.set(call_name, key, (result,), call_config.get('ttl'), call_config.get('max_entries', 1000))
+
+    def invalidate_after(self, call_name):
+        """Throw away cached results that calling call_name may have changed."""
+
+        for invalidated_call in self.invalidates.get(call_name, ()):
+            if invalidated_call in self.calls:
+                self.backend.invalidate(invalidated_call)
+
+_result_cache = None
+
+def get_result_cache():
+    """Return the ResultCache for the current JINX_RESULT_CACHE setting, or None.
+
+    None means no calls are cached.
+    """
+
+    global _result_cache
+
+    config = getattr(settings, 'JINX_RESULT_CACHE', None)
+
+    if not config:
+        return None
+
+    if _result_cache is None or _result_cache.config is not config:
+        _result_cache = ResultCache(config)
+
+    return _result_cache
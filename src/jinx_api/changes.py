@@ -0,0 +1,293 @@
+"""An append-only log of changes made through the API, for clients to follow.
+
+Instead of polling every host's state, a client can ask for the changes made
+since the last one it saw, and wait for new ones if there aren't any.  Every
+change gets a sequence number one higher than the one before.  The log is
+configured with the JINX_CHANGE_LOG setting:
+
+JINX_CHANGE_LOG = {
+    # MemoryChangeLog keeps changes in the memory of each server process, so
+    # it only works with a single process.  SqliteChangeLog keeps them in a
+    # file all processes on a host can share.
+    'BACKEND': 'jinx_api.changes.MemoryChangeLog',
+    'OPTIONS': {'max_changes': 100000, 'retention': 86400},
+}
+
+Changes are forgotten retention seconds after they were made, or earlier if
+more than max_changes are kept.
+
+A change is a dict like this:
+
+{"seq":       1234,
+ "time":      1308000000.0,
+ "call":      "set_host_state",
+ "hostname":  "sim1234.agni.lindenlab.com",
+ "old_state": "up",
+ "state":     "down"}
+
+set_hosts_state records one change per host it changed.  add_host_state
+records a change with a null hostname and old_state.
+
+Changes are recorded after clusto has been changed, so a client that reads
+the current state and then follows the log from the sequence number it read
+beforehand never misses a change, though it may see some twice.
+"""
+
+import sqlite3
+import threading
+import time
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.importlib import import_module
+
+
+class MemoryChangeLog(object):
+    """Keep changes in memory, oldest first."""
+
+    def __init__(self, max_changes=100000, retention=86400):
+        self.max_changes = max_changes
+        self.retention = retention
+        self._changes = []
+        self._last_seq = 0
+        self._condition = threading.Condition()
+
+    def _expire(self):
+        cutoff = time.time() - self.retention
+        expired = 0
+
+        while expired < len(self._changes) and self._changes[expired]['time'] < cutoff:
+            expired += 1
+
+        expired = max(expired, len(self._changes) - self.max_changes)
+
+        if expired > 0:
+            del self._changes[:expired]
+
+    def append(self, changes):
+        self._condition.acquire()
+        try:
+            for change in changes:
+                self._last_seq += 1
+                self._changes.append(dict(change, seq=self._last_seq))
+
+            self._expire()
+            self._condition.notifyAll()
+        finally:
+            self._condition.release()
+
+    def get_since(self, since, limit):
+        """Return (changes after since, first seq still kept, last seq)."""
+
+        self._condition.acquire()
+        try:
+            self._expire()
+
+            if self._changes:
+                first_seq = self._changes[0]['seq']
+            else:
+                first_seq = self._last_seq + 1
+
+            # Sequence numbers have no gaps, so the position can be worked out.
+            start = max(since + 1 - first_seq, 0)
+
+            return self._changes[start:start + limit], first_seq, self._last_seq
+        finally:
+            self._condition.release()
+
+    def wait(self, since, timeout):
+        """Wait at most timeout seconds for a change after since."""
+
+        self._condition.acquire()
+        try:
+            if self._last_seq <= since:
+                self._condition.wait(timeout)
+        finally:
+            self._condition.release()
+
+
+class SqliteChangeLog(object):
+    """Keep changes in a sqlite database file.
+
+    Every server process using the same file sees the same changes.
+
+    Options:
+        path -- the path to the database file.  It's created if necessary.
+    """
+
+    _columns = ('seq', 'time', 'call', 'hostname', 'old_state', 'state')
+
+    def __init__(self, path, max_changes=100000, retention=86400):
+        self.path = path
+        self.max_changes = max_changes
+        self.retention = retention
+
+        connection = self._connect()
+        try:
+            # AUTOINCREMENT keeps sequence numbers from being reused after
+            # the newest changes are deleted.
+            connection.execute("""CREATE TABLE IF NOT EXISTS jinx_changes (
+                                      seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                                      time REAL,
+                                      call TEXT,
+                                      hostname TEXT,
+                                      old_state TEXT,
+                                      state TEXT)""")
+            connection.commit()
+        finally:
+            connection.close()
+
+    def _connect(self):
+        # sqlite connections can't be shared between threads, and opening
+        # one is cheap, so each operation gets its own.
+        return sqlite3.connect(self.path, timeout=10)
+
+    def _last_seq(self, connection):
+        row = connection.execute("SELECT seq FROM sqlite_sequence WHERE name = 'jinx_changes'").fetchone()
+
+        if row is None:
+            return 0
+
+        return row[0]
+
+    def append(self, changes):
+        connection = self._connect()
+        try:
+            connection.executemany("INSERT INTO jinx_changes (%s) VALUES (%s)" %
+                                   (", ".join(self._columns[1:]), ", ".join("?" * (len(self._columns) - 1))),
+                                   [[change.get(column) for column in self._columns[1:]] for change in changes])
+
+            # Enforce the retention time and the size bound.
+            connection.execute("DELETE FROM jinx_changes WHERE time < ?", (time.time() - self.retention,))
+            connection.execute("DELETE FROM jinx_changes WHERE seq <= ?", (self._last_seq(connection) - self.max_changes,))
+            connection.commit()
+        finally:
+            connection.close()
+
+    def get_since(self, since, limit):
+        """Return (changes after since, first seq still kept, last seq)."""
+
+        connection = self._connect()
+        try:
+            # Read everything in one transaction, so the numbers agree.
+            connection.execute("BEGIN")
+
+            rows = connection.execute("SELECT %s FROM jinx_changes WHERE seq > ? AND time >= ? ORDER BY seq LIMIT ?" %
+                                      ", ".join(self._columns),
+                                      (since, time.time() - self.retention, limit)).fetchall()
+            last_seq = self._last_seq(connection)
+            first_seq = connection.execute("SELECT MIN(seq) FROM jinx_changes WHERE time >= ?",
+                                           (time.time() - self.retention,)).fetchone()[0]
+        finally:
+            connection.close()
+
+        if first_seq is None:
+            first_seq = last_seq + 1
+
+        return [dict(zip(self._columns, row)) for row in rows], first_seq, last_seq
+
+    def wait(self, since, timeout):
+        """Wait at most timeout seconds for a change after since.
+
+        Other processes can't wake this one up, so the file is polled.
+        """
+
+        deadline = time.time() + timeout
+
+        while True:
+            connection = self._connect()
+            try:
+                if self._last_seq(connection) > since:
+                    return
+            finally:
+                connection.close()
+
+            remaining = deadline - time.time()
+
+            if remaining <= 0:
+                return
+
+            time.sleep(min(0.1, remaining))
+
+
+_change_log = None
+_lock = threading.Lock()
+
+def get_change_log():
+    """Return the change log configured by the JINX_CHANGE_LOG setting."""
+
+    global _change_log
+
+    _lock.acquire()
+    try:
+        if _change_log is None:
+            config = getattr(settings, 'JINX_CHANGE_LOG', {})
+            backend_path = config.get('BACKEND', 'jinx_api.changes.MemoryChangeLog')
+            module_name, class_name = backend_path.rsplit('.', 1)
+
+            try:
+                backend_class = getattr(import_module(module_name), class_name)
+            except (ImportError, AttributeError), e:
+                raise ImproperlyConfigured('Error loading change log backend %s: "%s"' % (backend_path, e))
+
+            _change_log = backend_class(**config.get('OPTIONS', {}))
+
+        return _change_log
+    finally:
+        _lock.release()
+
+def record_changes(call_name, changes):
+    """Append changes made by an API call to the log.
+
+    Arguments:
+        call_name -- The name of the API call that made the changes.
+        changes -- A list of dicts with "hostname", "old_state" and "state"
+            keys.
+    """
+
+    now = time.time()
+
+    get_change_log().append([{'time': now,
+                              'call': call_name,
+                              'hostname': change.get('hostname'),
+                              'old_state': change.get('old_state'),
+                              'state': change.get('state')} for change in changes])
+
+def get_changes(since, timeout=0, limit=1000):
+    """Return the changes made after sequence number since.
+
+    If there are none, waits at most timeout seconds for one.  If since is
+    None, no changes are returned, only the number of the latest one to
+    start following the log from.  Returns a dict like this:
+
+    {"changes":   [...],
+     "last_seq":  1234,
+     "truncated": false}
+
+    "changes" holds at most limit changes, oldest first, and "last_seq" is the
+    sequence number of the last change returned, or since if there were none,
+    so it can be passed as since the next time.  "truncated" is true if
+    changes after since have been forgotten (or since is from before the log
+    was reset), so the client should read the current state again.
+    """
+
+    log = get_change_log()
+
+    if since is None:
+        changes, first_seq, last_seq = log.get_since(0, 0)
+
+        return {'changes': [], 'last_seq': last_seq, 'truncated': False}
+
+    changes, first_seq, last_seq = log.get_since(since, limit)
+
+    if not changes and timeout > 0 and since <= last_seq:
+        log.wait(since, timeout)
+        changes, first_seq, last_seq = log.get_since(since, limit)
+
+    if changes:
+        next_seq = changes[-1]['seq']
+    else:
+        next_seq = min(since, last_seq)
+
+    return {'changes': changes,
+            'last_seq': next_seq,
+            'truncated': since + 1 < first_seq or since > last_seq}
@@ -0,0 +1,73 @@
+"""Routing of /jinx/<version>/<call> URLs to API calls by exact name.
+
+Django tries URL patterns one at a time, so routing through a list of
+patterns gets slower with every call added, and since the patterns in
+api_calls match anywhere in the URL, their order decides which call a URL
+reaches.  CallDispatcher stands in for include(api_calls): it splits the
+version off the URL once and looks the call up in a dict.
+"""
+
+from django.core.urlresolvers import RegexURLResolver, Resolver404
+
+try:
+    from django.core.urlresolvers import ResolverMatch
+except ImportError:
+    # Before Django 1.3, resolvers return plain (view, args, kwargs) tuples.
+    ResolverMatch = None
+
+
+class CallDispatcher(RegexURLResolver):
+    """Dispatch API calls by name, for any version of the protocol.
+
+    Arguments:
+        regex -- The pattern for the version part of the URL, e.g.
+            r'^[0-9.-]+/'.  Everything after it is the call name.
+        calls -- A list of URL patterns (made with patterns()) whose regexes
+            are the names of the calls, like api_calls.
+        version_calls -- optional; a dict mapping versions (e.g. '2.0') to
+            lists of patterns for calls that behave differently in that
+            version.  They take precedence over calls.
+
+    Reversing URLs works as it does with include(calls).
+    """
+
+    def __init__(self, regex, calls, version_calls=None):
+        RegexURLResolver.__init__(self, regex, calls)
+
+        self._calls = dict((pattern.regex.pattern, pattern) for pattern in calls)
+        self._version_calls = {}
+
+        for version, patterns in (version_calls or {}).iteritems():
+            for pattern in patterns:
+                self._version_calls[(version, pattern.regex.pattern)] = pattern
+
+    def get_pattern(self, version, call_name):
+        """Return the URL pattern for a call in a version of the protocol, or None."""
+
+        pattern = self._version_calls.get((version, call_name))
+
+        if pattern is None:
+            pattern = self._calls.get(call_name)
+
+        return pattern
+
+    def resolve(self, path):
+        match = self.regex.search(path)
+
+        if match is None:
+            raise Resolver404, {'path': path}
+
+        version = match.group(0).rstrip('/')
+        call_name = path[match.end():]
+        pattern = self.get_pattern(version, call_name)
+
+        if pattern is None:
+            raise Resolver404, {'tried': [], 'path': call_name}
+
+        kwargs = dict(pattern.default_args)
+
+        if ResolverMatch is None:
+            return pattern.callback, (), kwargs
+
+        # Resolvers that include this one read the match's attributes.
+        return ResolverMatch(pattern.callback, (), kwargs, pattern.name)
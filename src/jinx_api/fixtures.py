@@ -0,0 +1,148 @@
+"""Clusto databases that are built once and restored for every test or benchmark.
+
+Filling clusto through its drivers is slow: every entity and attribute is its
+own INSERT, and a large inventory takes minutes.  A Fixture runs a function
+that fills clusto once, into a sqlite file (the image), and afterwards
+restore() just copies the image and connects clusto to the copy, so each
+user gets the data fresh, and changes made to it never leak into the next
+one:
+
+    RACKS = Fixture(build_racks)
+
+    class TestSomething(JinxTestCase):
+        fixture = RACKS
+
+The value the build function returns (e.g. the names of what it created) is
+kept as Fixture.data.  Images live in a temporary directory that's removed
+when the process exits, unless the Fixture is given a path, in which case
+the image (and a pickle of its data) is kept there and reused by later runs
+until the file is deleted.
+"""
+
+import ConfigParser
+import atexit
+import cPickle as pickle
+import os
+import shutil
+import tempfile
+import threading
+import clusto
+
+_temp_dir = None
+_lock = threading.Lock()
+
+def _get_temp_dir():
+    global _temp_dir
+
+    _lock.acquire()
+    try:
+        if _temp_dir is None:
+            _temp_dir = tempfile.mkdtemp(prefix='jinx-fixtures-')
+            atexit.register(shutil.rmtree, _temp_dir, True)
+
+        return _temp_dir
+    finally:
+        _lock.release()
+
+def connect(path):
+    """Connect clusto to the sqlite database in the file at path."""
+
+    conf = ConfigParser.ConfigParser()
+    conf.add_section('clusto')
+    conf.set('clusto', 'dsn', 'sqlite:///%s' % path)
+    clusto.connect(conf)
+
+def disconnect():
+    """Disconnect clusto, and close its connections, so its file can be copied or removed."""
+
+    engine = clusto.SESSION.bind
+
+    clusto.clear()
+    clusto.disconnect()
+
+    # clusto.connect() only configures sessions created afterwards, so the
+    # thread's session has to go, or it would keep using this database.
+    clusto.SESSION.remove()
+    engine.dispose()
+
+
+class Fixture(object):
+    """A clusto database built once by a function, and copied for each use.
+
+    Arguments:
+        build -- A function that fills the connected (empty) clusto
+            database.  What it returns is kept as the data attribute.
+        path -- optional; where to keep the image between runs.
+    """
+
+    def __init__(self, build, path=None):
+        self.build = build
+        self.path = path
+        self.data = None
+        self._image = None
+        self._copy = None
+
+    def _make_image(self):
+        if self.path is not None and os.path.exists(self.path) and os.path.exists(self.path + '.pickle'):
+            data_file = open(self.path + '.pickle', 'rb')
+            try:
+                self.data = pickle.load(data_file)
+            finally:
+                data_file.close()
+
+            self._image = self.path
+            return
+
+        if self.path is None:
+            handle, image = tempfile.mkstemp(suffix='.sqlite', dir=_get_temp_dir())
+            os.close(handle)
+            os.remove(image)
+        else:
+            image = self.path
+
+            for stale in (image, image + '.pickle'):
+                if os.path.exists(stale):
+                    os.remove(stale)
+
+        connect(image)
+        try:
+            clusto.init_clusto()
+            data = self.build()
+            clusto.flush()
+        finally:
+            disconnect()
+
+        if self.path is not None:
+            # The data is saved last, so a partly built image is never reused.
+            data_file = open(self.path + '.pickle', 'wb')
+            try:
+                pickle.dump(data, data_file, pickle.HIGHEST_PROTOCOL)
+            finally:
+                data_file.close()
+
+        self.data = data
+        self._image = image
+
+    def restore(self):
+        """Connect clusto to a fresh copy of the fixture, building it first if necessary."""
+
+        if self._image is None:
+            self._make_image()
+
+        if self._copy is not None:
+            self.release()
+
+        handle, self._copy = tempfile.mkstemp(suffix='.sqlite', dir=_get_temp_dir())
+        os.close(handle)
+        shutil.copyfile(self._image, self._copy)
+        connect(self._copy)
+
+    def release(self):
+        """Disconnect clusto from the copy made by restore(), and remove it."""
+
+        if self._copy is None:
+            return
+
+        disconnect()
+        os.remove(self._copy)
+        self._copy = None
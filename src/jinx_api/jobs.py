@@ -0,0 +1,383 @@
+"""Background jobs for API calls that take too long to run inside a request.
+
+A job is a function call queued on a WorkerPool.  Its progress and result are
+kept in a job store, so that clients can poll for them with the job's ID.  The
+store is configured with the JINX_JOB_STORE setting:
+
+JINX_JOB_STORE = {
+    # MemoryJobStore keeps jobs in the memory of each server process, so a
+    # job can only be looked up through the process that started it.
+    # SqliteJobStore keeps them in a file all processes on a host can share.
+    'BACKEND': 'jinx_api.jobs.MemoryJobStore',
+    'OPTIONS': {'max_jobs': 10000, 'retention': 3600},
+}
+
+Jobs are forgotten retention seconds after they were submitted, or earlier
+if more than max_jobs are kept.
+
+A job is a dict like this:
+
+{"id":           "8c4a1b0e2f6d4e1f9d0a7b3c5e2f1a09",
+ "call":         "power_cycle",
+ "args":         ["sim1234.agni.lindenlab.com"],
+ "state":        "finished",
+ "submitted_at": 1308000000.0,
+ "started_at":   1308000000.1,
+ "finished_at":  1308000004.2,
+ "deadline":     1308000300.0,
+ "status":       200,
+ "result":       ...}
+
+"state" is "queued", "running" or "finished".  "status" and "result" are
+None until the job finishes; then they hold the HTTP status code and result
+the call would have had if it had been made directly.
+
+A job that hasn't finished by its deadline (JINX_JOB_TIMEOUT seconds after
+it was submitted, unless submit_job() was given another timeout) is finished
+with status 504 the next time it's looked up, and its task is abandoned so
+that it doesn't keep a worker thread from other jobs.
+"""
+
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+import simplejson
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.http import HttpResponse
+from django.utils.importlib import import_module
+from jinx_api.cache import LRUCache
+from jinx_api.workers import WorkerPool
+
+
+class MemoryJobStore(object):
+    """Keep jobs in memory, in an LRUCache."""
+
+    def __init__(self, max_jobs=10000, retention=3600):
+        self.retention = retention
+        self._jobs = LRUCache(max_jobs)
+        self._lock = threading.Lock()
+
+    def add(self, job):
+        self._jobs.set(job['id'], job, self.retention)
+
+    def update(self, job_id, **fields):
+        self._lock.acquire()
+        try:
+            job = self._jobs.get(job_id)
+
+            if job is not None:
+                # Replace the dict rather than changing it, so that readers
+                # never see a half-updated job.
+                job = dict(job)
+                job.update(fields)
+                self._jobs.set(job_id, job, self.retention - (time.time() - job['submitted_at']))
+        finally:
+            self._lock.release()
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+
+class SqliteJobStore(object):
+    """Keep jobs in a sqlite database file.
+
+    Every server process using the same file sees the same jobs.
+
+    Options:
+        path -- the path to the database file.  It's created if necessary.
+    """
+
+    _columns = ('id', 'call', 'args', 'state', 'submitted_at', 'started_at', 'finished_at', 'deadline', 'status',
+                'result')
+    _json_columns = ('args', 'result')
+
+    def __init__(self, path, max_jobs=10000, retention=3600):
+        self.path = path
+        self.max_jobs = max_jobs
+        self.retention = retention
+
+        connection = self._connect()
+        try:
+            connection.execute("""CREATE TABLE IF NOT EXISTS jinx_jobs (
+                                      id TEXT PRIMARY KEY,
+                                      call TEXT,
+                                      args TEXT,
+                                      state TEXT,
+                                      submitted_at REAL,
+                                      started_at REAL,
+                                      finished_at REAL,
+                                      deadline REAL,
+                                      status INTEGER,
+                                      result TEXT)""")
+            connection.execute("CREATE INDEX IF NOT EXISTS jinx_jobs_submitted_at ON jinx_jobs (submitted_at)")
+            connection.commit()
+        finally:
+            connection.close()
+
+    def _connect(self):
+        # sqlite connections can't be shared between threads, and opening
+        # one is cheap, so each operation gets its own.
+        return sqlite3.connect(self.path, timeout=10)
+
+    def _encode(self, column, value):
+        if column in self._json_columns:
+            return simplejson.dumps(value)
+        return value
+
+    def add(self, job):
+        connection = self._connect()
+        try:
+            connection.execute("INSERT INTO jinx_jobs (%s) VALUES (%s)" %
+                               (", ".join(self._columns), ", ".join("?" * len(self._columns))),
+                               [self._encode(column, job.get(column)) for column in self._columns])
+
+            # Enforce the retention time and the size bound.
+            connection.execute("DELETE FROM jinx_jobs WHERE submitted_at < ?", (time.time() - self.retention,))
+            connection.execute("""DELETE FROM jinx_jobs WHERE id NOT IN
+                                      (SELECT id FROM jinx_jobs ORDER BY submitted_at DESC LIMIT ?)""",
+                               (self.max_jobs,))
+            connection.commit()
+        finally:
+            connection.close()
+
+    def update(self, job_id, **fields):
+        columns = [column for column in self._columns if column in fields]
+
+        connection = self._connect()
+        try:
+            connection.execute("UPDATE jinx_jobs SET %s WHERE id = ?" % ", ".join("%s = ?" % column for column in columns),
+                               [self._encode(column, fields[column]) for column in columns] + [job_id])
+            connection.commit()
+        finally:
+            connection.close()
+
+    def get(self, job_id):
+        connection = self._connect()
+        try:
+            row = connection.execute("SELECT %s FROM jinx_jobs WHERE id = ? AND submitted_at >= ?" % ", ".join(self._columns),
+                                     (job_id, time.time() - self.retention)).fetchone()
+        finally:
+            connection.close()
+
+        if row is None:
+            return None
+
+        job = dict(zip(self._columns, row))
+
+        for column in self._json_columns:
+            job[column] = simplejson.loads(job[column])
+
+        return job
+
+
+_job_store = None
+_job_pool = None
+_lock = threading.Lock()
+
+# The Task of each unfinished job this process submitted, by job ID, so that
+# overdue ones can be abandoned.
+_job_tasks = {}
+
+def get_job_store():
+    """Return the job store configured by the JINX_JOB_STORE setting."""
+
+    global _job_store
+
+    _lock.acquire()
+    try:
+        if _job_store is None:
+            config = getattr(settings, 'JINX_JOB_STORE', {})
+            backend_path = config.get('BACKEND', 'jinx_api.jobs.MemoryJobStore')
+            module_name, class_name = backend_path.rsplit('.', 1)
+
+            try:
+                backend_class = getattr(import_module(module_name), class_name)
+            except (ImportError, AttributeError), e:
+                raise ImproperlyConfigured('Error loading job store backend %s: "%s"' % (backend_path, e))
+
+            _job_store = backend_class(**config.get('OPTIONS', {}))
+
+        return _job_store
+    finally:
+        _lock.release()
+
+def _get_job_pool():
+    global _job_pool
+
+    _lock.acquire()
+    try:
+        if _job_pool is None:
+            _job_pool = WorkerPool(getattr(settings, 'JINX_JOB_WORKERS', 8), name='jinx-job')
+
+        return _job_pool
+    finally:
+        _lock.release()
+
+def _timeout_message(job):
+    return '%s did not finish within %g seconds.' % (job['call'], job['deadline'] - job['submitted_at'])
+
+def _run_job(store, job_id, call_name, function, deadline):
+    store.update(job_id, state='running', started_at=time.time())
+
+    try:
+        result = function()
+    except:
+        status = 500
+        result = traceback.format_exc()
+    else:
+        if isinstance(result, HttpResponse):
+            status = result.status_code
+            result = result.content
+        else:
+            status = 200
+
+            # Make sure the result can be stored and sent back to the client.
+            try:
+                simplejson.dumps(result)
+            except TypeError, e:
+                status = 500
+                result = '%s returned unserializable data: %s' % (call_name, str(e))
+
+    _lock.acquire()
+    try:
+        _job_tasks.pop(job_id, None)
+    finally:
+        _lock.release()
+
+    finished_at = time.time()
+
+    # The job may already have been reported as timed out; don't contradict that.
+    if finished_at > deadline:
+        job = store.get(job_id)
+
+        if job is not None:
+            status = 504
+            result = _timeout_message(job)
+
+    store.update(job_id, state='finished', finished_at=finished_at, status=status, result=result)
+
+def _time_out_job(store, job):
+    """Finish an overdue job with status 504, abandoning its task if it's running in this process."""
+
+    _lock.acquire()
+    try:
+        task = _job_tasks.pop(job['id'], None)
+    finally:
+        _lock.release()
+
+    if task is not None:
+        _get_job_pool().abandon(task)
+
+    fields = {'state': 'finished', 'finished_at': time.time(), 'status': 504, 'result': _timeout_message(job)}
+    store.update(job['id'], **fields)
+
+    job = dict(job)
+    job.update(fields)
+
+    return job
+
+def _abandon_overdue_jobs(store):
+    _lock.acquire()
+    try:
+        job_ids = list(_job_tasks)
+    finally:
+        _lock.release()
+
+    now = time.time()
+
+    for job_id in job_ids:
+        job = store.get(job_id)
+
+        if job is not None and job['state'] != 'finished' and now > job['deadline']:
+            _time_out_job(store, job)
+
+def submit_job(call_name, args, function, timeout=None):
+    """Queue function() to run in the background and return the new job's ID.
+
+    function may return an HttpResponse to report an error, just like a view.
+
+    Arguments:
+        call_name -- The name of the API call the job performs.
+        args -- The arguments to that API call.  These are only recorded for
+            clients' information, so they must be JSON-serializable.
+        function -- The function to run, which takes no arguments.
+        timeout -- optional; the number of seconds after which the job is
+            given up on (defaults to JINX_JOB_TIMEOUT).
+    """
+
+    store = get_job_store()
+
+    # Free the worker threads of jobs nobody has come back for.
+    _abandon_overdue_jobs(store)
+
+    if timeout is None:
+        timeout = getattr(settings, 'JINX_JOB_TIMEOUT', 300)
+
+    submitted_at = time.time()
+
+    job = {'id': uuid.uuid4().hex,
+           'call': call_name,
+           'args': list(args),
+           'state': 'queued',
+           'submitted_at': submitted_at,
+           'started_at': None,
+           'finished_at': None,
+           'deadline': submitted_at + timeout,
+           'status': None,
+           'result': None}
+
+    store.add(job)
+    pool = _get_job_pool()
+
+    # Holding the lock keeps _run_job from finishing the job before its task
+    # is recorded.
+    _lock.acquire()
+    try:
+        _job_tasks[job['id']] = pool.submit(_run_job, store, job['id'], call_name, function, job['deadline'])
+    finally:
+        _lock.release()
+
+    return job['id']
+
+def get_job(job_id):
+    """Return the job with the given ID, or None if there isn't one (anymore).
+
+    A job that's past its deadline is finished with status 504 first.
+    """
+
+    store = get_job_store()
+    job = store.get(job_id)
+
+    if job is not None and job['state'] != 'finished' and time.time() > job['deadline']:
+        job = _time_out_job(store, job)
+
+    return job
+
+def wait_for_jobs(job_ids, timeout):
+    """Wait for jobs to finish, for at most timeout seconds.
+
+    Returns a dict mapping each of job_ids to its job, or to None if there is
+    no such job.
+    """
+
+    deadline = time.time() + timeout
+    jobs = {}
+    unfinished = set(job_ids)
+
+    while True:
+        for job_id in list(unfinished):
+            job = get_job(job_id)
+            jobs[job_id] = job
+
+            if job is None or job['state'] == 'finished':
+                unfinished.discard(job_id)
+
+        remaining = deadline - time.time()
+
+        if not unfinished or remaining <= 0:
+            return jobs
+
+        time.sleep(min(0.1, remaining))
@@ -0,0 +1,287 @@
+"""Per-call performance metrics, in the Prometheus text exposition format.
+
+InstrumentationMiddleware records, for every API call:
+
+    jinx_requests_total                 requests, by call and status code
+    jinx_request_duration_seconds       histogram of time spent in Django,
+                                        including streaming the response
+    jinx_response_size_bytes            histogram of response body sizes
+    jinx_sql_queries_total              SQL statements executed
+    jinx_sql_duration_seconds_total     time spent executing them
+    jinx_json_decode_seconds_total      time spent decoding request bodies
+    jinx_json_encode_seconds_total      time spent encoding responses (in
+                                        either format)
+
+The numbers are kept in the memory of each server process, and are served by
+the /jinx/metrics endpoint.  SQL statements are counted by hooking the
+SQLAlchemy engine that clusto uses.
+"""
+
+import bisect
+import re
+import threading
+import time
+
+REQUEST_DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+RESPONSE_SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000, 100000000)
+
+# Maps metric names to (type, help text, histogram buckets).
+METRICS = {
+    'jinx_requests_total': ('counter', 'API requests handled', None),
+    'jinx_request_duration_seconds': ('histogram', 'Time taken to handle API requests', REQUEST_DURATION_BUCKETS),
+    'jinx_response_size_bytes': ('histogram', 'Size of API response bodies', RESPONSE_SIZE_BUCKETS),
+    'jinx_sql_queries_total': ('counter', 'SQL statements executed by API requests', None),
+    'jinx_sql_duration_seconds_total': ('counter', 'Time spent executing SQL statements', None),
+    'jinx_json_decode_seconds_total': ('counter', 'Time spent decoding request bodies (JSON or MessagePack)', None),
+    'jinx_json_encode_seconds_total': ('counter', 'Time spent encoding responses (JSON or MessagePack)', None),
+}
+
+
+class Histogram(object):
+    """Counts of observed values falling at or below each of a list of bounds."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        # The counts are cumulative, as Prometheus wants them.
+        for i in xrange(bisect.bisect_left(self.buckets, value), len(self.buckets)):
+            self.counts[i] += 1
+
+        self.sum += value
+        self.count += 1
+
+
+def _format_labels(labels):
+    escaped = []
+
+    for name, value in labels:
+        value = unicode(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        escaped.append('%s="%s"' % (name, value))
+
+    return '{%s}' % ','.join(escaped)
+
+def _format_number(value):
+    if isinstance(value, float):
+        return repr(value)
+
+    return str(value)
+
+
+class MetricsRegistry(object):
+    """A thread-safe collection of counters and histograms, with labels."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+        # Map (metric name, labels) -> value or Histogram.  labels is a tuple
+        # of (label name, label value) pairs.
+        self._counters = {}
+        self._histograms = {}
+
+    def inc(self, name, labels, amount=1):
+        self._lock.acquire()
+        try:
+            key = (name, labels)
+            self._counters[key] = self._counters.get(key, 0) + amount
+        finally:
+            self._lock.release()
+
+    def observe(self, name, labels, value):
+        self._lock.acquire()
+        try:
+            key = (name, labels)
+
+            if key not in self._histograms:
+                self._histograms[key] = Histogram(METRICS[name][2])
+
+            self._histograms[key].observe(value)
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._counters.clear()
+            self._histograms.clear()
+        finally:
+            self._lock.release()
+
+    def get(self, name, labels):
+        """Return a counter's value, or a histogram's (count, sum); mostly for tests."""
+
+        self._lock.acquire()
+        try:
+            key = (name, labels)
+
+            if key in self._histograms:
+                return self._histograms[key].count, self._histograms[key].sum
+
+            return self._counters.get(key, 0)
+        finally:
+            self._lock.release()
+
+    def render(self):
+        """Return all metrics in the Prometheus text exposition format."""
+
+        lines = []
+
+        self._lock.acquire()
+        try:
+            for name in sorted(METRICS):
+                metric_type, help_text, buckets = METRICS[name]
+
+                lines.append('# HELP %s %s' % (name, help_text))
+                lines.append('# TYPE %s %s' % (name, metric_type))
+
+                if metric_type == 'counter':
+                    for (metric_name, labels), value in sorted(self._counters.items()):
+                        if metric_name == name:
+                            lines.append('%s%s %s' % (name, _format_labels(labels), _format_number(value)))
+                else:
+                    for (metric_name, labels), histogram in sorted(self._histograms.items()):
+                        if metric_name != name:
+                            continue
+
+                        for bound, count in zip(histogram.buckets, histogram.counts):
+                            lines.append('%s_bucket%s %d' % (name, _format_labels(labels + (('le', bound),)), count))
+
+                        lines.append('%s_bucket%s %d' % (name, _format_labels(labels + (('le', '+Inf'),)), histogram.count))
+                        lines.append('%s_sum%s %s' % (name, _format_labels(labels), _format_number(histogram.sum)))
+                        lines.append('%s_count%s %d' % (name, _format_labels(labels), histogram.count))
+        finally:
+            self._lock.release()
+
+        return '\n'.join(lines) + '\n'
+
+registry = MetricsRegistry()
+
+
+class RequestStats(object):
+    """What one request has spent its time on so far."""
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.call = 'unknown'
+        self.sql_queries = 0
+        self.sql_time = 0.0
+        self.sql_statements = {}  # statement -> times executed
+        self.json_decode_time = 0.0
+        self.json_encode_time = 0.0
+
+_local = threading.local()
+
+def start_request():
+    """Start collecting stats for the request being handled by this thread."""
+
+    _local.stats = RequestStats()
+
+    return _local.stats
+
+def current_request():
+    """Return the RequestStats for this thread's request, or None if there isn't one."""
+
+    return getattr(_local, 'stats', None)
+
+def add_time(field, seconds):
+    """Add time spent on something (e.g. 'json_encode_time') to this thread's request."""
+
+    stats = current_request()
+
+    if stats is not None:
+        setattr(stats, field, getattr(stats, field) + seconds)
+
+def finish_request(stats, status, size):
+    """Record a finished request's stats in the registry."""
+
+    labels = (('call', stats.call),)
+
+    registry.inc('jinx_requests_total', labels + (('status', status),))
+    registry.observe('jinx_request_duration_seconds', labels, time.time() - stats.started_at)
+    registry.observe('jinx_response_size_bytes', labels, size)
+    registry.inc('jinx_sql_queries_total', labels, stats.sql_queries)
+    registry.inc('jinx_sql_duration_seconds_total', labels, stats.sql_time)
+    registry.inc('jinx_json_decode_seconds_total', labels, stats.json_decode_time)
+    registry.inc('jinx_json_encode_seconds_total', labels, stats.json_encode_time)
+
+    if current_request() is stats:
+        _local.stats = None
+
+
+def _record_query(seconds, statement):
+    stats = current_request()
+
+    if stats is not None:
+        stats.sql_queries += 1
+        stats.sql_time += seconds
+        stats.sql_statements[statement] = stats.sql_statements.get(statement, 0) + 1
+
+_in_list_re = re.compile(r'\(\s*\?(\s*,\s*\?)*\s*\)')
+
+def statement_shape(statement):
+    """Return a statement with its whitespace and IN (?, ?, ...) lists normalized.
+
+    Statements run with different parameters are already the same, since
+    their values are bound separately; this also makes them the same when the
+    IN lists they were given have different lengths.
+    """
+
+    return _in_list_re.sub('(?)', ' '.join(statement.split()))
+
+def repeated_statements(stats, threshold):
+    """Return [(count, shape), ...] for statement shapes a request ran at least threshold times, most first."""
+
+    counts = {}
+
+    for statement, count in stats.sql_statements.iteritems():
+        shape = statement_shape(statement)
+        counts[shape] = counts.get(shape, 0) + count
+
+    return sorted([(total, repeated) for repeated, total in counts.iteritems() if total >= threshold], reverse=True)
+
+def instrument_engine(engine):
+    """Count the SQL statements executed through a SQLAlchemy engine.
+
+    Statements are charged to the request being handled by the thread that
+    runs them.  Instrumenting the same engine again does nothing.
+    """
+
+    if getattr(engine, '_jinx_instrumented', False):
+        return
+
+    try:
+        from sqlalchemy import event
+    except ImportError:
+        event = None
+
+    if event is not None:
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            _local.query_started_at = time.time()
+
+        def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            _record_query(time.time() - getattr(_local, 'query_started_at', time.time()), statement)
+
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', after_cursor_execute)
+    else:
+        # Older SQLAlchemy versions (which clusto has long used) only take a
+        # ConnectionProxy when the engine is created, but the engine just
+        # wraps its Connection class in the proxy, which can be done later.
+        from sqlalchemy.interfaces import ConnectionProxy
+        from sqlalchemy.engine.base import _proxy_connection_cls
+
+        class QueryTimingProxy(ConnectionProxy):
+            def cursor_execute(self, execute, cursor, statement, parameters, context, executemany):
+                started_at = time.time()
+
+                try:
+                    return execute(cursor, statement, parameters, context)
+                finally:
+                    _record_query(time.time() - started_at, statement)
+
+        engine.Connection = _proxy_connection_cls(engine.Connection, QueryTimingProxy())
+
+    engine._jinx_instrumented = True
@@ -1,98 +1,535 @@
-import simplejson
-from django.http import HttpResponse, HttpResponseServerError, HttpResponseBadRequest, HttpResponseNotAllowed
+import clusto
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseServerError, HttpResponseBadRequest, HttpResponseNotAllowed, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
 from jinx_api.http import HttpResponseUnsupportedMediaType
+from jinx_api.api.versioning import get_version_tag
+from jinx_api.authorization import check_authorization
+from jinx_api.cache import get_result_cache
+from jinx_api.registry import get_view_info, build_registry
+from jinx_api import metrics
+from jinx_api.pagination import Page, encode_cursor, get_page_request, paginate, parse_page_request
+from jinx_api.serialization import get_codec, get_codec_for_media_type, negotiate_codec, DecodeError, JSON_MEDIA_TYPE
+import cProfile
 import functools
+import hashlib
+import itertools
+import logging
+import pstats
+import simplejson
+import StringIO
+import time
 import traceback
 import sys
-import inspect
+import zlib
 
+# When streaming a list-like response, this many items are encoded and sent
+# to the client at a time.
+STREAM_CHUNK_ITEMS = 1000
 
-def trim_docstring(docstring):
-    """ Trim a docstring.
+
+def is_streamable(data):
+    """Return True if data is an iterator or other lazy iterable returned by a view.
     
-    Follows the rules of PEP 257:
+    Lists, tuples, dicts and strings are regular JSON data and are encoded
+    all at once.  Anything else that can be iterated over (e.g. a generator)
+    is encoded as a JSON array incrementally, without building the whole list
+    in memory.
+    """
     
-    Strip a uniform amount of indentation from the second and further lines 
-    of the docstring, equal to the minimum indentation of all non-blank lines
-    after the first line. Any indentation in the first line of the docstring 
-    (i.e., up to the first newline) is insignificant and removed. Relative 
-    indentation of later lines in the docstring is retained. Blank lines should
-    be removed from the beginning and end of the docstring.
+    return hasattr(data, '__iter__') and not isinstance(data, (list, tuple, dict, basestring))
+
+def json_array_chunks(items, chunk_items=STREAM_CHUNK_ITEMS):
+    """Encode the items from an iterable as a JSON array, a few at a time.
     
-    This following code was taken directly from PEP 257.
+    This is a generator that yields strings which, concatenated together,
+    form a JSON array.  Only chunk_items items are held in memory at once.
     """
-    if not docstring:
-        return ''
-    # Convert tabs to spaces (following the normal Python rules)
-    # and split into a list of lines:
-    lines = docstring.expandtabs().splitlines()
-    # Determine minimum indentation (first line doesn't count):
-    indent = sys.maxint
-    for line in lines[1:]:
-        stripped = line.lstrip()
-        if stripped:
-            indent = min(indent, len(line) - len(stripped))
-    # Remove indentation (first line is special):
-    trimmed = [lines[0].strip()]
-    if indent < sys.maxint:
-        for line in lines[1:]:
-            trimmed.append(line[indent:].rstrip())
-    # Strip off trailing and leading blank lines:
-    while trimmed and not trimmed[-1]:
-        trimmed.pop()
-    while trimmed and not trimmed[0]:
-        trimmed.pop(0)
-    # Return a single string:
-    return '\n'.join(trimmed)
+    
+    codec = get_codec()
+    
+    yield '['
+    
+    chunk = []
+    separator = ''
+    
+    for item in items:
+        chunk.append(separator)
+        chunk.append(codec.dumps(item))
+        separator = ', '
+        
+        if len(chunk) >= 2 * chunk_items:
+            yield ''.join(chunk)
+            chunk = []
+    
+    chunk.append(']')
+    yield ''.join(chunk)
 
+def _run_view(request, view, args, kwargs, stream):
+    """Call a view function; see call_view()."""
+    
+    try:
+        response_data = view(request, *args, **kwargs)
+        
+        if is_streamable(response_data):
+            if stream:
+                # Fetch the first item now, so that if the view is going to
+                # fail right away (e.g. a bad query), it fails while I can
+                # still send an error status.
+                iterator = iter(response_data)
+                first_items = list(itertools.islice(iterator, 1))
+                response_data = itertools.chain(first_items, iterator)
+            else:
+                response_data = list(response_data)
+    except:
+        exception_traceback = traceback.format_exception(*sys.exc_info())
+        
+        #print >> sys.stderr, "Unhandled exception from view:"
+        #print >> sys.stderr, exception_traceback
+        
+        response = HttpResponseServerError(exception_traceback, mimetype='text/plain')
+        response['X-Jinx-Error-Source'] = 'api'
+        return response
+    
+    # Let the view return an HTTP response directly if it wants to, e.g. HttpResponseNotFound
+    if isinstance(response_data, HttpResponse):
+        response_data['X-Jinx-Error-Source'] = 'api'
+    
+    return response_data
 
-class APIDocumentationMiddleware(object):
-    """Service requests for documentation"""
+def call_view(request, view, args, kwargs, stream=True, version_tag=None):
+    """Call an API view function and translate failures into HTTP responses.
+    
+    This is the part of JSONMiddleware that actually runs the view.  It is
+    also used by calls like multicall that need to run several views within
+    a single request.
+    
+    Results of calls configured in JINX_RESULT_CACHE are served from the
+    cache when possible, and calls that change data throw away the cached
+    results they affect (see jinx_api.cache).
+    
+    Arguments:
+        request -- The HttpRequest object from Django.
+        view -- The view function to call.
+        args -- The positional arguments to pass to the view (not including
+            the request).
+        kwargs -- The keyword arguments to pass to the view.
+        stream -- optional; if False, an iterator returned by the view is
+            turned into a list before returning.
+        version_tag -- optional; the clusto version tag the result is sent
+            out under (e.g. in an ETag).  Only results cached at that version
+            are used.
+    
+    Returns:
+        Whatever data the view returned, or an HttpResponse.  If the view
+        returned an HttpResponse, or if it could not be called or raised an
+        exception, the HttpResponse will have the X-Jinx-Error-Source header
+        set to 'api'.
+    """
+    
+    view_info = get_view_info(view)
+    
+    # Make sure the view can be called with these arguments, rather than
+    # calling it and catching a TypeError, which could just as well come from
+    # a bug inside the view.
+    argument_error = view_info.check_arguments(args, kwargs)
+    
+    if argument_error is not None:
+        # This will return an HTTP 400 with a body like this:
+        #   the_function_name() takes exactly 3 arguments (2 given)
+        response = HttpResponseBadRequest(argument_error)
+        
+        # This counts as an error in the API call, so add a header:
+        response['X-Jinx-Error-Source'] = 'api'
+        
+        return response
+    
+    result_cache = get_result_cache()
+    call_name = view_info.name
+    cache_key = None
+    
+    # Pages of results aren't cached; the page isn't part of the key.
+    if (result_cache is not None and result_cache.is_cached(call_name) and not kwargs and
+        get_page_request(request) is None):
+        cache_key = result_cache.make_key(args, version_tag)
+        
+        hit, response_data = result_cache.get(call_name, cache_key)
+        
+        if hit:
+            return response_data
+        
+        # The cache needs the whole result, not an iterator that can only be
+        # used once.
+        stream = False
+    
+    response_data = _run_view(request, view, args, kwargs, stream)
+    
+    if result_cache is not None:
+        if cache_key is not None and not isinstance(response_data, HttpResponse):
+            result_cache.set(call_name, cache_key, response_data)
+        
+        result_cache.invalidate_after(call_name)
+    
+    return response_data
+
+
+def _counting_chunks(chunks, stats, status):
+    """Pass a streamed response through, recording its stats once it has all been sent.
+    
+    The time spent producing the chunks, which includes running the view's
+    iterator as well as encoding, is counted as JSON encoding time.
+    """
+
+    iterator = iter(chunks)
+    size = 0
+
+    try:
+        while True:
+            started_at = time.time()
+
+            try:
+                chunk = iterator.next()
+            except StopIteration:
+                break
+            finally:
+                stats.json_encode_time += time.time() - started_at
+
+            size += len(chunk)
+            yield chunk
+    finally:
+        metrics.finish_request(stats, status, size)
+
+
+class QueryBudgetExceeded(Exception):
+    """An API call ran more SQL statements than its query budget allows."""
+
+query_logger = logging.getLogger('jinx_api.queries')
+
+def check_query_budget(stats, call_name, budget, config):
+    """Log statements a request ran suspiciously often, and enforce its budget.
+    
+    Arguments:
+        stats -- The request's metrics.RequestStats.
+        call_name -- The name of the API call.
+        budget -- The most statements the call should run, or None.
+        config -- The JINX_QUERY_BUDGET setting.
+    
+    Exceptions Raised:
+        QueryBudgetExceeded -- The call went over its budget, and the ACTION
+            setting is 'raise'.
+    """
+    
+    threshold = config.get('REPEAT_THRESHOLD', 50)
+    
+    if threshold:
+        for count, shape in metrics.repeated_statements(stats, threshold):
+            query_logger.warning("%s ran this statement %d times (one query per entity?): %s", call_name, count, shape)
+    
+    if budget is not None and stats.sql_queries > budget:
+        message = "%s ran %d SQL statements; its budget is %d" % (call_name, stats.sql_queries, budget)
+        
+        if config.get('ACTION', 'warn') == 'raise':
+            raise QueryBudgetExceeded(message)
+        
+        query_logger.warning(message)
+
+def _checked_chunks(chunks, check):
+    """Pass a streamed response through, calling check() once it has all been generated."""
+    
+    for chunk in chunks:
+        yield chunk
+    
+    check()
+
+class QueryBudgetMiddleware(object):
+    """Check the SQL statements run by each API call against its query budget.
+    
+    Views declare their budget with registry.query_budget.  This must come
+    after InstrumentationMiddleware, which counts the statements.  It's
+    configured by the JINX_QUERY_BUDGET setting; None turns it off:
+    
+    JINX_QUERY_BUDGET = {
+        # What to do when a call goes over its budget: 'warn' logs a warning
+        # to the jinx_api.queries logger, 'raise' raises QueryBudgetExceeded
+        # (as the test suite does).
+        'ACTION': 'warn',
+        
+        # Log a warning when a request runs the same statement (apart from
+        # its parameters) this many times, which usually means a view is
+        # querying once per entity.  0 turns this off.
+        'REPEAT_THRESHOLD': 50,
+        
+        # Budgets for particular calls, overriding the views' own.
+        'BUDGETS': {},
+    }
+    
+    Streamed responses are checked once they've been generated, since
+    generating them runs queries too.
+    """
     
     def process_view(self, request, view, view_args, view_kwargs):
-        """Check for a request for documentation and satisfy it.
+        config = getattr(settings, 'JINX_QUERY_BUDGET', None)
         
-        Documentation requests look like normal API calls, except that they use
-        GET and have the 'doc' query parameter."""
+        if config is None:
+            return None
+        
+        view_info = get_view_info(view)
+        budget = config.get('BUDGETS', {}).get(view_info.name, view_info.query_budget)
+        request.jinx_query_budget = (view_info.name, budget, config)
+    
+    def process_response(self, request, response):
+        query_budget = getattr(request, 'jinx_query_budget', None)
+        stats = metrics.current_request()
+        
+        if query_budget is None or stats is None:
+            return response
         
-        if 'doc' in request.GET:
-            # I want to print something like this:
-            #    view_name(arg1, arg2, arg3=default3, ...):
-            # 
-            # I'll have to construct it using the inspect module.
+        if getattr(response, '_is_string', True):
+            check_query_budget(stats, *query_budget)
+        else:
+            response._container = _checked_chunks(response._container,
+                                                  lambda: check_query_budget(stats, *query_budget))
+        
+        return response
+
+
+class InstrumentationMiddleware(object):
+    """Record performance metrics for each request, and profile requests on demand.
+
+    This should be the first middleware, so that the time spent in the others
+    is counted.  See jinx_api.metrics for what's recorded.
+
+    If JINX_ALLOW_PROFILING is set, a request with the 'profile' query
+    parameter (e.g. /jinx/2.0/get_rack_contents?profile) is run under cProfile,
+    and the profile is sent back as text instead of the call's response.
+    ?profile=time sorts the profile by a different key (see pstats); the
+    default, also used for keys pstats doesn't know, is cumulative time.
+    """
+
+    def process_request(self, request):
+        metrics.start_request()
+
+        if clusto.SESSION.bind is not None:
+            metrics.instrument_engine(clusto.SESSION.bind)
+
+        if 'profile' in request.GET and getattr(settings, 'JINX_ALLOW_PROFILING', False):
+            request.jinx_profiler = cProfile.Profile()
+            request.jinx_profiler.enable()
+
+    def process_view(self, request, view, view_args, view_kwargs):
+        stats = metrics.current_request()
+
+        if stats is not None:
+            stats.call = get_view_info(view).name
+
+    def process_response(self, request, response):
+        profiler = getattr(request, 'jinx_profiler', None)
+
+        if profiler is not None:
+            # Streamed responses are generated after this returns, so
+            # generate them now to include them in the profile.
+            response.content = response.content
+            profiler.disable()
+
+            output = StringIO.StringIO()
+            print >> output, "Response status: %d, %d bytes" % (response.status_code, len(response.content))
+            print >> output
+
+            sort_key = request.GET['profile']
+
+            if sort_key not in pstats.Stats.sort_arg_dict_default:
+                sort_key = 'cumulative'
+
+            profile_stats = pstats.Stats(profiler, stream=output)
+            profile_stats.sort_stats(sort_key).print_stats(100)
+
+            response = HttpResponse(output.getvalue(), mimetype='text/plain')
+
+        stats = metrics.current_request()
+
+        if stats is None:
+            return response
+
+        if getattr(response, '_is_string', True):
+            metrics.finish_request(stats, response.status_code, len(response.content))
+        else:
+            # Django generates the body from the iterator after this returns.
+            response._container = _counting_chunks(response._container, stats, response.status_code)
+
+        return response
+
+
+def accepted_encoding(accept_encoding):
+    """Return 'gzip' or 'deflate' for the compression an Accept-Encoding header allows, or None.
+    
+    gzip is preferred when the client rates both the same.
+    """
+    
+    qualities = {}
+    
+    for coding in accept_encoding.split(','):
+        parts = coding.split(';')
+        name = parts[0].strip().lower()
+        quality = 1.0
+        
+        for parameter in parts[1:]:
+            key, _, value = parameter.partition('=')
             
-            args, varargs, varkwargs, defaults = inspect.getargspec(view)
+            if key.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0
+        
+        if name == 'x-gzip':
+            name = 'gzip'
+        
+        qualities[name] = quality
+    
+    best = None
+    best_quality = 0
+    
+    for encoding in ('gzip', 'deflate'):
+        quality = qualities.get(encoding, qualities.get('*', 0))
+        
+        if quality > best_quality:
+            best = encoding
+            best_quality = quality
+    
+    return best
+
+def _compressor(encoding, level):
+    if encoding == 'gzip':
+        # Adding 16 to the window bits makes zlib write a gzip header and
+        # trailer instead of a zlib one.
+        return zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    
+    return zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS)
+
+def compressed_chunks(chunks, compressor):
+    """Compress a stream of strings incrementally, yielding compressed strings."""
+    
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        
+        # zlib holds on to small inputs until it has a block's worth.
+        if compressed:
+            yield compressed
+    
+    yield compressor.flush()
+
+
+class CompressionMiddleware(object):
+    """Compress responses with gzip or deflate, if the client accepts it.
+    
+    Responses smaller than JINX_COMPRESSION_MIN_SIZE bytes are sent as they
+    are, since compressing them saves little.  Streamed responses are
+    compressed as they're streamed: only enough of the stream to tell whether
+    it reaches the minimum size is read up front.
+    """
+    
+    def process_response(self, request, response):
+        if response.has_header('Content-Encoding') or response.status_code in (204, 304):
+            return response
+        
+        # Caches have to keep compressed and uncompressed responses apart.
+        patch_vary_headers(response, ('Accept-Encoding',))
+        
+        encoding = accepted_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        
+        if encoding is None:
+            return response
+        
+        min_size = getattr(settings, 'JINX_COMPRESSION_MIN_SIZE', 1024)
+        compressor = _compressor(encoding, getattr(settings, 'JINX_COMPRESSION_LEVEL', 6))
+        
+        if getattr(response, '_is_string', True):
+            content = response.content
             
-            # Strip off the first parameter, which is the request object
-            args = args[1:]
+            if len(content) < min_size:
+                return response
             
-            signature = view.__name__
+            response.content = compressor.compress(content) + compressor.flush()
             
-            # Defaults are kind of hairy.  inspect fills the defaults list in with
-            # the default values of the trailing arguments in the args list.
+            if response.has_header('Content-Length'):
+                response['Content-Length'] = str(len(response.content))
+        else:
+            chunks = (self._encode_chunk(response, chunk) for chunk in response._container)
+            head = []
+            size = 0
             
-            if defaults is not None:
-                # First, peel off the arguments without defaults
-                arg_list = list(args[:-len(defaults)])
+            for chunk in chunks:
+                head.append(chunk)
+                size += len(chunk)
                 
-                # Now, peel off the rest and add their default value:
-                for arg, default in zip(args[-len(defaults):], defaults):
-                    arg_list.append("%s=%s" % (arg, default))
-            else:
-                arg_list = args
-            
-            # Add a "..." if this function takes variable arguments
-            if varargs is not None:
-                arg_list.append("...")
-            
-            # Finish it off by separating the arguments with commas:
-            signature += "(%s):" % ", ".join(arg_list)
+                if size >= min_size:
+                    break
             
-            docstring = trim_docstring(view.__doc__)
+            if size < min_size:
+                # The whole stream turned out to be small.
+                response.content = ''.join(head)
+                return response
             
-            return HttpResponse(signature + "\n" + docstring, mimetype='text/plain')
+            response._container = compressed_chunks(itertools.chain(head, chunks), compressor)
+        
+        response['Content-Encoding'] = encoding
+        
+        return response
+    
+    def _encode_chunk(self, response, chunk):
+        if isinstance(chunk, unicode):
+            return chunk.encode(response._charset)
+        
+        return chunk
+
+
+class APIDocumentationMiddleware(object):
+    """Service requests for documentation"""
+    
+    def __init__(self):
+        # Work out the documentation for every API call up front.
+        build_registry()
+    
+    def process_view(self, request, view, view_args, view_kwargs):
+        """Check for a request for documentation and satisfy it.
+        
+        Documentation requests look like normal API calls, except that they use
+        GET and have the 'doc' query parameter."""
+        
+        if 'doc' in request.GET and not get_view_info(view).raw:
+            return HttpResponse(get_view_info(view).documentation, mimetype='text/plain')
             
 
+def make_etag(request, args, media_type, version_tag):
+    """Return the ETag for a conditional call's response.
+    
+    The tag covers everything the response depends on: the call (including
+    the protocol version in its path), its arguments, the page asked for,
+    the format it's encoded in, and the state of clusto, given by
+    version_tag.  It's weak, because compressed and uncompressed responses
+    share it.
+    """
+    
+    key = simplejson.dumps([request.path, args, request.GET.get('page_size'), request.GET.get('cursor'),
+                            media_type, version_tag], sort_keys=True)
+    
+    return 'W/"%s"' % hashlib.sha1(key).hexdigest()
+
+def etag_matches(etag, if_none_match):
+    """Return whether an If-None-Match header matches an ETag, using weak comparison."""
+    
+    if not if_none_match:
+        return False
+    
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        
+        if candidate == '*' or candidate.replace('W/', '', 1) == etag.replace('W/', '', 1):
+            return True
+    
+    return False
+
+
 class JSONMiddleware(object):
     """Handle JSON requests and responses"""
 
@@ -111,6 +548,33 @@ class JSONMiddleware(object):
         Content-Type "application/json".  If the view function returns an
         HttpResponse object, this will be sent back to the client as is.
         
+        Clients may use MessagePack instead of JSON, for the request body by
+        sending a Content-Type of "application/x-msgpack", and for the
+        response by sending an Accept header that prefers it.  JSON stays the
+        default for responses, whatever the request was encoded with.
+        
+        If the view function returns an iterator (e.g. a generator), the
+        response is streamed to the client as a JSON array, a few items at a
+        time, so that neither the full list nor the full JSON document has to
+        be held in memory.  An error while streaming can't change the status
+        code anymore; it cuts the response short instead, leaving the client
+        with invalid JSON.  MessagePack responses aren't streamed, because a
+        MessagePack array starts with its length.
+        
+        Data is encoded and decoded with the codecs chosen by the
+        JINX_JSON_CODECS and JINX_MSGPACK_CODECS settings (see
+        jinx_api.serialization).
+        
+        Calls marked with registry.paginated return a page of results, with
+        a cursor for the next page, when the page_size and cursor query
+        parameters are used (see jinx_api.pagination).
+        
+        Responses to the calls listed in JINX_CONDITIONAL_CALLS carry an ETag
+        derived from clusto's latest version number.  A request whose
+        If-None-Match header holds that tag gets a 304 Not Modified, without
+        the view being called at all, as long as nothing in clusto has
+        changed since.
+        
         Arguments:
             request -- The HttpRequest object from Django.
             view -- The view function that Django is about to call.
@@ -119,8 +583,13 @@ class JSONMiddleware(object):
             
         Status Codes Returned:
             200 -- The request was completed successfully.
+            304 -- The client's If-None-Match header matched the ETag of the
+                response (for calls listed in JINX_CONDITIONAL_CALLS).
+            400 -- The page_size or cursor query parameters were invalid, or
+                used with a call that can't be paginated.
             405 -- A method other than POST was used.
-            415 -- A request body type other than application/json was sent.
+            415 -- A request body type other than application/json or
+                application/x-msgpack was sent.
             500 -- The view function raised an unhandled exception, or returned
                 unserializable data (see exception value for details).
             ?   -- View functions may return whatever HTTP status codes they
@@ -128,64 +597,130 @@ class JSONMiddleware(object):
             
         """
     
+        if get_view_info(view).raw:
+            return None
+        
         content_type = request.META['CONTENT_TYPE']
         method = request.META['REQUEST_METHOD']
         
         if method != 'POST':
             return HttpResponseNotAllowed('The Jinx API requires a POST')
+        
+        request_codec = get_codec_for_media_type(content_type)
             
-        if content_type != "application/json":
-            return HttpResponseUnsupportedMediaType('The Jinx API requires a request with Content-Type: application/json')
+        if request_codec is None:
+            return HttpResponseUnsupportedMediaType('The Jinx API requires a request with Content-Type: application/json '
+                                                    'or application/x-msgpack')
             
-        json_data = request.raw_post_data
+        request_data = request.raw_post_data
+        
+        decode_started_at = time.time()
         
         try:
-            json_args = simplejson.loads(json_data)
-        except simplejson.JSONDecodeError, e:
-            return HttpResponseUnsupportedMediaType('Request body could not be parsed as a JSON object: %s' % str(e))
+            request_args = request_codec.loads(request_data)
+        except DecodeError, e:
+            return HttpResponseUnsupportedMediaType('Request body could not be parsed as %s: %s' % (request_codec.media_type, str(e)))
+        finally:
+            metrics.add_time('json_decode_time', time.time() - decode_started_at)
         
-        if type(json_args) != list:
-            return HttpResponseBadRequest('Expected a list of arguments; got %s' % str(type(json_args)))
+        if type(request_args) != list:
+            return HttpResponseBadRequest('Expected a list of arguments; got %s' % str(type(request_args)))
         
-        args = list(view_args) + json_args
+        args = list(view_args) + request_args
+        response_codec = negotiate_codec(request.META.get('HTTP_ACCEPT'))
+        view_info = get_view_info(view)
+        etag = None
+        version_tag = None
         
         try:
-            response_data = view(request, *args, **view_kwargs)
-        except TypeError, e:
-            # This will return an HTTP 400 with a body like this:
-            #   the_function_name() takes 4 arguments (3 given)
-            response = HttpResponseBadRequest(str(e))
-            
-            # This counts as an error in the API call, so add a header:
-            response['X-Jinx-Error-Source'] = 'api'
-            
-            return response
-        except:
-            exception_traceback = traceback.format_exception(*sys.exc_info())
+            page_request = parse_page_request(request, view_info.name, view_info.position_type)
+        except ValueError, e:
+            return HttpResponseBadRequest(str(e))
+        
+        if page_request is not None:
+            if not view_info.paginated:
+                return HttpResponseBadRequest("%s does not support pagination." % view_info.name)
             
-            #print >> sys.stderr, "Unhandled exception from view:"
-            #print >> sys.stderr, exception_traceback
+            request.jinx_page = page_request
+        
+        # The tag is made before calling the view, so a change made while
+        # the view runs can only make the client fetch the data again.  The
+        # result cache is told the version too, since a result it cached
+        # before a change it wasn't told about (e.g. one made by another
+        # process) mustn't go out under the new tag.
+        if view_info.name in getattr(settings, 'JINX_CONDITIONAL_CALLS', ()):
+            version_tag = get_version_tag()
+            etag = make_etag(request, args, response_codec.media_type, version_tag)
             
-            response = HttpResponseServerError(exception_traceback, mimetype='text/plain')
-            response['X-Jinx-Error-Source'] = 'api'
-            return response
+            if etag_matches(etag, request.META.get('HTTP_IF_NONE_MATCH')):
+                response = HttpResponseNotModified()
+                response['ETag'] = etag
+                patch_vary_headers(response, ('Accept',))
+                return response
+        
+        response_data = call_view(request, view, args, view_kwargs, version_tag=version_tag)
         
         # Let the view return an HTTP response directly if it wants to, e.g. HttpResponseNotFound
         if isinstance(response_data, HttpResponse):
-            response_data['X-Jinx-Error-Source'] = 'api'
             return response_data
-        else:
-            try:
-                response_json = simplejson.dumps(response_data)
-            except TypeError, e:
-                return HttpResponseServerError('%s returned unserializable data: %s' % (view.__name__, str(e)))
+        
+        if page_request is not None:
+            if not isinstance(response_data, Page):
+                # The view ignored the page; fall back on slicing its results.
+                response_data = paginate(request, list(response_data))
+                
+                if isinstance(response_data, HttpResponse):
+                    return response_data
             
-        return HttpResponse(response_json, mimetype='application/json')
+            if response_data.next_position is None:
+                next_cursor = None
+            else:
+                next_cursor = encode_cursor(view_info.name, response_data.next_position)
+            
+            response_data = {'results': response_data.items, 'next_cursor': next_cursor}
+        
+        if is_streamable(response_data):
+            if response_codec.media_type == JSON_MEDIA_TYPE:
+                response = HttpResponse(json_array_chunks(response_data), mimetype=JSON_MEDIA_TYPE)
+                patch_vary_headers(response, ('Accept',))
+                
+                if etag is not None:
+                    response['ETag'] = etag
+                
+                return response
+            
+            response_data = list(response_data)
+        
+        encode_started_at = time.time()
+        
+        try:
+            response_body = response_codec.dumps(response_data)
+        except TypeError, e:
+            return HttpResponseServerError('%s returned unserializable data: %s' % (view.__name__, str(e)))
+        finally:
+            metrics.add_time('json_encode_time', time.time() - encode_started_at)
+        
+        response = HttpResponse(response_body, mimetype=response_codec.media_type)
+        patch_vary_headers(response, ('Accept',))
+        
+        if etag is not None:
+            response['ETag'] = etag
+        
+        return response
 
 
 class JinxAuthorizationMiddleware(object):
     def process_view(self, request, view, view_args, view_kwargs):
-        """Return a 403 Forbidden status if LDAP says the user may not make this API call."""
-    
-        # check LDAP to see whether the user (from kerberos authentication) has the right to run this API call
-        pass
+        """Return a 403 Forbidden status if LDAP says the user may not make this API call.
+        
+        The user is the one the web server authenticated with Kerberos.  See
+        jinx_api.authorization for how decisions are made and cached.
+        Multicall checks each of its calls separately.
+        """
+        
+        view_info = get_view_info(view)
+        
+        if view_info.raw:
+            return None
+        
+        return check_authorization(request, view_info.name)
@@ -0,0 +1,220 @@
+"""A small, self-contained MessagePack encoder and decoder.
+
+MessagePack (http://msgpack.org/) is a binary format with the same data model
+as JSON, but it's more compact, and it's quicker to decode in C.  This module
+is used when the msgpack library isn't installed.  It handles the types JSON
+can represent: None, bools, ints, longs, floats, strings, lists/tuples and
+dicts.
+
+Strings are packed with the str types of the format, whether they're
+unicode or str objects.  A str must hold UTF-8 (or ASCII) text, just as it
+would for JSON.  Unpacked strings are always unicode, like those that come
+out of a JSON decoder; bin values are unpacked as str.
+"""
+
+import struct
+
+
+class PackError(TypeError):
+    """Data couldn't be packed, because of its type or size."""
+
+
+class UnpackError(ValueError):
+    """The data being unpacked isn't valid MessagePack."""
+
+
+def _pack_string(data, parts):
+    size = len(data)
+
+    if size < 32:
+        parts.append(chr(0xa0 | size))
+    elif size < 0x100:
+        parts.append('\xd9' + chr(size))
+    elif size < 0x10000:
+        parts.append(struct.pack('>BH', 0xda, size))
+    elif size < 0x100000000:
+        parts.append(struct.pack('>BI', 0xdb, size))
+    else:
+        raise PackError("string too long to pack")
+
+    parts.append(data)
+
+def _pack_int(data, parts):
+    if 0 <= data < 0x80:
+        parts.append(chr(data))
+    elif -32 <= data < 0:
+        parts.append(chr(data & 0xff))
+    elif data >= 0:
+        if data < 0x100:
+            parts.append(struct.pack('>BB', 0xcc, data))
+        elif data < 0x10000:
+            parts.append(struct.pack('>BH', 0xcd, data))
+        elif data < 0x100000000:
+            parts.append(struct.pack('>BI', 0xce, data))
+        elif data < 0x10000000000000000:
+            parts.append(struct.pack('>BQ', 0xcf, data))
+        else:
+            raise PackError("integer too large to pack: %d" % data)
+    else:
+        if data >= -0x80:
+            parts.append(struct.pack('>Bb', 0xd0, data))
+        elif data >= -0x8000:
+            parts.append(struct.pack('>Bh', 0xd1, data))
+        elif data >= -0x80000000:
+            parts.append(struct.pack('>Bi', 0xd2, data))
+        elif data >= -0x8000000000000000:
+            parts.append(struct.pack('>Bq', 0xd3, data))
+        else:
+            raise PackError("integer too small to pack: %d" % data)
+
+def _pack_container_header(size, fix_type, type_16, type_32, parts):
+    if size < 16:
+        parts.append(chr(fix_type | size))
+    elif size < 0x10000:
+        parts.append(struct.pack('>BH', type_16, size))
+    elif size < 0x100000000:
+        parts.append(struct.pack('>BI', type_32, size))
+    else:
+        raise PackError("container too large to pack")
+
+def _pack(data, parts):
+    # Checked roughly in order of how common the types are in Jinx responses.
+    if isinstance(data, unicode):
+        _pack_string(data.encode('utf-8'), parts)
+    elif isinstance(data, str):
+        _pack_string(data, parts)
+    elif data is None:
+        parts.append('\xc0')
+    elif data is True:
+        parts.append('\xc3')
+    elif data is False:
+        parts.append('\xc2')
+    elif isinstance(data, (int, long)):
+        _pack_int(data, parts)
+    elif isinstance(data, float):
+        parts.append(struct.pack('>Bd', 0xcb, data))
+    elif isinstance(data, (list, tuple)):
+        _pack_container_header(len(data), 0x90, 0xdc, 0xdd, parts)
+
+        for item in data:
+            _pack(item, parts)
+    elif isinstance(data, dict):
+        _pack_container_header(len(data), 0x80, 0xde, 0xdf, parts)
+
+        for key, value in data.iteritems():
+            _pack(key, parts)
+            _pack(value, parts)
+    else:
+        raise PackError("%r can't be packed" % (data,))
+
+def packb(data):
+    """Return data packed as a MessagePack str."""
+
+    parts = []
+    _pack(data, parts)
+
+    return ''.join(parts)
+
+
+class _Unpacker(object):
+    def __init__(self, data):
+        self.data = data
+        self.offset = 0
+
+    def _take(self, size):
+        start = self.offset
+        self.offset += size
+
+        if self.offset > len(self.data):
+            raise UnpackError("data ends unexpectedly")
+
+        return self.data[start:self.offset]
+
+    def _unpack_format(self, format, size):
+        return struct.unpack(format, self._take(size))[0]
+
+    def _unpack_string(self, size):
+        try:
+            return self._take(size).decode('utf-8')
+        except UnicodeDecodeError, e:
+            raise UnpackError("invalid UTF-8 in string: %s" % e)
+
+    def _unpack_array(self, size):
+        return [self.unpack() for i in xrange(size)]
+
+    def _unpack_map(self, size):
+        result = {}
+
+        for i in xrange(size):
+            key = self.unpack()
+
+            if isinstance(key, (list, dict)):
+                raise UnpackError("unhashable map key")
+
+            result[key] = self.unpack()
+
+        return result
+
+    def unpack(self):
+        type_byte = ord(self._take(1))
+
+        if type_byte < 0x80:
+            return type_byte
+        elif type_byte >= 0xe0:
+            return type_byte - 0x100
+        elif 0xa0 <= type_byte <= 0xbf:
+            return self._unpack_string(type_byte & 0x1f)
+        elif 0x90 <= type_byte <= 0x9f:
+            return self._unpack_array(type_byte & 0x0f)
+        elif 0x80 <= type_byte <= 0x8f:
+            return self._unpack_map(type_byte & 0x0f)
+        elif type_byte == 0xc0:
+            return None
+        elif type_byte == 0xc2:
+            return False
+        elif type_byte == 0xc3:
+            return True
+        elif type_byte in _FIXED_FORMATS:
+            return self._unpack_format(*_FIXED_FORMATS[type_byte])
+        elif type_byte in _STRING_SIZES:
+            return self._unpack_string(self._unpack_format(*_STRING_SIZES[type_byte]))
+        elif type_byte in _BIN_SIZES:
+            return self._take(self._unpack_format(*_BIN_SIZES[type_byte]))
+        elif type_byte == 0xdc:
+            return self._unpack_array(self._unpack_format('>H', 2))
+        elif type_byte == 0xdd:
+            return self._unpack_array(self._unpack_format('>I', 4))
+        elif type_byte == 0xde:
+            return self._unpack_map(self._unpack_format('>H', 2))
+        elif type_byte == 0xdf:
+            return self._unpack_map(self._unpack_format('>I', 4))
+        else:
+            # Extension types (and the unused 0xc1) have no JSON equivalent.
+            raise UnpackError("unsupported type byte 0x%02x" % type_byte)
+
+# Type bytes followed by a fixed-size value: (struct format, size).
+_FIXED_FORMATS = {
+    0xca: ('>f', 4), 0xcb: ('>d', 8),
+    0xcc: ('>B', 1), 0xcd: ('>H', 2), 0xce: ('>I', 4), 0xcf: ('>Q', 8),
+    0xd0: ('>b', 1), 0xd1: ('>h', 2), 0xd2: ('>i', 4), 0xd3: ('>q', 8),
+}
+
+# Type bytes followed by the size of a string or bin value.
+_STRING_SIZES = {0xd9: ('>B', 1), 0xda: ('>H', 2), 0xdb: ('>I', 4)}
+_BIN_SIZES = {0xc4: ('>B', 1), 0xc5: ('>H', 2), 0xc6: ('>I', 4)}
+
+def unpackb(data):
+    """Unpack a MessagePack str.  Raises UnpackError if it isn't valid."""
+
+    unpacker = _Unpacker(data)
+
+    try:
+        result = unpacker.unpack()
+    except RuntimeError:
+        # Nested too deeply to unpack recursively.
+        raise UnpackError("data nested too deeply")
+
+    if unpacker.offset != len(data):
+        raise UnpackError("extra data after the packed value")
+
+    return result
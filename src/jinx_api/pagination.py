@@ -0,0 +1,169 @@
+"""Pagination of API calls that return long lists.
+
+Calls marked with registry.paginated can return their results a page at a
+time.  A client asks for the first page by adding a page_size query parameter
+to the call's URL:
+
+    POST /jinx/2.0/get_hosts_in_state?page_size=1000
+
+Instead of the usual list, the response is a dict like this:
+
+    {"results":     ["sim1.agni.lindenlab.com", ...],
+     "next_cursor": "WyJnZXRfaG9zdHNfaW5fc3RhdGUiLCAic2ltMTAwMC5hZ25pIl0="}
+
+and the client gets the next page by sending the same call again with the
+cursor:
+
+    POST /jinx/2.0/get_hosts_in_state?page_size=1000&cursor=WyJnZXRf...
+
+until next_cursor is null.  Cursors are opaque to clients.  They hold the
+position of the last result returned (usually its sort key, so that pages
+stay consistent while data changes, and so that queries can start right
+there) and are only valid for the call that returned them.
+
+A paginated view reads the requested page with get_page_request(), and
+returns PageRequest.page() of the results, having fetched (at least) the
+size + 1 of them following the position, so that it's known whether there
+are more.  Views that can't fetch a page at a time can call paginate() on
+their complete list instead.
+"""
+
+import base64
+import simplejson
+from django.conf import settings
+from django.http import HttpResponseBadRequest
+
+
+class InvalidCursor(ValueError):
+    """A cursor couldn't be decoded, or belongs to a different call."""
+
+
+def encode_cursor(call_name, position):
+    return base64.urlsafe_b64encode(simplejson.dumps([call_name, position]))
+
+def decode_cursor(call_name, cursor, position_type=None):
+    """Return the position stored in a cursor.  Raises InvalidCursor.
+
+    Cursors aren't signed, so a client can put anything in one; if
+    position_type is given, a position that isn't of that type is invalid.
+    """
+
+    try:
+        cursor_call_name, position = simplejson.loads(base64.urlsafe_b64decode(str(cursor)))
+    except (TypeError, ValueError):
+        raise InvalidCursor("Invalid cursor: %s" % cursor)
+
+    if cursor_call_name != call_name:
+        raise InvalidCursor("The cursor is for %s, not %s." % (cursor_call_name, call_name))
+
+    if position_type is not None and not isinstance(position, position_type):
+        raise InvalidCursor("Invalid cursor position for %s: %s" % (call_name, str(position)))
+
+    return position
+
+
+class Page(object):
+    """One page of a call's results, and the position to continue from (None on the last page)."""
+
+    def __init__(self, items, next_position):
+        self.items = items
+        self.next_position = next_position
+
+
+class PageRequest(object):
+    """The page a client asked for.
+
+    Attributes:
+        size -- The maximum number of results to return.
+        position -- Where the previous page ended, as set by the view that
+            returned it, or None for the first page.
+    """
+
+    def __init__(self, size, position=None):
+        self.size = size
+        self.position = position
+
+    def page(self, items, key):
+        """Return the Page made of the first size of items.
+
+        items must start right after position and hold at least size + 1
+        results if there are more.  key(item) gives the position to continue
+        after item.
+        """
+
+        items = list(items[:self.size + 1])
+
+        if len(items) > self.size:
+            return Page(items[:self.size], key(items[self.size - 1]))
+
+        return Page(items, None)
+
+def get_page_request(request):
+    """Return the PageRequest for a request, or None if it isn't paginated."""
+
+    return getattr(request, 'jinx_page', None)
+
+def parse_page_request(request, call_name, position_type=None):
+    """Build the PageRequest asked for by a request's query parameters.
+
+    Returns None if the request doesn't ask for pagination.  Raises
+    ValueError (or InvalidCursor) if the parameters are invalid, including
+    a cursor whose position isn't of position_type.
+    """
+
+    if 'page_size' not in request.GET and 'cursor' not in request.GET:
+        return None
+
+    max_size = getattr(settings, 'JINX_MAX_PAGE_SIZE', 10000)
+
+    try:
+        size = int(request.GET.get('page_size', getattr(settings, 'JINX_DEFAULT_PAGE_SIZE', 1000)))
+    except ValueError:
+        raise ValueError("page_size must be an integer; got %s" % request.GET['page_size'])
+
+    if not 1 <= size <= max_size:
+        raise ValueError("page_size must be between 1 and %d; got %d" % (max_size, size))
+
+    position = None
+
+    if request.GET.get('cursor'):
+        position = decode_cursor(call_name, request.GET['cursor'], position_type)
+
+    return PageRequest(size, position)
+
+def paginate(request, items, key=None):
+    """Paginate a complete list of results, if the request asks for it.
+
+    With a key function, items are sorted by it, and pages are found by key
+    (so they stay consistent if items are added or removed).  Otherwise
+    pages are found by offset into items as given.
+
+    Returns items unchanged if the request isn't paginated, and a Page
+    otherwise.  Keys must be strings or numbers, which survive being stored
+    in a cursor.
+    """
+
+    page_request = get_page_request(request)
+
+    if page_request is None:
+        return items
+
+    if key is None:
+        start = page_request.position or 0
+
+        if not isinstance(start, (int, long)) or start < 0:
+            return HttpResponseBadRequest("Invalid cursor position: %s" % str(start))
+
+        end = start + page_request.size
+
+        if len(items) > end:
+            return Page(list(items[start:end]), end)
+
+        return Page(list(items[start:end]), None)
+
+    items = sorted(items, key=key)
+
+    if page_request.position is not None:
+        items = [item for item in items if key(item) > page_request.position]
+
+    return page_request.page(items, key)
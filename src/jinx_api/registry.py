@@ -0,0 +1,276 @@
+"""A registry of information about the API's view functions.
+
+Everything the middleware needs to know about a view -- its signature, how
+many arguments it accepts, and its documentation -- is worked out once and
+kept here, instead of being recomputed with the inspect module on every
+request.
+"""
+
+import inspect
+import sys
+import threading
+
+
+def trim_docstring(docstring):
+    """ Trim a docstring.
+    
+    Follows the rules of PEP 257:
+    
+    Strip a uniform amount of indentation from the second and further lines 
+    of the docstring, equal to the minimum indentation of all non-blank lines
+    after the first line. Any indentation in the first line of the docstring 
+    (i.e., up to the first newline) is insignificant and removed. Relative 
+    indentation of later lines in the docstring is retained. Blank lines should
+    be removed from the beginning and end of the docstring.
+    
+    This following code was taken directly from PEP 257.
+    """
+    if not docstring:
+        return ''
+    # Convert tabs to spaces (following the normal Python rules)
+    # and split into a list of lines:
+    lines = docstring.expandtabs().splitlines()
+    # Determine minimum indentation (first line doesn't count):
+    indent = sys.maxint
+    for line in lines[1:]:
+        stripped = line.lstrip()
+        if stripped:
+            indent = min(indent, len(line) - len(stripped))
+    # Remove indentation (first line is special):
+    trimmed = [lines[0].strip()]
+    if indent < sys.maxint:
+        for line in lines[1:]:
+            trimmed.append(line[indent:].rstrip())
+    # Strip off trailing and leading blank lines:
+    while trimmed and not trimmed[-1]:
+        trimmed.pop()
+    while trimmed and not trimmed[0]:
+        trimmed.pop(0)
+    # Return a single string:
+    return '\n'.join(trimmed)
+
+
+class ViewInfo(object):
+    """Information about a view function, computed once.
+
+    Attributes:
+        name -- The view's name.
+        view -- The view function.
+        arg_names -- The names of the view's arguments, not including the
+            request.
+        defaults -- A dict mapping argument names to their default values.
+        varargs -- True if the view accepts any number of extra arguments.
+        min_args -- The minimum number of arguments the view needs.
+        max_args -- The maximum number of arguments the view accepts, or None
+            if there's no limit.
+        signature -- A string like "view_name(arg1, arg2, arg3=default3, ...):"
+        doc -- The view's docstring, trimmed per PEP 257.
+        documentation -- The signature and docstring, as sent back for
+            documentation requests.
+        raw -- True if the view was marked with raw_view, and handles its
+            own requests and responses.
+        paginated -- True if the view was marked with paginated, and can
+            return its results a page at a time.
+        position_type -- The type of the positions in the view's cursors, as
+            given to paginated, or None if it isn't paginated.
+        query_budget -- The most SQL statements the view should run per
+            call, as set with query_budget, or None if it has no budget.
+    """
+
+    def __init__(self, view):
+        self.name = view.__name__
+        self.view = view
+        self.raw = getattr(view, 'jinx_raw_view', False)
+        self.paginated = getattr(view, 'jinx_paginated', False)
+        self.position_type = getattr(view, 'jinx_position_type', None)
+        self.query_budget = getattr(view, 'jinx_query_budget', None)
+
+        args, varargs, varkwargs, defaults = inspect.getargspec(view)
+
+        # Strip off the first parameter, which is the request object
+        args = args[1:]
+
+        # Defaults are kind of hairy.  inspect fills the defaults list in with
+        # the default values of the trailing arguments in the args list.
+        if defaults is None:
+            defaults = ()
+
+        self.arg_names = list(args)
+        self.defaults = dict(zip(args[len(args) - len(defaults):], defaults))
+        self.varargs = varargs is not None
+        self.min_args = len(args) - len(defaults)
+
+        if self.varargs:
+            self.max_args = None
+        else:
+            self.max_args = len(args)
+
+        # I want to print something like this:
+        #    view_name(arg1, arg2, arg3=default3, ...):
+        arg_list = []
+
+        for arg in args:
+            if arg in self.defaults:
+                arg_list.append("%s=%s" % (arg, self.defaults[arg]))
+            else:
+                arg_list.append(arg)
+
+        # Add a "..." if this function takes variable arguments
+        if self.varargs:
+            arg_list.append("...")
+
+        # Finish it off by separating the arguments with commas:
+        self.signature = "%s(%s):" % (self.name, ", ".join(arg_list))
+
+        self.doc = trim_docstring(view.__doc__)
+        self.documentation = self.signature + "\n" + self.doc
+
+        if self.paginated:
+            self.documentation += ("\n\nThe results can be returned a page at a time, by adding page_size and cursor "
+                                   "query parameters; see jinx_api/pagination.py.")
+
+    def check_arguments(self, args, kwargs):
+        """Check whether the view can be called with the given arguments.
+
+        Returns None if it can, or an error message like this if it can't:
+
+            the_function_name() takes exactly 4 arguments (3 given)
+
+        The request argument isn't counted.
+        """
+
+        for name in kwargs:
+            if name not in self.arg_names:
+                return "%s() got an unexpected keyword argument '%s'" % (self.name, name)
+
+        num_given = len(args) + len(kwargs)
+
+        if num_given >= self.min_args and (self.max_args is None or num_given <= self.max_args):
+            return None
+
+        if self.max_args is None:
+            description = "at least %d" % self.min_args
+            expected = self.min_args
+        elif self.min_args == self.max_args:
+            description = "exactly %d" % self.min_args
+            expected = self.min_args
+        elif num_given < self.min_args:
+            description = "at least %d" % self.min_args
+            expected = self.min_args
+        else:
+            description = "at most %d" % self.max_args
+            expected = self.max_args
+
+        if expected == 1:
+            plural = ""
+        else:
+            plural = "s"
+
+        return "%s() takes %s argument%s (%d given)" % (self.name, description, plural, num_given)
+
+
+def raw_view(view):
+    """Mark a view that isn't a JSON API call, e.g. one serving plain text.
+
+    The Jinx middleware passes requests for raw views straight through to the
+    view, without decoding arguments or encoding the result.
+    """
+
+    view.jinx_raw_view = True
+
+    return view
+
+
+def paginated(position_type):
+    """Mark a view whose results can be returned a page at a time.
+
+    position_type is the type (or tuple of types) of the positions the view
+    keeps in its cursors: basestring for hostnames and other sort keys,
+    (int, long) for offsets.  Cursors are made by clients, so one holding
+    anything else is rejected before the view is called.  See
+    jinx_api.pagination for what the view has to do.
+
+        @paginated(basestring)
+        def get_pdu_hostnames(request):
+            ...
+    """
+
+    def decorator(view):
+        view.jinx_paginated = True
+        view.jinx_position_type = position_type
+
+        return view
+
+    return decorator
+
+
+def query_budget(budget):
+    """Declare the most SQL statements a view should run per call.
+
+    The budget should hold no matter how much data there is, so it catches
+    views that query once per host.  See QueryBudgetMiddleware for what
+    happens when a call goes over its budget.
+
+        @query_budget(5)
+        def list_host_states(request):
+            ...
+    """
+
+    def decorator(view):
+        view.jinx_query_budget = budget
+
+        return view
+
+    return decorator
+
+
+# Maps view functions to their ViewInfo.
+_view_info = {}
+
+# Maps API call names to the ViewInfo of their view function.
+_calls = None
+
+_lock = threading.Lock()
+
+def get_view_info(view):
+    """Return the ViewInfo for a view function, computing it if necessary."""
+
+    info = _view_info.get(view)
+
+    if info is None:
+        info = ViewInfo(view)
+
+        _lock.acquire()
+        try:
+            _view_info[view] = info
+        finally:
+            _lock.release()
+
+    return info
+
+def build_registry():
+    """Compute the ViewInfo for every call in api_calls, if that hasn't been done yet.
+
+    This also imports all of the view modules.
+    """
+
+    global _calls
+
+    if _calls is not None:
+        return
+
+    from jinx_api.api.urls import api_calls
+
+    calls = {}
+
+    for pattern in api_calls:
+        calls[pattern.regex.pattern] = get_view_info(pattern.callback)
+
+    _calls = calls
+
+def get_calls():
+    """Return a dict mapping the name of each API call to the ViewInfo of its view."""
+
+    build_registry()
+
+    return _calls
@@ -0,0 +1,356 @@
+"""Pluggable encoding and decoding of API requests and responses.
+
+Encoding large responses is a noticeable part of the CPU time spent on many
+calls, and which JSON library is fastest depends on what's installed and on
+the Python version.  The middleware encodes and decodes through a codec
+chosen with the JINX_JSON_CODECS setting, a list of codec names in order of
+preference:
+
+JINX_JSON_CODECS = ('simplejson', 'json')
+
+A name is one of those in CODECS below, or the dotted path of a class with
+the same interface as Codec.  The first codec whose library is installed and
+has its C speedups is used.  If none has speedups, the first one that's
+installed is used.  benchmarks/serialization_bench.py compares them on
+typical Jinx responses.
+
+Clients may also use MessagePack, a binary format that's smaller and quicker
+to decode, by sending a Content-Type and/or Accept of application/x-msgpack.
+Its codec is chosen the same way with JINX_MSGPACK_CODECS; the built-in
+'mpack' codec (see jinx_api.mpack) always works, if slowly.
+"""
+
+import threading
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.importlib import import_module
+
+
+class CodecUnavailable(Exception):
+    """The library a codec needs isn't installed."""
+
+
+class DecodeError(ValueError):
+    """Data couldn't be decoded.  Raised by all codecs, whatever library they use."""
+
+
+class Codec(object):
+    """The interface of a codec.
+
+    Attributes:
+        name -- The codec's name, as used in JINX_JSON_CODECS.
+        media_type -- The MIME type of the data it produces.
+        accelerated -- True if the library is using its C speedups.
+    """
+
+    name = None
+    media_type = None
+    accelerated = False
+
+    def dumps(self, data):
+        """Encode data as a str.
+
+        Raises TypeError if data (or something in it) can't be encoded.
+        """
+
+        raise NotImplementedError
+
+    def loads(self, text):
+        """Decode a str.  Raises DecodeError if it isn't valid."""
+
+        raise NotImplementedError
+
+
+class JSONCodec(Codec):
+    """The base class of the JSON codecs."""
+
+    media_type = 'application/json'
+
+
+class SimplejsonCodec(JSONCodec):
+    name = 'simplejson'
+
+    def __init__(self):
+        try:
+            import simplejson
+        except ImportError:
+            raise CodecUnavailable("simplejson is not installed")
+
+        self._simplejson = simplejson
+        self._encoder = simplejson.JSONEncoder()
+        self._decoder = simplejson.JSONDecoder()
+
+        try:
+            import simplejson._speedups
+            self.accelerated = True
+        except ImportError:
+            self.accelerated = False
+
+    def dumps(self, data):
+        return self._encoder.encode(data)
+
+    def loads(self, text):
+        try:
+            return self._decoder.decode(text)
+        except ValueError, e:
+            raise DecodeError(str(e))
+
+
+class StdlibJSONCodec(JSONCodec):
+    """The json module that comes with Python 2.6 and later.
+
+    Python 2.7's has C speedups for both encoding and decoding; 2.6's only
+    decodes strings in C.
+    """
+
+    name = 'json'
+
+    def __init__(self):
+        try:
+            import json
+            import json.decoder
+            import json.encoder
+        except ImportError:
+            raise CodecUnavailable("the json module is not available")
+
+        self._encoder = json.JSONEncoder()
+        self._decoder = json.JSONDecoder()
+        self.accelerated = (getattr(json.encoder, 'c_make_encoder', None) is not None and
+                            getattr(json.decoder, 'c_scanstring', None) is not None)
+
+    def dumps(self, data):
+        return self._encoder.encode(data)
+
+    def loads(self, text):
+        try:
+            return self._decoder.decode(text)
+        except ValueError, e:
+            raise DecodeError(str(e))
+
+
+class UltraJSONCodec(JSONCodec):
+    """ujson, a JSON library written in C.
+
+    It's the fastest of these, but escapes some characters differently and
+    rounds floats to fewer digits, so it has to be chosen explicitly.
+    """
+
+    name = 'ujson'
+    accelerated = True
+
+    def __init__(self):
+        try:
+            import ujson
+        except ImportError:
+            raise CodecUnavailable("ujson is not installed")
+
+        self._ujson = ujson
+
+    def dumps(self, data):
+        try:
+            return self._ujson.dumps(data)
+        except (OverflowError, ValueError), e:
+            # ujson reports unencodable objects in several ways; make them
+            # look like everyone else's.
+            raise TypeError(str(e))
+
+    def loads(self, text):
+        try:
+            return self._ujson.loads(text)
+        except ValueError, e:
+            raise DecodeError(str(e))
+
+
+class MessagePackCodec(Codec):
+    """The msgpack library (msgpack-python)."""
+
+    name = 'msgpack'
+    media_type = 'application/x-msgpack'
+
+    def __init__(self):
+        try:
+            import msgpack
+        except ImportError:
+            raise CodecUnavailable("msgpack is not installed")
+
+        self._msgpack = msgpack
+        self.accelerated = msgpack.Packer.__module__ != 'msgpack.fallback'
+
+        # Pack str objects as text, like mpack does, and unpack text as
+        # unicode.  The options for that changed names between versions.
+        self._pack_options = {'use_bin_type': False}
+
+        try:
+            msgpack.packb(u'', **self._pack_options)
+        except TypeError:
+            self._pack_options = {}
+
+        self._unpack_options = {'raw': False}
+
+        try:
+            msgpack.unpackb(msgpack.packb(u''), **self._unpack_options)
+        except TypeError:
+            self._unpack_options = {'encoding': 'utf-8'}
+
+    def dumps(self, data):
+        try:
+            return self._msgpack.packb(data, **self._pack_options)
+        except (OverflowError, ValueError), e:
+            raise TypeError(str(e))
+
+    def loads(self, text):
+        try:
+            return self._msgpack.unpackb(text, **self._unpack_options)
+        except Exception, e:
+            # msgpack raises many different exceptions for bad data.
+            raise DecodeError(str(e))
+
+
+class PureMessagePackCodec(Codec):
+    """jinx_api.mpack, which is written in Python and always available."""
+
+    name = 'mpack'
+    media_type = 'application/x-msgpack'
+
+    def __init__(self):
+        from jinx_api import mpack
+
+        self._mpack = mpack
+
+    def dumps(self, data):
+        return self._mpack.packb(data)
+
+    def loads(self, text):
+        try:
+            return self._mpack.unpackb(text)
+        except self._mpack.UnpackError, e:
+            raise DecodeError(str(e))
+
+# Maps codec names to their classes.
+CODECS = {
+    'simplejson': SimplejsonCodec,
+    'json': StdlibJSONCodec,
+    'ujson': UltraJSONCodec,
+    'msgpack': MessagePackCodec,
+    'mpack': PureMessagePackCodec,
+}
+
+DEFAULT_CODECS = ('simplejson', 'json')
+DEFAULT_MSGPACK_CODECS = ('msgpack', 'mpack')
+
+JSON_MEDIA_TYPE = 'application/json'
+MSGPACK_MEDIA_TYPE = 'application/x-msgpack'
+
+# Maps the media types clients may use to (setting, default codec names).
+MEDIA_TYPES = {
+    JSON_MEDIA_TYPE: ('JINX_JSON_CODECS', DEFAULT_CODECS),
+    MSGPACK_MEDIA_TYPE: ('JINX_MSGPACK_CODECS', DEFAULT_MSGPACK_CODECS),
+    'application/msgpack': ('JINX_MSGPACK_CODECS', DEFAULT_MSGPACK_CODECS),
+}
+
+
+def load_codec(name):
+    """Create the codec with the given name or class path.
+
+    Raises CodecUnavailable if its library isn't installed, and
+    ImproperlyConfigured if there's no such codec.
+    """
+
+    if name in CODECS:
+        codec_class = CODECS[name]
+    else:
+        try:
+            module_name, class_name = name.rsplit('.', 1)
+            codec_class = getattr(import_module(module_name), class_name)
+        except (ValueError, ImportError, AttributeError), e:
+            raise ImproperlyConfigured('Error loading codec %s: "%s"' % (name, e))
+
+    return codec_class()
+
+def choose_codec(names):
+    """Return the preferred codec out of names, as described in the module docstring."""
+
+    installed = []
+
+    for name in names:
+        try:
+            codec = load_codec(name)
+        except CodecUnavailable:
+            continue
+
+        if codec.accelerated:
+            return codec
+
+        installed.append(codec)
+
+    if not installed:
+        raise ImproperlyConfigured('None of the JSON codecs %s is installed' % ', '.join(names))
+
+    return installed[0]
+
+# Maps setting names to (codec names, chosen codec).
+_codecs = {}
+_lock = threading.Lock()
+
+def _get_configured_codec(setting_name, default):
+    names = tuple(getattr(settings, setting_name, default))
+    chosen = _codecs.get(setting_name)
+
+    if chosen is None or chosen[0] != names:
+        _lock.acquire()
+        try:
+            chosen = (names, choose_codec(names))
+            _codecs[setting_name] = chosen
+        finally:
+            _lock.release()
+
+    return chosen[1]
+
+def get_codec():
+    """Return the JSON codec chosen by the JINX_JSON_CODECS setting."""
+
+    return _get_configured_codec(*MEDIA_TYPES[JSON_MEDIA_TYPE])
+
+def get_codec_for_media_type(media_type):
+    """Return the codec for a request's Content-Type, or None if it isn't supported.
+
+    Parameters like "; charset=utf-8" are ignored.
+    """
+
+    media_type = media_type.split(';', 1)[0].strip().lower()
+
+    if media_type not in MEDIA_TYPES:
+        return None
+
+    return _get_configured_codec(*MEDIA_TYPES[media_type])
+
+def negotiate_codec(accept):
+    """Return the codec to encode a response with, given the request's Accept header.
+
+    The supported media type with the highest quality is chosen; JSON wins
+    ties, and is used if the client accepts anything (or nothing) supported.
+    """
+
+    best_media_type = JSON_MEDIA_TYPE
+    best_quality = 0
+
+    for media_range in (accept or '').split(','):
+        parts = media_range.split(';')
+        media_type = parts[0].strip().lower()
+        quality = 1.0
+
+        for parameter in parts[1:]:
+            name, _, value = parameter.partition('=')
+
+            if name.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0
+
+        if media_type in MEDIA_TYPES and (quality > best_quality or
+                                          (quality == best_quality and media_type == JSON_MEDIA_TYPE)):
+            best_media_type = media_type
+            best_quality = quality
+
+    return get_codec_for_media_type(best_media_type)
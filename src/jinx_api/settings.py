@@ -81,6 +81,9 @@ MIDDLEWARE_CLASSES = (
 #    'django.middleware.csrf.CsrfViewMiddleware',
 #    'django.contrib.auth.middleware.AuthenticationMiddleware',
 #    'django.contrib.messages.middleware.MessageMiddleware',
+    'jinx_api.middleware.InstrumentationMiddleware',
+    'jinx_api.middleware.QueryBudgetMiddleware',
+    'jinx_api.middleware.CompressionMiddleware',
     'jinx_api.middleware.APIDocumentationMiddleware',
     'jinx_api.middleware.JinxAuthorizationMiddleware',
     'jinx_api.middleware.JSONMiddleware',
@@ -88,6 +91,131 @@ MIDDLEWARE_CLASSES = (
 
 ROOT_URLCONF = 'jinx_api.urls'
 
+# JSON libraries to encode and decode API calls with, in order of preference.
+# The first one that's installed with its C speedups is used; see
+# jinx_api/serialization.py, and benchmarks/serialization_bench.py to compare
+# them.
+JINX_JSON_CODECS = ('simplejson', 'json')
+
+# The same for clients that use MessagePack (Content-Type and/or Accept of
+# application/x-msgpack).  'mpack' is built in, so it's always available.
+JINX_MSGPACK_CODECS = ('msgpack', 'mpack')
+
+# Responses are compressed with gzip or deflate for clients that accept it,
+# unless they're smaller than JINX_COMPRESSION_MIN_SIZE bytes.
+# JINX_COMPRESSION_LEVEL trades CPU for size, from 1 (fastest) to 9 (smallest).
+JINX_COMPRESSION_MIN_SIZE = 1024
+JINX_COMPRESSION_LEVEL = 6
+
+# Allow any API request to be profiled by adding ?profile to its URL.  The
+# profile is sent back instead of the call's response; see
+# jinx_api.middleware.InstrumentationMiddleware.
+JINX_ALLOW_PROFILING = DEBUG
+
+# Power operations on many hosts (power_cycle_hosts etc.) run concurrently on
+# this many worker threads per server process.  At most JINX_POWER_PER_PDU_LIMIT
+# of them talk to the same PDU at once, and a host that hasn't finished
+# JINX_POWER_TIMEOUT seconds after the call started (queued or not) is reported
+# as timed out.
+JINX_POWER_WORKERS = 16
+JINX_POWER_PER_PDU_LIMIT = 4
+JINX_POWER_TIMEOUT = 30
+
+# Background jobs (e.g. power_cycle_async) run on this many worker threads per
+# server process.  Their status is kept in the job store for get_job_status()
+# and wait_for_jobs(); see jinx_api/jobs.py.  With several server processes,
+# use 'jinx_api.jobs.SqliteJobStore' with 'OPTIONS': {'path': ...} so that any
+# process can answer for any job.  wait_for_jobs() never waits longer than
+# JINX_JOB_MAX_WAIT seconds.  A job that hasn't finished JINX_JOB_TIMEOUT seconds
+# after it was submitted is reported as timed out (power jobs use
+# JINX_POWER_TIMEOUT instead).
+JINX_JOB_WORKERS = 8
+JINX_JOB_TIMEOUT = 300
+JINX_JOB_STORE = {
+    'BACKEND': 'jinx_api.jobs.MemoryJobStore',
+    'OPTIONS': {'max_jobs': 10000, 'retention': 3600},
+}
+JINX_JOB_MAX_WAIT = 60
+
+# set_host_state and add_host_state calls are recorded in a change log that
+# clients can follow with get_host_state_changes(); see jinx_api/changes.py.
+# With several server processes, use 'jinx_api.changes.SqliteChangeLog' with
+# 'OPTIONS': {'path': ...} so that every process sees every change.
+# get_host_state_changes() never waits longer than JINX_CHANGES_MAX_WAIT
+# seconds.
+JINX_CHANGE_LOG = {
+    'BACKEND': 'jinx_api.changes.MemoryChangeLog',
+    'OPTIONS': {'max_changes': 100000, 'retention': 86400},
+}
+JINX_CHANGES_MAX_WAIT = 60
+
+# The maximum number of API calls that may be batched into a single multicall.
+JINX_MULTICALL_LIMIT = 1000
+
+# get_hosts_by_regex searches an in-process copy of all hostnames.  It's
+# rebuilt whenever clusto's version number changes, and also when it's older
+# than this many seconds, to pick up any change the version number misses.
+JINX_HOSTNAME_INDEX_MAX_AGE = 60
+
+# Cache the results of read-only API calls that change rarely.  Calls that
+# change data throw away the cached results they affect; see jinx_api/cache.py.
+# The local memory backend keeps a separate cache in each server process, so
+# keep the TTLs short, or use 'jinx_api.cache.MemcachedBackend' with
+# 'OPTIONS': {'servers': ['127.0.0.1:11211']} to share one cache.
+JINX_RESULT_CACHE = {
+    'BACKEND': 'jinx_api.cache.LocalMemoryBackend',
+    'CALLS': {
+        'list_host_states': {'ttl': 30, 'max_entries': 1},
+        'get_server_class_info': {'ttl': 300, 'max_entries': 10000},
+        'get_rack_contents': {'ttl': 60, 'max_entries': 2000},
+        'get_racks_contents': {'ttl': 60, 'max_entries': 200},
+        'get_pdu_hostnames': {'ttl': 60, 'max_entries': 1},
+    },
+}
+
+# Calls that return long lists can return them a page at a time; see
+# jinx_api/pagination.py.  Pages hold JINX_DEFAULT_PAGE_SIZE results unless
+# the client asks for another size, up to JINX_MAX_PAGE_SIZE.
+JINX_DEFAULT_PAGE_SIZE = 1000
+JINX_MAX_PAGE_SIZE = 10000
+
+# Read-only calls that depend only on clusto's data.  Their responses carry
+# an ETag that changes whenever anything in clusto does, and clients polling
+# them with If-None-Match get a 304 Not Modified if nothing has changed.
+JINX_CONDITIONAL_CALLS = (
+    'get_rack_contents',
+    'get_racks_contents',
+    'get_server_hostnames_in_rack',
+    'get_host_state',
+    'get_hosts_state',
+    'get_hosts_in_state',
+    'list_host_states',
+    'get_server_class_info',
+    'get_pdu_hostnames',
+)
+
+# Check the user's LDAP groups before each API call; see
+# jinx_api/authorization.py for the options.  None allows every call.
+JINX_AUTHORIZATION = None
+
+# Before a server process takes its first request, load everything that
+# request would otherwise wait for, and fill the caches for these calls; see
+# jinx_api/warmup.py.  None turns this off.
+JINX_WARMUP = {
+    'HOSTNAME_INDEX': True,
+    'CALLS': [('list_host_states', []), ('get_pdu_hostnames', [])],
+    'USER': None,
+}
+
+# Watch for API calls that run more SQL statements than they should; see
+# QueryBudgetMiddleware in jinx_api/middleware.py.  Set to None to turn the
+# checks off.
+JINX_QUERY_BUDGET = {
+    'ACTION': 'warn',
+    'REPEAT_THRESHOLD': 50,
+    'BUDGETS': {},
+}
+
 TEMPLATE_DIRS = (
     # Put strings here, like "/home/html/django_templates" or "C:/www/django/templates".
     # Always use forward slashes, even on Windows.
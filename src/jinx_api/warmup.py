@@ -0,0 +1,171 @@
+"""Get a server process ready for requests before it's sent any.
+
+Left alone, the first request a new process handles pays for loading the
+middleware, importing every view module (and llclusto's drivers with them),
+compiling the URL patterns, connecting to the database and building the
+hostname index, which adds up to seconds.  lldjango.wsgi calls warm_up() as
+soon as it has made the WSGI application, so all of that happens before the
+process starts accepting connections.  It's configured by the JINX_WARMUP
+setting:
+
+JINX_WARMUP = {
+    # Build the in-process hostname index used by get_hosts_by_regex.
+    'HOSTNAME_INDEX': True,
+
+    # API calls to send through the application, as (name, arguments), to
+    # fill the result cache with data that's wanted right after a restart.
+    'CALLS': [('list_host_states', []), ('get_pdu_hostnames', [])],
+
+    # With authorization turned on, the user to make those calls as.
+    'USER': None,
+}
+
+None turns warming up off.  A step that fails is logged to the
+jinx_api.warmup logger, and the rest still run; a process that starts slowly
+is better than one that doesn't start.
+"""
+
+import logging
+import simplejson
+import StringIO
+import sys
+import time
+import clusto
+from django.conf import settings
+from django.core.urlresolvers import Resolver404, get_resolver
+from jinx_api import metrics
+from jinx_api.api.hostindex import hostname_index
+from jinx_api.registry import build_registry, get_calls
+
+logger = logging.getLogger('jinx_api.warmup')
+
+# The protocol version to resolve and make calls with.
+WARMUP_VERSION = '2.0'
+
+
+def load_middleware(application):
+    """Load the application's middleware, as its first request would."""
+
+    if application._request_middleware is not None:
+        return
+
+    application.initLock.acquire()
+    try:
+        if application._request_middleware is None:
+            application.load_middleware()
+    finally:
+        application.initLock.release()
+
+def resolve_calls():
+    """Resolve every API call's URL, importing its view.
+
+    Returns a list of problems, e.g. a call whose URL doesn't resolve.
+    """
+
+    resolver = get_resolver(None)
+    problems = []
+
+    for call_name in sorted(get_calls()):
+        try:
+            resolver.resolve('/jinx/%s/%s' % (WARMUP_VERSION, call_name))
+        except Resolver404:
+            problems.append("/jinx/%s/%s doesn't reach any view" % (WARMUP_VERSION, call_name))
+
+    return problems
+
+def check_database():
+    """Connect to clusto's database and make sure it answers."""
+
+    metrics.instrument_engine(clusto.SESSION.bind)
+    clusto.get_latest_version_number()
+
+    return True
+
+def make_call(application, call_name, args, user=None):
+    """Send an API call through the WSGI application, returning its status line."""
+
+    body = simplejson.dumps(args)
+    environ = {
+        'REQUEST_METHOD': 'POST',
+        'SCRIPT_NAME': '',
+        'PATH_INFO': '/jinx/%s/%s' % (WARMUP_VERSION, call_name),
+        'QUERY_STRING': '',
+        'CONTENT_TYPE': 'application/json',
+        'CONTENT_LENGTH': str(len(body)),
+        'SERVER_NAME': 'localhost',
+        'SERVER_PORT': '80',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': StringIO.StringIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+
+    if user is not None:
+        environ['REMOTE_USER'] = user
+
+    status = []
+
+    def start_response(status_line, headers, exc_info=None):
+        status.append(status_line)
+
+    response = application(environ, start_response)
+
+    # Streamed responses only do their work as they're read.
+    try:
+        for chunk in response:
+            pass
+    finally:
+        if hasattr(response, 'close'):
+            response.close()
+
+    return status[0]
+
+def warm_up(application):
+    """Do the work of the application's first requests now.
+
+    Returns a list of the problems found, which are also logged.
+    """
+
+    config = getattr(settings, 'JINX_WARMUP', None)
+
+    if config is None:
+        return []
+
+    started_at = time.time()
+    problems = []
+
+    def step(description, function, *args):
+        try:
+            return function(*args)
+        except Exception, e:
+            logger.exception("warmup: couldn't %s", description)
+            problems.append("couldn't %s: %s" % (description, e))
+
+    step("load the middleware", load_middleware, application)
+    step("import the views", build_registry)
+
+    for problem in step("resolve the API calls", resolve_calls) or []:
+        logger.error("warmup: %s", problem)
+        problems.append(problem)
+
+    if not step("connect to the database", check_database):
+        # Everything else needs the database.
+        return problems
+
+    if config.get('HOSTNAME_INDEX', True):
+        step("build the hostname index", hostname_index.refresh)
+
+    for call_name, args in config.get('CALLS', ()):
+        status = step("call %s" % call_name, make_call, application, call_name, args, config.get('USER'))
+
+        if status is not None and not status.startswith('200'):
+            logger.error("warmup: %s returned %s", call_name, status)
+            problems.append("%s returned %s" % (call_name, status))
+
+    logger.info("warmup: ready in %.2f seconds", time.time() - started_at)
+
+    return problems
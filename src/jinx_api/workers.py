@@ -0,0 +1,180 @@
+"""A small thread pool for running slow operations outside the request thread."""
+
+import Queue
+import sys
+import threading
+import time
+
+
+class Task(object):
+    """A function call queued on a WorkerPool.
+
+    Once the task is done, either result holds the function's return value or
+    exc_info holds the sys.exc_info() tuple of the exception it raised.  A
+    task cancelled before it started is done without ever running; its
+    cancelled attribute is True.
+    """
+
+    def __init__(self, function, args, kwargs):
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+
+        self.started_at = None
+        self.finished_at = None
+        self.cancelled = False
+        self.result = None
+        self.exc_info = None
+
+        # The thread running the task, once it's started.
+        self.thread = None
+
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def done(self):
+        return self._done.isSet()
+
+    def run(self):
+        self._lock.acquire()
+        try:
+            if self.cancelled:
+                return
+
+            self.started_at = time.time()
+            self.thread = threading.currentThread()
+        finally:
+            self._lock.release()
+
+        try:
+            self.result = self.function(*self.args, **self.kwargs)
+        except:
+            self.exc_info = sys.exc_info()
+
+        self.finished_at = time.time()
+        self._done.set()
+
+    def cancel(self):
+        """Keep the task from running, if it hasn't started yet.  Returns True if it hadn't."""
+
+        self._lock.acquire()
+        try:
+            if self.started_at is not None:
+                return False
+
+            self.cancelled = True
+            self._done.set()
+
+            return True
+        finally:
+            self._lock.release()
+
+    def wait(self, timeout=None):
+        """Wait for the task to finish.  Returns True if it did."""
+
+        self._done.wait(timeout)
+
+        return self.done
+
+
+class WorkerPool(object):
+    """Run tasks on a fixed number of background threads.
+
+    Threads are started the first time a task is submitted.  They're daemon
+    threads, so they won't keep the process alive on shutdown.
+
+    A thread stuck in a task that will never finish (e.g. one waiting on a
+    hung BMC) can't be stopped, but abandon() gives up on it: a new thread
+    takes its place, and it exits once its task does return.  At most
+    max_abandoned threads are left running like that, so something that hangs
+    for good can't make the pool start threads without end.
+    """
+
+    def __init__(self, num_workers, name='jinx-worker', max_abandoned=None):
+        self.num_workers = num_workers
+        self.name = name
+
+        if max_abandoned is None:
+            max_abandoned = num_workers
+
+        self.max_abandoned = max_abandoned
+
+        self._queue = Queue.Queue()
+        self._threads = []
+        self._abandoned = set()
+        self._thread_count = 0
+        self._lock = threading.Lock()
+
+    def _start_threads(self):
+        self._lock.acquire()
+        try:
+            while len(self._threads) < self.num_workers:
+                thread = threading.Thread(target=self._work, name='%s-%d' % (self.name, self._thread_count))
+                thread.setDaemon(True)
+                self._thread_count += 1
+                self._threads.append(thread)
+                thread.start()
+        finally:
+            self._lock.release()
+
+    def _work(self):
+        thread = threading.currentThread()
+
+        while True:
+            task = self._queue.get()
+            task.run()
+
+            if thread in self._abandoned:
+                self._lock.acquire()
+                try:
+                    self._abandoned.discard(thread)
+                finally:
+                    self._lock.release()
+
+                return
+
+    def submit(self, function, *args, **kwargs):
+        """Queue function(*args, **kwargs) to run on a worker thread and return its Task."""
+
+        if len(self._threads) < self.num_workers:
+            self._start_threads()
+
+        task = Task(function, args, kwargs)
+        self._queue.put(task)
+
+        return task
+
+    def abandon(self, task):
+        """Give up on a task: cancel it if it hasn't started, else replace the thread running it.
+
+        Returns True if the task was cancelled before it started, and False
+        if it had already started (or finished).
+        """
+
+        if task.cancel():
+            return True
+
+        if task.done:
+            return False
+
+        self._lock.acquire()
+        try:
+            thread = task.thread
+
+            if thread not in self._threads or len(self._abandoned) >= self.max_abandoned:
+                return False
+
+            self._threads.remove(thread)
+            self._abandoned.add(thread)
+        finally:
+            self._lock.release()
+
+        self._start_threads()
+
+        return False
+
+    def pending(self):
+        """Return the number of tasks waiting for a free worker thread."""
+
+        return self._queue.qsize()